@@ -0,0 +1,127 @@
+"""
+Microbenchmarks for the pure CPU paths that run per task per request:
+calculate_priority_score, get_energy_task_filter, generate_rule_based_schedule,
+calculate_available_hours and the is_overdue due-date parsing GET /tasks does
+(prepare_task_response).
+
+Inputs are sized like real accounts, from hundreds to tens of thousands of
+tasks with a mix of due date formats, and a calendar busy with short meetings.
+The file is named bench_* so the regular test run skips it; run it explicitly
+from backend/ with pytest-benchmark. Results are saved under benchmarks/history/
+and later runs compare against the last saved one:
+
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-storage=benchmarks/history --benchmark-autosave
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-storage=benchmarks/history \\
+        --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# server.py reads these at import time; no connection is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "studysmart_bench")
+
+from server import (  # noqa: E402
+    ScheduleGenerateRequest, calculate_available_hours, calculate_priority_score,
+    generate_rule_based_schedule, get_energy_task_filter, prepare_task_response
+)
+
+TASK_COUNTS = [200, 2_000, 20_000]
+PLANNER_TASK_COUNTS = [20, 200, 2_000]  # what one day's planning pass sees
+NOW = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+DATE = "2026-03-02"
+
+
+def make_tasks(n: int, seed: int = 7) -> list:
+    """Task documents with the due date formats found in the database"""
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(n):
+        due = NOW + timedelta(days=rng.randint(-5, 20), hours=rng.randint(0, 23))
+        due_date = rng.choice([
+            due.strftime("%Y-%m-%d"),
+            due.strftime("%d-%m-%Y"),  # the frontend's format
+            due.isoformat(),
+            due.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            None
+        ])
+        tasks.append({
+            "task_id": f"task_{i:06d}",
+            "title": f"Task {i}",
+            "priority": rng.choice(["low", "medium", "high"]),
+            "status": rng.choice(["pending", "pending", "in-progress", "completed"]),
+            "due_date": due_date,
+            "estimated_time": rng.choice([None, 15, 25, 30, 45, 60, 90, 120]),
+            # roughly one task in ten waits on an earlier one
+            "depends_on": [f"task_{rng.randrange(i):06d}"] if i and rng.random() < 0.1 else [],
+            "priority_score": float(rng.choice([1, 2, 3, 4, 6, 9]))
+        })
+    return tasks
+
+
+def make_events(count: int, seed: int = 11) -> list:
+    """A calendar of short meetings between 08:00 and 22:00, some of them free"""
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        start = rng.randrange(8 * 60, 22 * 60, 15)
+        end = min(start + rng.choice([15, 30, 45, 60]), 23 * 60 + 59)
+        events.append({
+            "id": f"event_{i}",
+            "summary": f"Meeting {i}",
+            "start": {"dateTime": f"{DATE}T{start // 60:02d}:{start % 60:02d}:00Z"},
+            "end": {"dateTime": f"{DATE}T{end // 60:02d}:{end % 60:02d}:00Z"},
+            "transparency": "transparent" if rng.random() < 0.1 else "opaque"
+        })
+    return events
+
+
+@pytest.mark.parametrize("n", TASK_COUNTS)
+def test_calculate_priority_score(benchmark, n):
+    tasks = make_tasks(n)
+    scores = benchmark(lambda: [calculate_priority_score(t, NOW) for t in tasks])
+    assert len(scores) == n and all(1 <= s <= 9 for s in scores)
+
+
+@pytest.mark.parametrize("n", TASK_COUNTS)
+def test_get_energy_task_filter(benchmark, n):
+    tasks = make_tasks(n)
+    levels = ["low", "medium", "high"]
+    kept = benchmark(lambda: [
+        sum(get_energy_task_filter(level, t["priority"]) for t in tasks) for level in levels
+    ])
+    assert kept[0] <= kept[1] <= kept[2] == n
+
+
+@pytest.mark.parametrize("n", TASK_COUNTS)
+def test_is_overdue_parsing(benchmark, n):
+    tasks = make_tasks(n)
+    # prepare_task_response mutates, so each round gets fresh copies
+    result = benchmark.pedantic(
+        lambda docs: [prepare_task_response(t, NOW) for t in docs],
+        setup=lambda: (([dict(t) for t in tasks],), {}),
+        rounds=20
+    )
+    assert any(t["is_overdue"] for t in result)
+
+
+@pytest.mark.parametrize("events", [0, 12, 60])
+@pytest.mark.parametrize("n", PLANNER_TASK_COUNTS)
+def test_generate_rule_based_schedule(benchmark, n, events):
+    tasks = [t for t in make_tasks(n) if t["status"] != "completed"]
+    calendar = make_events(events)
+    request = ScheduleGenerateRequest(date=DATE, available_start="07:00", available_end="23:00")
+    result = benchmark(generate_rule_based_schedule, tasks, request, calendar)
+    assert result["schedule"]
+
+
+def test_calculate_available_hours(benchmark):
+    windows = [(f"{h:02d}:{m:02d}", f"{h + 8:02d}:{m:02d}") for h in range(0, 16) for m in (0, 15, 30, 45)]
+    hours = benchmark(lambda: [calculate_available_hours(start, end) for start, end in windows])
+    assert all(h == 8 for h in hours)
@@ -0,0 +1,116 @@
+"""
+Per-request CPU for rendering a 1,000-task GET /tasks response.
+
+- before: Task(**t) per document, then FastAPI validates and serializes the
+  list again for response_model=List[Task] and renders it with JSONResponse
+- after: slim records rendered once with ORJSONResponse (list_response)
+
+Only the response path is timed; the Mongo query is the same for both.
+
+Run from backend/:  python benchmarks/bench_list_serialization.py [--tasks 1000] [--rounds 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# server.py reads these at import time; no connection is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "studysmart_bench")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from server import Task, list_response, prepare_task_response  # noqa: E402
+
+
+def make_tasks(n: int) -> list:
+    """Task documents as Motor returns them (dates as aware datetimes)"""
+    now = datetime.now(timezone.utc)
+    tasks = []
+    for i in range(n):
+        completed = i % 3 == 0
+        tasks.append({
+            "task_id": f"task_{uuid.uuid4().hex[:12]}",
+            "user_id": "user_bench",
+            "title": f"Task {i}",
+            "description": "Read chapter and summarise the key points " * 2,
+            "subject": ["Math", "Physics", "History"][i % 3],
+            "priority": ["low", "medium", "high"][i % 3],
+            "status": "completed" if completed else "pending",
+            "due_date": (now + timedelta(days=i % 14 - 3)).strftime("%Y-%m-%d"),
+            "estimated_time": 30 + i % 90,
+            "depends_on": [],
+            "scheduled_time": None,
+            "completed_at": now - timedelta(hours=i) if completed else None,
+            "created_at": (now - timedelta(days=i % 30)).isoformat(),
+            "linked_goal_id": None,
+            "tags": ["exam", "reading"],
+            "status_history": [{"status": "pending", "timestamp": now.isoformat(), "note": "Task created"}],
+            "actual_time": None,
+            "priority_score": 2.5,
+            "score_refresh_at": None,
+            "due_at": now,
+            "blocked": False,
+            "topo_rank": 0
+        })
+    return tasks
+
+
+RESPONSE_FIELD = create_response_field(name="Response_get_tasks", type_=List[Task])
+
+
+async def before(tasks: list) -> bytes:
+    now = datetime.now(timezone.utc)
+    models = [Task(**prepare_task_response(dict(t), now)) for t in tasks]
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=models, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def after(tasks: list) -> bytes:
+    now = datetime.now(timezone.utc)
+    return list_response(Task, [prepare_task_response(dict(t), now) for t in tasks]).body
+
+
+def measure(render, tasks: list, rounds: int) -> float:
+    """Mean CPU milliseconds per request"""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(render(tasks))  # warm-up
+        start = time.process_time()
+        for _ in range(rounds):
+            loop.run_until_complete(render(tasks))
+        return (time.process_time() - start) / rounds * 1000
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+    old_body = asyncio.run(before(tasks))
+    new_body = asyncio.run(after(tasks))
+    assert json.loads(old_body) == json.loads(new_body), "both paths must render the same JSON"
+
+    old_ms = measure(before, tasks, args.rounds)
+    new_ms = measure(after, tasks, args.rounds)
+    print(f"{args.tasks} tasks, {args.rounds} rounds, {len(new_body) / 1024:.0f} KiB per response")
+    print(f"  before (Task models + response_model + JSONResponse): {old_ms:8.2f} ms CPU/request")
+    print(f"  after  (slim records + ORJSONResponse):               {new_ms:8.2f} ms CPU/request")
+    print(f"  speedup: {old_ms / new_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Synthetic data for the load-test suite.
+
+Fills a local Mongo database with users, tasks, pomodoro sessions (with their
+focus rollups), goals, study groups, memberships and chat history. Documents
+are built with the server's own helpers where one exists (build_task_doc,
+focus_rollup_update), so they look like what the API writes. Generation is
+deterministic for a given --seed and streams in batches, so the large preset
+(100k users, 10M tasks, 5M sessions) runs in bounded memory.
+
+Run from backend/ against a local mongod:
+
+    python benchmarks/datagen.py --preset small --reset
+    python benchmarks/datagen.py --preset large --reset   # 100k users, 10M tasks, 5M sessions
+
+MONGO_URL and DB_NAME default to mongodb://localhost:27017 and studysmart_bench.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "studysmart_bench")
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+
+from pymongo import MongoClient  # noqa: E402
+
+from server import TaskCreate, build_task_doc, focus_rollup_update, get_month_start, get_week_start  # noqa: E402
+
+PRESETS = {
+    #          users, tasks/user, sessions/user, goals/user, groups, messages/group
+    "tiny": (200, 20, 10, 2, 10, 50),
+    "small": (2_000, 50, 25, 3, 100, 200),
+    "medium": (20_000, 100, 50, 3, 800, 500),
+    "large": (100_000, 100, 50, 3, 4_000, 1_000),
+}
+
+USER_PREFIX = "bench_user_"
+GROUP_PREFIX = "bench_group_"
+SUBJECTS = ["Math", "Physics", "Chemistry", "Biology", "History", "Literature", "CS", ""]
+PRIORITIES = ["low", "medium", "high"]
+HISTORY_DAYS = 30
+BATCH = 10_000
+
+
+def user_id(i: int) -> str:
+    return f"{USER_PREFIX}{i:06d}"
+
+
+def group_id(g: int) -> str:
+    return f"{GROUP_PREFIX}{g:05d}"
+
+
+class BatchWriter:
+    """insert_many in fixed-size batches per collection"""
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+        self.written = {}
+
+    def add(self, collection: str, doc: dict):
+        docs = self.pending.setdefault(collection, [])
+        docs.append(doc)
+        if len(docs) >= BATCH:
+            self.flush(collection)
+
+    def flush(self, collection: str = None):
+        for name in [collection] if collection else list(self.pending):
+            docs = self.pending.pop(name, [])
+            if docs:
+                self.db[name].insert_many(docs, ordered=False)
+                self.written[name] = self.written.get(name, 0) + len(docs)
+
+
+def apply_inc(doc: dict, inc: dict):
+    """Apply a {$inc} with dotted paths to a plain dict"""
+    for path, amount in inc.items():
+        *parents, leaf = path.split(".")
+        target = doc
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = target.get(leaf, 0) + amount
+
+
+def generate_user(rng: random.Random, i: int, now: datetime, sizes: tuple, writer: BatchWriter, group_count: int):
+    _, tasks_per_user, sessions_per_user, goals_per_user, _, _ = sizes
+    uid = user_id(i)
+    writer.add("users", {
+        "user_id": uid,
+        "email": f"{uid}@bench.local",
+        "name": f"Bench User {i}",
+        "password_hash": None,  # benchmark users authenticate with minted JWTs
+        "picture": None,
+        "total_xp": rng.randint(0, 20_000),
+        "weekly_xp": rng.randint(0, 2_000),
+        "monthly_xp": rng.randint(0, 6_000),
+        "current_streak": rng.randint(0, 30),
+        "current_week": get_week_start().isoformat(),
+        "current_month": get_month_start().isoformat(),
+        "study_group_id": group_id(i % group_count) if group_count else None,
+        "badges": [],
+        "created_at": (now - timedelta(days=rng.randint(30, 400))).isoformat()
+    })
+
+    task_ids, subjects = [], {}
+    for t in range(tasks_per_user):
+        created = now - timedelta(days=rng.random() * HISTORY_DAYS)
+        due = created + timedelta(days=rng.randint(-2, 14))
+        doc = build_task_doc(TaskCreate(
+            title=f"Task {t} for {uid}",
+            description="Work through the exercises and summarise",
+            subject=rng.choice(SUBJECTS),
+            priority=rng.choice(PRIORITIES),
+            due_date=due.strftime("%Y-%m-%d") if rng.random() < 0.8 else None,
+            estimated_time=rng.choice([15, 25, 30, 45, 60, 90]),
+            tags=rng.sample(["exam", "reading", "homework", "project", "review"], 2)
+        ), uid, created.isoformat())
+        if rng.random() < 0.55:
+            completed_at = min(created + timedelta(hours=rng.randint(1, 96)), now)
+            doc.update(status="completed", completed_at=completed_at)
+        elif rng.random() < 0.2:
+            doc["status"] = "in-progress"
+        task_ids.append(doc["task_id"])
+        subjects[doc["task_id"]] = doc["subject"] or None
+        writer.add("tasks", doc)
+
+    rollups = {}
+    for _ in range(sessions_per_user):
+        started = now - timedelta(days=rng.random() * HISTORY_DAYS)
+        focus = rng.choice([25, 25, 25, 50, 45])
+        session = {
+            "session_id": f"session_{uuid.uuid4().hex[:12]}",
+            "user_id": uid,
+            "task_id": rng.choice(task_ids) if task_ids and rng.random() < 0.7 else None,
+            "focus_duration": focus,
+            "break_duration": 5,
+            "completed": True,
+            "started_at": started,
+            "completed_at": started + timedelta(minutes=focus),
+            "rolled_up": True
+        }
+        writer.add("pomodoro_sessions", session)
+        query, update = focus_rollup_update(session, subjects.get(session["task_id"]))
+        apply_inc(rollups.setdefault(query["day"], dict(query)), update["$inc"])
+    for rollup in rollups.values():
+        writer.add("focus_daily", rollup)
+
+    for g in range(goals_per_user):
+        targets = rng.sample(task_ids, min(len(task_ids), 5))
+        writer.add("goals", {
+            "goal_id": f"goal_{uuid.uuid4().hex[:12]}",
+            "user_id": uid,
+            "title": f"Goal {g}",
+            "description": "",
+            "target_tasks": targets,
+            "week_start": get_week_start().strftime("%Y-%m-%d"),
+            "progress": 0.0,
+            "completed": False,
+            "streak": 0,
+            "subtasks": [],
+            "progress_logs": [],
+            "category": "academic",
+            "milestones": [],
+            "xp_reward": 100,
+            "deadline": None,
+            "xp_earned": 0,
+            "created_at": (now - timedelta(days=rng.randint(0, HISTORY_DAYS))).isoformat()
+        })
+
+
+def generate_groups(rng: random.Random, now: datetime, sizes: tuple, writer: BatchWriter):
+    users, _, _, _, group_count, messages_per_group = sizes
+    members = {g: [] for g in range(group_count)}
+    for i in range(users):
+        # Everyone is in their primary group; some join one or two more
+        for g in {i % group_count, *rng.sample(range(group_count), rng.choice([0, 0, 1, 2]))}:
+            members[g].append(i)
+
+    for g, user_indexes in members.items():
+        gid = group_id(g)
+        created = (now - timedelta(days=HISTORY_DAYS + 1)).isoformat()
+        owner = user_indexes[0] if user_indexes else 0
+        writer.add("study_groups", {
+            "group_id": gid,
+            "name": f"Study Group {g}",
+            "description": "",
+            "owner_id": user_id(owner),
+            "is_public": True,
+            "total_xp": rng.randint(0, 200_000),
+            "weekly_xp": rng.randint(0, 20_000),
+            "created_at": created
+        })
+        for i in user_indexes:
+            writer.add("group_memberships", {
+                "membership_id": f"mem_{uuid.uuid4().hex[:12]}",
+                "user_id": user_id(i),
+                "group_id": gid,
+                "role": "owner" if i == owner else "member",
+                "joined_at": created,
+                "is_active": True,
+                "last_read_at": (now - timedelta(days=rng.random() * 3)).isoformat()
+            })
+        for m in range(messages_per_group if user_indexes else 0):
+            sender = rng.choice(user_indexes)
+            writer.add("group_messages", {
+                "message_id": f"msg_{uuid.uuid4().hex[:12]}",
+                "group_id": gid,
+                "user_id": user_id(sender),
+                "user_name": f"Bench User {sender}",
+                "user_picture": None,
+                "content": f"Message {m} in group {g}",
+                "message_type": "text",
+                "created_at": (now - timedelta(minutes=(messages_per_group - m) * 7)).isoformat()
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument("--users", type=int, help="override the preset's user count")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop the benchmark database first")
+    args = parser.parse_args()
+
+    sizes = PRESETS[args.preset]
+    if args.users:
+        sizes = (args.users, *sizes[1:])
+    users, group_count = sizes[0], min(sizes[4], sizes[0])
+    sizes = (users, *sizes[1:4], group_count, sizes[5])
+
+    client = MongoClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ["DB_NAME"]]
+    if args.reset:
+        client.drop_database(os.environ["DB_NAME"])
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    writer = BatchWriter(db)
+    start = time.perf_counter()
+
+    generate_groups(rng, now, sizes, writer)
+    for i in range(users):
+        generate_user(rng, i, now, sizes, writer, group_count)
+        if (i + 1) % 5_000 == 0:
+            print(f"  {i + 1}/{users} users ({time.perf_counter() - start:.0f}s)")
+    writer.flush()
+
+    print(f"Generated into {os.environ['DB_NAME']} in {time.perf_counter() - start:.0f}s:")
+    for name, count in sorted(writer.written.items()):
+        print(f"  {name:20s} {count:>12,}")
+    print("Indexes are created when the app starts (benchmarks/loadtest.py does this).")
+
+
+if __name__ == "__main__":
+    main()
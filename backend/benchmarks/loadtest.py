@@ -0,0 +1,250 @@
+"""
+In-process load test: scripted user journeys against the FastAPI app and a local mongod.
+
+The app runs in this process behind httpx's ASGI transport (lifespan
+included, so indexes exist first; schema migrations run in the background,
+so load a migrated database for stable numbers). Virtual users are sampled from
+the data benchmarks/datagen.py generated, authenticate with minted JWTs and
+loop over weighted journeys:
+
+    dashboard      auth/me, tasks, goals, overview, pomodoro stats, my groups, burnout check
+    complete_task  create a task, complete it, run a pomodoro
+    chat           my groups, post a message, read messages
+    leaderboard    student and group leaderboards
+    planner        generate today's plan and read it back
+
+Per step it reports p50/p95/p99 latency and errors, plus overall throughput
+and Mongo commands per request (from the /metrics command listener).
+Baselines are saved as JSON under benchmarks/baselines/ and a later run can
+be compared against one; the exit code is 1 when p95 latency or queries per
+request regress past --tolerance.
+
+    python benchmarks/datagen.py --preset small --reset
+    python benchmarks/loadtest.py --users 50 --duration 60 --save-baseline main
+    python benchmarks/loadtest.py --users 50 --duration 60 --compare main
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "studysmart_bench")
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+os.environ.setdefault("RATE_LIMIT_STORE", "off")  # measure the app, not its quotas
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from metrics import MONGO_COMMANDS_PER_REQUEST  # noqa: E402
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+JOURNEY_WEIGHTS = {"dashboard": 5, "complete_task": 3, "chat": 3, "leaderboard": 2, "planner": 1}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}  # step -> [seconds]
+        self.errors = {}  # step -> count
+        self.requests = 0
+
+    async def call(self, http: httpx.AsyncClient, step: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        self.latencies.setdefault(step, []).append(time.perf_counter() - start)
+        self.requests += 1
+        if failed:
+            self.errors[step] = self.errors.get(step, 0) + 1
+            return None
+        return response.json() if response.content else None
+
+
+async def dashboard(http, rec, today):
+    await rec.call(http, "GET /auth/me", "GET", "/api/auth/me")
+    await rec.call(http, "GET /tasks", "GET", "/api/tasks")
+    await rec.call(http, "GET /goals", "GET", "/api/goals")
+    await rec.call(http, "GET /analytics/overview", "GET", "/api/analytics/overview")
+    await rec.call(http, "GET /pomodoro/stats", "GET", "/api/pomodoro/stats")
+    await rec.call(http, "GET /groups/my/all", "GET", "/api/groups/my/all")
+    await rec.call(http, "POST /ai/burnout-check", "POST", "/api/ai/burnout-check")
+
+
+async def complete_task(http, rec, today):
+    task = await rec.call(http, "POST /tasks", "POST", "/api/tasks", json={
+        "title": "Load test task", "priority": random.choice(["low", "medium", "high"]), "due_date": today
+    })
+    if task:
+        await rec.call(http, "PUT /tasks/{id} (complete)", "PUT", f"/api/tasks/{task['task_id']}", json={"status": "completed"})
+    session = await rec.call(http, "POST /pomodoro/start", "POST", "/api/pomodoro/start", json={"focus_duration": 25})
+    if session:
+        await rec.call(http, "POST /pomodoro/{id}/complete", "POST", f"/api/pomodoro/{session['session_id']}/complete")
+
+
+async def chat(http, rec, today):
+    groups = await rec.call(http, "GET /groups/my/all", "GET", "/api/groups/my/all")
+    if not groups:
+        return
+    group_id = random.choice(groups)["group_id"]
+    await rec.call(http, "POST /groups/{id}/messages", "POST", f"/api/groups/{group_id}/messages", json={"content": "Anyone up for a session?"})
+    await rec.call(http, "GET /groups/{id}/messages", "GET", f"/api/groups/{group_id}/messages", params={"limit": 50})
+
+
+async def leaderboard(http, rec, today):
+    await rec.call(http, "GET /leaderboard", "GET", "/api/leaderboard", params={"period": "weekly"})
+    await rec.call(http, "GET /leaderboard/groups", "GET", "/api/leaderboard/groups")
+
+
+async def planner(http, rec, today):
+    await rec.call(http, "POST /planner/generate", "POST", "/api/planner/generate", json={"date": today})
+    await rec.call(http, "GET /planner/schedule/{date}", "GET", f"/api/planner/schedule/{today}")
+
+
+JOURNEYS = {"dashboard": dashboard, "complete_task": complete_task, "chat": chat, "leaderboard": leaderboard, "planner": planner}
+
+
+async def virtual_user(app, user: dict, journeys: list, weights: list, deadline: float, rec: Recorder):
+    token = server.create_jwt_token(user["user_id"], user["email"])
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://loadtest",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=60
+    ) as http:
+        while time.perf_counter() < deadline:
+            journey = random.choices(journeys, weights)[0]
+            await JOURNEYS[journey](http, rec, today)
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def queries_per_request() -> dict:
+    return {key[0]: (count, total) for key, (count, total) in MONGO_COMMANDS_PER_REQUEST.totals().items()}
+
+
+def summarize(rec: Recorder, elapsed: float, queries_before: dict, queries_after: dict) -> dict:
+    steps = {}
+    for step, values in sorted(rec.latencies.items()):
+        steps[step] = {
+            "count": len(values),
+            "errors": rec.errors.get(step, 0),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2)
+        }
+    routes = {}
+    for route, (count, total) in sorted(queries_after.items()):
+        before_count, before_total = queries_before.get(route, (0, 0))
+        if count > before_count:
+            routes[route] = round((total - before_total) / (count - before_count), 1)
+    return {
+        "requests": rec.requests,
+        "errors": sum(rec.errors.values()),
+        "duration_s": round(elapsed, 1),
+        "throughput_rps": round(rec.requests / elapsed, 1) if elapsed else 0,
+        "steps": steps,
+        "queries_per_request": routes
+    }
+
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests in {report['duration_s']}s: "
+          f"{report['throughput_rps']} req/s, {report['errors']} errors")
+    print(f"\n{'step':36s} {'count':>7s} {'err':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for step, s in report["steps"].items():
+        print(f"{step:36s} {s['count']:7d} {s['errors']:5d} {s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['p99_ms']:9.1f}")
+    if report["queries_per_request"]:
+        print(f"\n{'route':44s} {'queries/request':>16s}")
+        for route, queries in sorted(report["queries_per_request"].items(), key=lambda item: -item[1]):
+            print(f"{route:44s} {queries:16.1f}")
+    else:
+        print("\n(no Mongo command events seen; queries per request needs a real mongod)")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of p95 latency or queries per request beyond tolerance"""
+    regressions = []
+    for step, s in report["steps"].items():
+        old = baseline["steps"].get(step)
+        if old and s["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{step}: p95 {old['p95_ms']:.1f} -> {s['p95_ms']:.1f} ms")
+    for route, queries in report["queries_per_request"].items():
+        old = baseline["queries_per_request"].get(route)
+        if old is not None and queries > old * (1 + tolerance) and queries - old >= 1:
+            regressions.append(f"{route}: {old:.1f} -> {queries:.1f} queries/request")
+    return regressions
+
+
+async def run(args) -> dict:
+    app = server.app
+    async with app.router.lifespan_context(app):
+        users = await server.db.users.find(
+            {"user_id": {"$regex": "^bench_user_"}},
+            {"_id": 0, "user_id": 1, "email": 1}
+        ).limit(args.user_pool).to_list(args.user_pool)
+        if not users:
+            raise SystemExit("No benchmark users found; run benchmarks/datagen.py first")
+
+        journeys = [j for j in args.journeys.split(",") if j]
+        weights = [JOURNEY_WEIGHTS[j] for j in journeys]
+        rec = Recorder()
+        queries_before = queries_per_request()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            virtual_user(app, random.choice(users), journeys, weights, deadline, rec)
+            for _ in range(args.users)
+        ])
+        return summarize(rec, time.perf_counter() - start, queries_before, queries_per_request())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--journeys", default=",".join(JOURNEYS))
+    parser.add_argument("--user-pool", type=int, default=1000, help="generated users to sample from")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps({**report, "args": vars(args)}, indent=2) + "\n")
+        print(f"\nBaseline saved to {path}")
+
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against baseline '{args.compare}':")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against baseline '{args.compare}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Import-time profile of the app: what a fresh worker pays before serving, and
+what the prewarm phase (server.PREWARM_MODULES) takes off the first request.
+
+Runs a clean interpreter with -X importtime, imports server, then each prewarm
+module, and prints the wall time of each phase plus the packages that cost the most.
+
+Run from backend/:  python benchmarks/profile_imports.py [--top 25]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import server
+phases = {"import server": time.perf_counter() - start}
+for module in server.PREWARM_MODULES:
+    start = time.perf_counter()
+    try:
+        importlib.import_module(module)
+    except Exception as e:
+        print(f"{module}: {e}", file=sys.stderr)
+    phases[f"prewarm {module}"] = time.perf_counter() - start
+print(json.dumps(phases))
+"""
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)")
+
+
+def import_time_by_package(stderr: str) -> list:
+    """(self us summed over every module of the package, module count, top-level package), slowest first"""
+    packages = {}
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            package = match.group(2).split(".")[0]
+            own, count = packages.get(package, (0, 0))
+            packages[package] = (own + int(match.group(1)), count + 1)
+    return sorted(((own, count, package) for package, (own, count) in packages.items()), reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    env = {
+        "MONGO_URL": "mongodb://localhost:27017",
+        "DB_NAME": "studysmart_bench",
+        **os.environ,
+        "PYTHONDONTWRITEBYTECODE": "1"
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr[-2000:])
+
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    print("Phase wall time:")
+    for phase, seconds in phases.items():
+        print(f"  {phase:48s} {seconds * 1000:9.1f} ms")
+
+    print("\nSlowest packages (own import time of all their modules):")
+    for own, count, package in import_time_by_package(result.stderr)[:args.top]:
+        print(f"  {package:48s} {own / 1000:9.1f} ms  ({count} modules)")
+
+if __name__ == "__main__":
+    main()
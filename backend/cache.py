@@ -0,0 +1,297 @@
+"""
+Two-tier cache for hot read paths, coherent across workers.
+
+Tier 1 is an in-process LRU. Tier 2 is shared by every worker: a Mongo
+collection with a TTL index (CACHE_BACKEND=mongo, the default), or a plain dict
+when there is only one worker (CACHE_BACKEND=local).
+
+Keys are namespaced and carry their namespace's version. invalidate(namespace)
+bumps the version in the shared tier, which orphans every entry of the
+namespace at once (they expire by TTL). The bump is the broadcast: each worker
+polls the versions (sync_versions, every CACHE_VERSION_POLL_SECONDS) and drops
+its local entries of bumped namespaces, so no worker serves an invalidated
+namespace for longer than one poll.
+
+Misses are single-flight within a worker and leased across workers: while one
+request computes a cold key the others wait for its result instead of all
+hitting the database at once. A shared tier that errors is treated as a miss.
+Namespaces whose loader is as cheap as a shared-tier read (one find_one) can
+skip the shared tier with shared=False. A fill still running when its key is
+deleted neither caches its result nor serves callers arriving after the delete.
+
+Cached values are shared between requests and must be treated as read-only.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import CACHE_REQUESTS
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "mongo").lower()
+CACHE_LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", "10000"))
+CACHE_VERSION_POLL_SECONDS = float(os.environ.get("CACHE_VERSION_POLL_SECONDS", "1"))
+CACHE_LEASE_SECONDS = 5.0  # how long peers wait for the worker computing a key
+CACHE_LEASE_POLL_SECONDS = 0.05
+
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-process tier with per-entry expiry"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (monotonic expiry, value)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def drop_prefix(self, prefix: str):
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+
+class LocalStore:
+    """Shared tier for a single worker: a dict with expiry"""
+
+    def __init__(self):
+        self._entries = {}  # key -> (epoch expiry, value)
+        self._versions = {}
+        self._leases = {}
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return MISSING
+        return entry[1]
+
+    async def set(self, key: str, value, ttl: float):
+        self._entries[key] = (time.time() + ttl, value)
+        if len(self._entries) > CACHE_LOCAL_SIZE * 10:
+            now = time.time()
+            self._entries = {k: entry for k, entry in self._entries.items() if entry[0] > now}
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    async def bump(self, namespace: str) -> int:
+        self._versions[namespace] = self._versions.get(namespace, 0) + 1
+        return self._versions[namespace]
+
+    async def versions(self) -> dict:
+        return dict(self._versions)
+
+    async def lease(self, key: str, seconds: float) -> bool:
+        if self._leases.get(key, 0) > time.time():
+            return False
+        self._leases[key] = time.time() + seconds
+        return True
+
+    async def release(self, key: str):
+        self._leases.pop(key, None)
+
+
+class MongoStore:
+    """Shared tier in Mongo.
+
+    entries holds {_id: key, value, expires_at} (values wrapped so any BSON
+    value, None included, can be cached) and leases as {_id: "lease:" + key};
+    versions holds {_id: namespace, version}. The TTL monitor only runs once a
+    minute, so reads check expires_at themselves.
+    """
+
+    def __init__(self, entries, versions):
+        self.entries = entries
+        self.versions_collection = versions
+
+    async def get(self, key: str):
+        doc = await self.entries.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        return doc["value"]["v"] if doc else MISSING
+
+    async def set(self, key: str, value, ttl: float):
+        await self.entries.update_one(
+            {"_id": key},
+            {"$set": {"value": {"v": value}, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    async def delete(self, key: str):
+        await self.entries.delete_one({"_id": key})
+
+    async def bump(self, namespace: str) -> int:
+        doc = await self.versions_collection.find_one_and_update(
+            {"_id": namespace}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc["version"]
+
+    async def versions(self) -> dict:
+        return {doc["_id"]: doc["version"] async for doc in self.versions_collection.find({})}
+
+    async def lease(self, key: str, seconds: float) -> bool:
+        now = datetime.now(timezone.utc)
+        lease = {"_id": f"lease:{key}", "expires_at": now + timedelta(seconds=seconds)}
+        try:
+            await self.entries.insert_one(lease)
+            return True
+        except DuplicateKeyError:
+            # Take over a lease its holder let lapse (the TTL monitor may not have removed it yet)
+            result = await self.entries.replace_one({"_id": lease["_id"], "expires_at": {"$lte": now}}, lease)
+            return result.modified_count == 1
+
+    async def release(self, key: str):
+        await self.entries.delete_one({"_id": f"lease:{key}"})
+
+
+class TwoTierCache:
+    def __init__(self, shared, local_size: int = CACHE_LOCAL_SIZE):
+        self.shared = shared
+        self.local = LRUCache(local_size)
+        self.versions = {}  # namespace -> version this worker last saw
+        self._flights = {}  # full key -> task computing it
+        self._stale_flights = set()  # fills whose key was deleted while they ran
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{namespace}:{self.versions.get(namespace, 0)}:{key}"
+
+    async def get_or_set(
+        self,
+        namespace: str,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+        local_ttl: Optional[float] = None,
+        shared: bool = True
+    ):
+        """The cached value, or loader()'s result cached for ttl seconds (local_ttl in this worker's tier).
+
+        With shared=False the value is only kept in this worker, for local_ttl or ttl.
+        """
+        full_key = self._key(namespace, key)
+        value = self.local.get(full_key)
+        if value is not MISSING:
+            CACHE_REQUESTS.inc(namespace=namespace, result="local_hit")
+            return value
+
+        flight = self._flights.get(full_key)
+        if flight is None:
+            local_ttl = min(ttl, local_ttl or ttl)
+            fill = self._fill(namespace, full_key, loader, ttl, local_ttl) if shared \
+                else self._fill_local(namespace, full_key, loader, local_ttl)
+            flight = self._flights[full_key] = asyncio.ensure_future(fill)
+            flight.add_done_callback(lambda done: self._flight_done(full_key, done))
+        # A cancelled caller must not cancel the fill other callers wait on
+        return await asyncio.shield(flight)
+
+    async def _fill(self, namespace: str, full_key: str, loader, ttl: float, local_ttl: float):
+        value = await self._shared("get", full_key, default=MISSING)
+        if value is not MISSING:
+            CACHE_REQUESTS.inc(namespace=namespace, result="shared_hit")
+        else:
+            leased = await self._shared("lease", full_key, CACHE_LEASE_SECONDS, default=True)
+            if not leased:
+                value = await self._wait_for_peer(full_key)
+            if value is not MISSING:
+                CACHE_REQUESTS.inc(namespace=namespace, result="shared_hit")
+            else:
+                CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+                try:
+                    value = await loader()
+                    if not self._stale():
+                        await self._shared("set", full_key, value, ttl)
+                finally:
+                    if leased:
+                        await self._shared("release", full_key)
+        if not self._stale():
+            self.local.set(full_key, value, local_ttl)
+        return value
+
+    async def _fill_local(self, namespace: str, full_key: str, loader, local_ttl: float):
+        CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+        value = await loader()
+        if not self._stale():
+            self.local.set(full_key, value, local_ttl)
+        return value
+
+    def _stale(self) -> bool:
+        """Whether the running fill's key was deleted after it started"""
+        return asyncio.current_task() in self._stale_flights
+
+    def _flight_done(self, full_key: str, flight: asyncio.Future):
+        self._stale_flights.discard(flight)
+        if self._flights.get(full_key) is flight:
+            del self._flights[full_key]
+
+    async def _wait_for_peer(self, full_key: str):
+        """Poll the shared tier while another worker computes the key; MISSING if it takes too long"""
+        deadline = time.monotonic() + CACHE_LEASE_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CACHE_LEASE_POLL_SECONDS)
+            value = await self._shared("get", full_key, default=MISSING)
+            if value is not MISSING:
+                return value
+        return MISSING
+
+    async def _shared(self, operation: str, *args, default=None):
+        try:
+            return await getattr(self.shared, operation)(*args)
+        except Exception as e:
+            logging.warning(f"Shared cache {operation} failed: {e}")
+            return default
+
+    async def delete(self, namespace: str, key: str, shared: bool = True):
+        """Drop one key here (and in the shared tier); other workers keep theirs until local_ttl.
+
+        A fill of the key already under way is detached: its result is not
+        cached and later callers start a fresh one.
+        """
+        full_key = self._key(namespace, key)
+        self.local.delete(full_key)
+        flight = self._flights.pop(full_key, None)
+        if flight is not None:
+            self._stale_flights.add(flight)
+        if shared:
+            await self._shared("delete", full_key)
+
+    async def invalidate(self, namespace: str):
+        """Orphan every entry of namespace, in every worker within one version poll"""
+        version = await self._shared("bump", namespace)
+        if version is not None:
+            self.versions[namespace] = max(version, self.versions.get(namespace, 0))
+        self.local.drop_prefix(f"{namespace}:")
+
+    async def sync_versions(self):
+        """Pick up namespace bumps made by other workers"""
+        versions = await self.shared.versions()
+        for namespace, version in versions.items():
+            if version > self.versions.get(namespace, 0):
+                self.versions[namespace] = version
+                self.local.drop_prefix(f"{namespace}:")
+
+
+def create_cache(entries=None, versions=None) -> TwoTierCache:
+    if CACHE_BACKEND == "local":
+        return TwoTierCache(LocalStore())
+    return TwoTierCache(MongoStore(entries, versions))
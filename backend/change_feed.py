@@ -0,0 +1,266 @@
+"""
+Change-stream consumer that keeps caches and materialized views in step with writes.
+
+Derived data (leaderboards, analytics, goal progress, member counts) depends on
+writes spread over many handlers. Rather than each handler remembering what to
+invalidate, handlers registered here see every change to the collections they
+watch, whichever code path made it:
+
+    @change_feed.on("tasks", "users")
+    async def note_change(change): ...      # called per change
+
+    @change_feed.on_flush
+    async def apply(): ...                  # called after each batch
+
+    @change_feed.on_rebuild
+    async def rebuild(): ...                # history lost: recompute from scratch
+
+One worker at a time consumes the stream, holding a lease in the state
+collection; the others stand by and take over if it stops renewing. The resume
+token is saved there after every flushed batch, so a restart carries on where
+the last leader stopped. A handler, flusher or rebuilder that raises aborts
+the batch before its checkpoint, and the stream is reopened from the last saved
+token: changes are replayed, never skipped. Delivery is therefore
+at-least-once, so handlers must be idempotent, and flushers must keep whatever
+they failed to apply. Once the same checkpoint has been replayed
+CHANGE_FEED_MAX_REPLAYS times, the next batch's worth of changes is handled
+one at a time, and a change whose handlers still raise is parked in
+change_feed_parked (logged as an error) and skipped. Long rebuilds page
+through collections with batches(), which renews the lease as it goes.
+
+The feed is live while the last checkpoint, whoever wrote it, is recent:
+a leader stuck replaying a batch stops checkpointing, and every worker then
+treats the views it maintains as stale. Change streams need a replica set (a
+single-node one is enough); against a standalone server the feed reports
+itself unavailable and derived data falls back to being computed on read.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+CHANGE_FEED_ENABLED = os.environ.get("CHANGE_FEED", "1").lower() not in ("0", "false", "no")
+CHANGE_FEED_LEASE_SECONDS = 15
+CHANGE_FEED_BATCH = 500  # changes handled between flushes, and documents per rebuild batch
+CHANGE_FEED_MAX_AWAIT_MS = 1000  # an idle stream still flushes (and renews the lease) this often
+CHANGE_FEED_UNAVAILABLE_RETRY_SECONDS = 300
+CHANGE_FEED_STALE_SECONDS = 2 * CHANGE_FEED_LEASE_SECONDS  # no checkpoint for this long: views are stale
+CHANGE_FEED_MAX_REPLAYS = 5  # failed attempts from one checkpoint before failing changes are parked
+
+# Server error codes
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL = 280
+NOT_A_REPLICA_SET = 40573
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class ChangeFeed:
+    def __init__(self, name: str = "main"):
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.handlers = {}  # collection -> [handler]
+        self.flushers = []
+        self.rebuilders = []
+        self.state = "stopped"  # standby, leader, unavailable, failed, disabled
+        self.checkpointed_at = None  # latest checkpoint of any worker, as last seen here
+        self._state_collection = None
+        self._parked = None
+
+    @property
+    def live(self) -> bool:
+        """Whether some worker checkpointed recently, so views the feed maintains are current"""
+        if self.checkpointed_at is None:
+            return False
+        return (datetime.now(timezone.utc) - self.checkpointed_at).total_seconds() < CHANGE_FEED_STALE_SECONDS
+
+    def on(self, *collections: str):
+        def register(handler: Callable[[dict], Awaitable[None]]):
+            for collection in collections:
+                self.handlers.setdefault(collection, []).append(handler)
+            return handler
+        return register
+
+    def on_flush(self, flusher: Callable[[], Awaitable[None]]):
+        self.flushers.append(flusher)
+        return flusher
+
+    def on_rebuild(self, rebuilder: Callable[[], Awaitable[None]]):
+        self.rebuilders.append(rebuilder)
+        return rebuilder
+
+    async def run(self, db, state_collection):
+        """Background job: stand by until this worker holds the lease, then consume"""
+        if not CHANGE_FEED_ENABLED:
+            self.state = "disabled"
+            return
+        self._state_collection = state_collection
+        self._parked = db["change_feed_parked"]
+        while True:
+            try:
+                if not await self._renew_lease(state_collection):
+                    self.state = "standby"
+                    await self._observe(state_collection)
+                    await asyncio.sleep(CHANGE_FEED_LEASE_SECONDS / 3)
+                    continue
+                await self._consume(db, state_collection)
+            except LeaseLost:
+                logging.warning(f"Change feed {self.name}: lease lost, standing by")
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    if self.state != "unavailable":
+                        logging.warning(f"Change feed {self.name}: change streams need a replica set, derived data is computed on read")
+                    self.state = "unavailable"
+                    await self._release_lease(state_collection)
+                    await asyncio.sleep(CHANGE_FEED_UNAVAILABLE_RETRY_SECONDS)
+                elif e.code in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL):
+                    logging.error(f"Change feed {self.name}: cannot resume ({e}), rebuilding derived data")
+                    await state_collection.update_one({"_id": self.name}, {"$unset": {"resume_token": ""}})
+                else:
+                    self.state = "failed"
+                    logging.error(f"Change feed {self.name} failed: {e}")
+                    await asyncio.sleep(5)
+            except Exception as e:
+                self.state = "failed"
+                logging.error(f"Change feed {self.name} failed: {e!r}")
+                await asyncio.sleep(5)
+
+    async def _consume(self, db, state_collection):
+        state = await state_collection.find_one({"_id": self.name}) or {}
+        resume_token = state.get("resume_token")
+        replays = state.get("replays", 0) if state.get("replay_token") == resume_token else 0
+        # After repeated failures, go through the next batch's worth of changes one
+        # by one, so the change that keeps failing can be told apart and parked
+        careful = CHANGE_FEED_BATCH if replays >= CHANGE_FEED_MAX_REPLAYS else 0
+        if careful:
+            logging.error(
+                f"Change feed {self.name}: replayed {replays} times from the same checkpoint, "
+                f"handling changes one at a time and parking those that fail"
+            )
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.handlers)}}}]
+        async with db.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=resume_token,
+            max_await_time_ms=CHANGE_FEED_MAX_AWAIT_MS
+        ) as stream:
+            self.state = "leader"
+            try:
+                if resume_token is None:
+                    # First start, or history lost: nothing to replay, so recompute instead.
+                    # The stream is already open, so writes made meanwhile still come through.
+                    await self._rebuild()
+                pending = 0
+                while True:
+                    change = await stream.try_next()
+                    if change is not None:
+                        if careful:
+                            careful -= 1
+                            await self._dispatch_or_park(change)
+                        else:
+                            await self._dispatch(change)
+                            pending += 1
+                            if pending < CHANGE_FEED_BATCH:
+                                continue
+                    # A failure raises before the checkpoint, so the reopened stream replays this batch
+                    await self._flush()
+                    await self._checkpoint(state_collection, stream.resume_token)
+                    resume_token, replays, pending = stream.resume_token, 0, 0
+            except LeaseLost:
+                raise
+            except Exception:
+                await state_collection.update_one(
+                    {"_id": self.name, "owner": self.owner},
+                    {"$set": {"replay_token": resume_token, "replays": replays + 1}}
+                )
+                raise
+
+    async def _dispatch(self, change: dict):
+        for handler in self.handlers.get(change["ns"]["coll"], []):
+            await handler(change)
+
+    async def _dispatch_or_park(self, change: dict):
+        try:
+            await self._dispatch(change)
+        except Exception as e:
+            logging.error(
+                f"Change feed {self.name}: PARKED {change.get('operationType')} on {change['ns']['coll']} "
+                f"{change.get('documentKey')} after {CHANGE_FEED_MAX_REPLAYS} failed replays: {e!r}"
+            )
+            await self._parked.insert_one({
+                "feed": self.name,
+                "change": change,
+                "error": repr(e),
+                "parked_at": datetime.now(timezone.utc)
+            })
+
+    async def _flush(self):
+        for flusher in self.flushers:
+            await flusher()
+
+    async def _rebuild(self):
+        for rebuilder in self.rebuilders:
+            await rebuilder()
+
+    async def batches(self, collection, query: dict, projection: dict):
+        """Documents matching query in _id-ordered batches, for rebuilders.
+        
+        The lease is renewed between batches, so a long rebuild keeps it; LeaseLost
+        is raised if another worker took over meanwhile.
+        """
+        last_id = None
+        while True:
+            page = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+            batch = await collection.find(page, projection).sort("_id", 1).to_list(CHANGE_FEED_BATCH)
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]["_id"]
+            if not await self._renew_lease(self._state_collection):
+                raise LeaseLost()
+
+    async def _checkpoint(self, state_collection, resume_token):
+        """Save the resume token, renewing the lease in the same write"""
+        now = datetime.now(timezone.utc)
+        result = await state_collection.update_one(
+            {"_id": self.name, "owner": self.owner},
+            {"$set": {
+                "resume_token": resume_token,
+                "lease_until": now + timedelta(seconds=CHANGE_FEED_LEASE_SECONDS),
+                "checkpointed_at": now,
+                "replays": 0
+            }}
+        )
+        if result.matched_count == 0:
+            raise LeaseLost()
+        self.checkpointed_at = now
+
+    async def _observe(self, state_collection):
+        """Note when the leader last checkpointed, for live"""
+        state = await state_collection.find_one({"_id": self.name}, {"checkpointed_at": 1}) or {}
+        checkpointed_at = state.get("checkpointed_at")
+        if checkpointed_at is not None and checkpointed_at.tzinfo is None:
+            checkpointed_at = checkpointed_at.replace(tzinfo=timezone.utc)
+        self.checkpointed_at = checkpointed_at
+
+    async def _renew_lease(self, state_collection) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await state_collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=CHANGE_FEED_LEASE_SECONDS)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # another worker holds a live lease
+
+    async def _release_lease(self, state_collection):
+        await state_collection.update_one({"_id": self.name, "owner": self.owner}, {"$set": {"lease_until": datetime.now(timezone.utc)}})
@@ -0,0 +1,253 @@
+"""
+Async Google Calendar access for the planner and calendar routes.
+
+Talks to the Calendar v3 REST API and the OAuth token endpoint over one shared,
+pooled httpx client instead of googleapiclient, so no request blocks the event
+loop. Base URLs are configurable so tests can point it at a local fake server.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+GOOGLE_CALENDAR_API_BASE = os.environ.get('GOOGLE_CALENDAR_API_BASE', 'https://www.googleapis.com/calendar/v3')
+GOOGLE_TOKEN_URI = os.environ.get('GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token')
+GOOGLE_HTTP_TIMEOUT_SECONDS = float(os.environ.get('GOOGLE_HTTP_TIMEOUT_SECONDS', '5'))
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.environ.get('GOOGLE_HTTP_MAX_CONNECTIONS', '50'))
+
+TOKEN_EXPIRY_MARGIN_SECONDS = 60  # refresh a little before Google says the token expires
+MAX_EVENT_PAGES = 20  # 250 events per page
+MAX_SYNC_PAGES = 100
+
+
+class GoogleCalendarError(Exception):
+    """A Google Calendar call failed (HTTP error, timeout or unusable credentials)"""
+
+
+class GoogleCalendarSyncTokenExpired(GoogleCalendarError):
+    """Google no longer accepts the stored sync token (HTTP 410); a full sync is needed"""
+
+
+def _json_body(resp: httpx.Response, what: str) -> dict:
+    """Decode a JSON object response, turning malformed bodies into GoogleCalendarError"""
+    try:
+        body = resp.json()
+    except ValueError as e:
+        raise GoogleCalendarError(f"{what} returned invalid JSON: {e}")
+    if not isinstance(body, dict):
+        raise GoogleCalendarError(f"{what} returned {type(body).__name__}, expected an object")
+    return body
+
+
+def _expiry(body: dict, what: str) -> float:
+    try:
+        return time.time() + float(body.get("expires_in", 3600))
+    except (TypeError, ValueError):
+        raise GoogleCalendarError(f"{what} returned an invalid expires_in: {body.get('expires_in')!r}")
+
+
+class GoogleCalendarClient:
+    """Shared async Calendar client with per-user access token caching.
+
+    Access tokens are cached in-process until shortly before they expire. A
+    refresh happens at most once per expiry per worker (concurrent callers
+    wait on the same refresh) and is reported to on_token_refresh so the
+    caller can persist it. on_request, if given, is told the operation,
+    duration and status code (None on transport errors) of every HTTP call.
+    """
+
+    def __init__(
+        self,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        api_base: str = GOOGLE_CALENDAR_API_BASE,
+        token_uri: str = GOOGLE_TOKEN_URI,
+        http: Optional[httpx.AsyncClient] = None,
+        on_token_refresh: Optional[Callable[[str, str, float], Awaitable[None]]] = None,
+        on_request: Optional[Callable[[str, float, Optional[int]], None]] = None,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_base = api_base.rstrip('/')
+        self.token_uri = token_uri
+        self.on_token_refresh = on_token_refresh
+        self.on_request = on_request
+        self._http = http
+        self._tokens = {}  # user_id -> (access_token, expires_at epoch seconds)
+        self._locks = {}
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """The pooled HTTP client, created on first use"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(GOOGLE_HTTP_TIMEOUT_SECONDS, connect=2.0),
+                limits=httpx.Limits(
+                    max_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=GOOGLE_HTTP_MAX_CONNECTIONS // 2
+                )
+            )
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _send(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        status = None
+        try:
+            resp = await self.http.request(method, url, **kwargs)
+            status = resp.status_code
+            return resp
+        finally:
+            if self.on_request:
+                self.on_request(operation, time.perf_counter() - start, status)
+
+    def forget(self, user_id: str):
+        """Drop cached credentials, e.g. after the user reconnects or disconnects"""
+        self._tokens.pop(user_id, None)
+
+    async def exchange_code(self, code: str, redirect_uri: str) -> dict:
+        """Exchange an OAuth authorization code for tokens"""
+        try:
+            resp = await self._send("token.exchange", "POST", self.token_uri, data={
+                'code': code,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': redirect_uri,
+                'grant_type': 'authorization_code'
+            })
+        except httpx.HTTPError as e:
+            raise GoogleCalendarError(f"Token exchange failed: {e!r}")
+        if resp.status_code != 200:
+            raise GoogleCalendarError(f"Token exchange failed ({resp.status_code}): {resp.text}")
+
+        tokens = _json_body(resp, "Token exchange")
+        if not tokens.get("access_token"):
+            raise GoogleCalendarError("Token exchange returned no access_token")
+        tokens["expires_at"] = _expiry(tokens, "Token exchange")
+        return tokens
+
+    async def _refresh(self, user_id: str, tokens: dict) -> str:
+        if not tokens.get("refresh_token"):
+            raise GoogleCalendarError("No refresh token stored, reconnect Google Calendar")
+        try:
+            resp = await self._send("token.refresh", "POST", self.token_uri, data={
+                'grant_type': 'refresh_token',
+                'refresh_token': tokens["refresh_token"],
+                'client_id': self.client_id,
+                'client_secret': self.client_secret
+            })
+        except httpx.HTTPError as e:
+            raise GoogleCalendarError(f"Token refresh failed: {e!r}")
+        if resp.status_code != 200:
+            raise GoogleCalendarError(f"Token refresh failed ({resp.status_code})")
+
+        data = _json_body(resp, "Token refresh")
+        access_token = data.get("access_token")
+        if not access_token or not isinstance(access_token, str):
+            raise GoogleCalendarError("Token refresh returned no access_token")
+        expires_at = _expiry(data, "Token refresh")
+        self._tokens[user_id] = (access_token, expires_at)
+        if self.on_token_refresh:
+            await self.on_token_refresh(user_id, access_token, expires_at)
+        return access_token
+
+    def _usable(self, cached: Optional[tuple], stale_token: Optional[str]) -> bool:
+        return bool(cached) and cached[0] != stale_token and cached[1] - TOKEN_EXPIRY_MARGIN_SECONDS > time.time()
+
+    async def access_token(self, user_id: str, tokens: dict, stale_token: Optional[str] = None) -> str:
+        """A valid access token for the user, refreshing if needed.
+
+        stale_token is a token Google just rejected; it is never handed out again.
+        """
+        cached = self._tokens.get(user_id)
+        if cached is None and tokens.get("access_token"):
+            # Tokens saved without an expiry are tried as-is; a 401 triggers the refresh
+            cached = (tokens["access_token"], tokens.get("expires_at") or float("inf"))
+            self._tokens[user_id] = cached
+        if self._usable(cached, stale_token):
+            return cached[0]
+
+        async with self._locks.setdefault(user_id, asyncio.Lock()):
+            cached = self._tokens.get(user_id)
+            if self._usable(cached, stale_token):
+                return cached[0]
+            return await self._refresh(user_id, tokens)
+
+    async def _get(self, user_id: str, tokens: dict, path: str, params: dict) -> dict:
+        url = f"{self.api_base}{path}"
+        try:
+            token = await self.access_token(user_id, tokens)
+            resp = await self._send("events.list", "GET", url, params=params, headers={"Authorization": f"Bearer {token}"})
+            if resp.status_code == 401:
+                token = await self.access_token(user_id, tokens, stale_token=token)
+                resp = await self._send("events.list", "GET", url, params=params, headers={"Authorization": f"Bearer {token}"})
+        except httpx.HTTPError as e:
+            raise GoogleCalendarError(f"Calendar request failed: {e!r}")
+        if resp.status_code == 410:
+            raise GoogleCalendarSyncTokenExpired("Sync token expired")
+        if resp.status_code != 200:
+            raise GoogleCalendarError(f"Calendar request failed ({resp.status_code}): {resp.text[:200]}")
+        page = _json_body(resp, "Calendar request")
+        if not isinstance(page.get("items", []), list):
+            raise GoogleCalendarError("Calendar request returned non-list items")
+        return page
+
+    async def list_events(
+        self,
+        user_id: str,
+        tokens: dict,
+        time_min: str,
+        time_max: str,
+        calendar_id: str = "primary"
+    ) -> list:
+        """All single (expanded) events between time_min and time_max, following pagination"""
+        params = {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "singleEvents": "true",
+            "orderBy": "startTime",
+            "maxResults": 250
+        }
+        items = []
+        for _ in range(MAX_EVENT_PAGES):
+            page = await self._get(user_id, tokens, f"/calendars/{calendar_id}/events", params)
+            items.extend(page.get("items", []))
+            if not page.get("nextPageToken"):
+                break
+            params = {**params, "pageToken": page["nextPageToken"]}
+        return items
+
+    async def sync_events(
+        self,
+        user_id: str,
+        tokens: dict,
+        sync_token: Optional[str] = None,
+        time_min: Optional[str] = None,
+        calendar_id: str = "primary"
+    ) -> tuple:
+        """Events changed since sync_token (or every event from time_min on a full sync).
+
+        Returns (items, next_sync_token). Deleted events come back with
+        status "cancelled". Raises GoogleCalendarSyncTokenExpired when Google
+        wants a full sync instead.
+        """
+        params = {"singleEvents": "true", "maxResults": 250}
+        if sync_token:
+            params["syncToken"] = sync_token
+        elif time_min:
+            params["timeMin"] = time_min
+
+        items = []
+        for _ in range(MAX_SYNC_PAGES):
+            page = await self._get(user_id, tokens, f"/calendars/{calendar_id}/events", params)
+            items.extend(page.get("items", []))
+            if not page.get("nextPageToken"):
+                return items, page.get("nextSyncToken")
+            params = {**params, "pageToken": page["nextPageToken"]}
+        raise GoogleCalendarError("Too many pages while syncing events")
@@ -0,0 +1,309 @@
+"""
+Prometheus metrics for the API, rendered without prometheus_client.
+
+Counters, gauges and histograms live in one in-process registry and are
+exposed in the Prometheus text format by /metrics. Each HTTP request gets a
+RequestStats in a context variable; Mongo commands (seen through a pymongo
+CommandListener on the Motor client) and LLM calls made while serving it are
+labelled with its route, so routes issuing many queries stand out. Motor copies
+the context into its executor threads, which is what makes this attribution work.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+BACKGROUND_ROUTE = "background"  # work done outside any request, e.g. sync loops
+UNMATCHED_ROUTE = "unmatched"  # 404s, kept out of the route label to bound cardinality
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()  # Mongo events arrive on Motor's executor threads
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            return [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> list:
+        with self._lock:
+            return [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one slot per bucket, then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def totals(self) -> dict:
+        """(count, sum) per label tuple"""
+        with self._lock:
+            return {key: (sum(counts[:-1]), counts[-1]) for key, counts in self._values.items()}
+
+    def samples(self) -> list:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongo_commands_total", "Mongo commands by issuing route", ("route", "command", "collection", "outcome")))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by issuing route", ("route", "command"),
+    buckets=MONGO_LATENCY_BUCKETS))
+MONGO_COMMANDS_PER_REQUEST = REGISTRY.register(Histogram(
+    "mongo_commands_per_request", "Mongo commands issued while serving one request", ("route",),
+    buckets=COUNT_BUCKETS))
+MONGO_POOL_CHECKED_OUT = REGISTRY.register(Gauge(
+    "mongo_pool_connections_checked_out", "Pooled Mongo connections currently in use", ("address",)))
+MONGO_POOL_OPEN = REGISTRY.register(Gauge(
+    "mongo_pool_connections_open", "Open pooled Mongo connections", ("address",)))
+MONGO_POOL_WAIT = REGISTRY.register(Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("address",),
+    buckets=MONGO_LATENCY_BUCKETS))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "LLM call latency by calling route", ("route", "outcome")))
+GOOGLE_LATENCY = REGISTRY.register(Histogram(
+    "google_api_request_duration_seconds", "Google OAuth / Calendar API call latency", ("operation", "status")))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests_total", "Cache lookups by namespace and the tier that answered", ("namespace", "result")))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by route class", ("route_class",)))
+
+
+class RequestStats:
+    """What one request did; its route is known once the router has matched it.
+
+    keep_commands also keeps each command document, for the query profiler.
+    """
+
+    def __init__(self, scope: dict, keep_commands: bool = False):
+        self.scope = scope
+        self.keep_commands = keep_commands
+        self.commands = []  # (command name, collection, seconds, command document or None)
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def current_route() -> str:
+    stats = current_request.get()
+    return stats.route if stats else BACKGROUND_ROUTE
+
+
+def observe_request(stats: RequestStats, method: str, status: int, seconds: float):
+    route = stats.route
+    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+    HTTP_LATENCY.observe(seconds, method=method, route=route)
+    MONGO_COMMANDS_PER_REQUEST.observe(len(stats.commands), route=route)
+
+
+def observe_llm_call(seconds: float, outcome: str):
+    LLM_LATENCY.observe(seconds, route=current_route(), outcome=outcome)
+
+
+def observe_google_call(operation: str, seconds: float, status):
+    GOOGLE_LATENCY.observe(seconds, operation=operation, status=status)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Counts and times every Mongo command against the route that issued it"""
+
+    def __init__(self):
+        self._pending = {}  # (connection, request_id) -> (stats, route, collection, command)
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        stats = current_request.get()
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                stats,
+                stats.route if stats else BACKGROUND_ROUTE,
+                collection,
+                event.command if stats is not None and stats.keep_commands else None
+            )
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        stats, route, collection, command = pending
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMANDS.inc(route=route, command=event.command_name, collection=collection, outcome=outcome)
+        MONGO_LATENCY.observe(seconds, route=route, command=event.command_name)
+        if stats is not None:
+            stats.commands.append((event.command_name, collection, seconds, command))
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+def pool_address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool utilization per server"""
+
+    def __init__(self):
+        self._waiting = {}  # thread id -> check-out start
+        self._lock = threading.Lock()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        MONGO_POOL_OPEN.set(0, address=pool_address(event))
+        MONGO_POOL_CHECKED_OUT.set(0, address=pool_address(event))
+
+    def connection_created(self, event):
+        MONGO_POOL_OPEN.inc(address=pool_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_OPEN.dec(address=pool_address(event))
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._waiting[threading.get_ident()] = time.perf_counter()
+
+    def _waited(self, event):
+        with self._lock:
+            start = self._waiting.pop(threading.get_ident(), None)
+        if start is not None:
+            MONGO_POOL_WAIT.observe(time.perf_counter() - start, address=pool_address(event))
+
+    def connection_check_out_failed(self, event):
+        self._waited(event)
+
+    def connection_checked_out(self, event):
+        self._waited(event)
+        MONGO_POOL_CHECKED_OUT.inc(address=pool_address(event))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(address=pool_address(event))
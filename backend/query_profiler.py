@@ -0,0 +1,121 @@
+"""
+N+1 query detector and slow-query profiler for development and staging.
+
+When QUERY_PROFILER is set, every request keeps the Mongo commands it issued
+(see metrics.RequestStats). At the end of the request they are grouped by
+normalized shape: command, collection and filter/pipeline with every value
+replaced by "?". A request is flagged when it repeats one shape more than
+QUERY_PROFILER_REPEAT_LIMIT times (the N+1 signature), runs more commands than
+its route's budget, or runs a command slower than QUERY_PROFILER_SLOW_MS.
+Flagged requests are logged and kept for GET /api/debug/queries (internal
+token required), which tests/conftest.py polls to fail tests whose requests blew their budget.
+"""
+import json
+import logging
+import os
+import threading
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+QUERY_PROFILER = os.environ.get("QUERY_PROFILER", "").lower() in ("1", "true", "yes")
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_PROFILER_REPEAT_LIMIT", "5"))
+QUERY_COMMAND_LIMIT = int(os.environ.get("QUERY_PROFILER_COMMAND_LIMIT", "25"))
+SLOW_QUERY_MS = float(os.environ.get("QUERY_PROFILER_SLOW_MS", "100"))
+REPORT_HISTORY = 200
+
+# Route template -> command budget, for routes that legitimately need more than the default
+QUERY_BUDGETS = {}
+
+# Command fields that say nothing about the query's shape
+NOISE_FIELDS = {
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "readConcern", "writeConcern",
+    "cursor", "batchSize", "limit", "skip", "ordered", "documents", "comment", "maxTimeMS",
+    "apiVersion", "apiStrict", "apiDeprecationErrors", "bypassDocumentValidation", "new", "upsert",
+    "collection"  # getMore names its collection here
+}
+
+
+def normalize(value):
+    """The value's structure with every literal replaced by "?".
+
+    Lists whose items all share one shape (an $in list, a batch of updates)
+    collapse to that shape, so their length does not change the result.
+    """
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [normalize(item) for item in value]
+        return items[:1] if all(item == items[0] for item in items) else items
+    return "?"
+
+
+def command_shape(command_name: str, command) -> str:
+    if command is None:
+        return command_name
+    collection = command.get(command_name)
+    if command_name == "getMore":
+        collection = command.get("collection")
+    body = {key: value for key, value in command.items() if key != command_name and key not in NOISE_FIELDS}
+    return f"{command_name} {collection if isinstance(collection, str) else ''} {json.dumps(normalize(body))}".rstrip()
+
+
+def route_budget(route: str) -> int:
+    return QUERY_BUDGETS.get(route, QUERY_COMMAND_LIMIT)
+
+
+_reports = deque(maxlen=REPORT_HISTORY)
+_reports_lock = threading.Lock()
+_seq = 0
+
+
+def profile_request(stats, method: str, path: str, status: int, seconds: float) -> Optional[dict]:
+    """Check one finished request; a report is kept (and logged) only when something is flagged"""
+    global _seq
+    commands = stats.commands
+    shapes = Counter(command_shape(name, command) for name, _, _, command in commands)
+    repeated = [{"shape": shape, "count": count} for shape, count in shapes.most_common() if count > QUERY_REPEAT_LIMIT]
+    slow = [
+        {"shape": command_shape(name, command), "ms": round(elapsed * 1000, 1)}
+        for name, _, elapsed, command in commands if elapsed * 1000 > SLOW_QUERY_MS
+    ]
+    budget = route_budget(stats.route)
+
+    violations = [f"{item['count']}x {item['shape']}" for item in repeated]
+    if len(commands) > budget:
+        violations.append(f"{len(commands)} commands, budget {budget}")
+    if not violations and not slow:
+        return None
+
+    with _reports_lock:
+        _seq += 1
+        report = {
+            "seq": _seq,
+            "at": datetime.now(timezone.utc).isoformat(),
+            "method": method,
+            "route": stats.route,
+            "path": path,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 1),
+            "commands": len(commands),
+            "budget": budget,
+            "mongo_ms": round(sum(elapsed for _, _, elapsed, _ in commands) * 1000, 1),
+            "violations": violations,
+            "repeated": repeated,
+            "slow": slow
+        }
+        _reports.append(report)
+
+    for violation in violations:
+        logging.warning(f"Query profiler: {method} {stats.route}: {violation}")
+    for item in slow:
+        logging.warning(f"Query profiler: {method} {stats.route}: slow ({item['ms']} ms) {item['shape']}")
+    return report
+
+
+def recent_reports(since: int = 0, violations_only: bool = False) -> list:
+    with _reports_lock:
+        reports = [r for r in _reports if r["seq"] > since]
+    if violations_only:
+        reports = [r for r in reports if r["violations"]]
+    return reports
@@ -0,0 +1,147 @@
+"""
+Per-user rate limits for expensive endpoints, by route class.
+
+Each route class has a quota: `requests` per `seconds` on average, with bursts
+of up to `burst`. Single-node deployments keep exact token buckets in memory.
+With several workers or nodes the buckets live in Mongo instead, approximated
+by sliding-window counters over atomic $inc documents: windows of burst / rate
+seconds allowing `burst` requests each, which gives the same average rate and
+burst size without a read-modify-write race.
+
+Quotas are configured per class with RATE_LIMIT_<CLASS>="<requests>/<seconds>[,<burst>]",
+e.g. RATE_LIMIT_AI="30/3600,10", and RATE_LIMIT_STORE picks memory, mongo or off.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Tuple
+
+from pymongo import ReturnDocument
+
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory").lower()
+
+
+@dataclass(frozen=True)
+class Quota:
+    requests: int
+    seconds: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        """Tokens refilled per second"""
+        return self.requests / self.seconds
+
+    @property
+    def window_seconds(self) -> float:
+        """Window length for the Mongo store: the time a full burst takes to refill"""
+        return self.burst / self.rate
+
+
+def parse_quota(value: str) -> Quota:
+    """'30/3600' or '30/3600,10'"""
+    rate, _, burst = value.partition(",")
+    requests, seconds = rate.split("/")
+    requests = int(requests)
+    quota = Quota(requests, float(seconds), int(burst) if burst else requests)
+    if quota.requests < 1 or quota.seconds <= 0 or quota.burst < 1:
+        raise ValueError(f"Invalid rate limit quota: {value}")
+    return quota
+
+
+def load_quotas(defaults: dict) -> dict:
+    """Route class -> Quota, each default overridable with RATE_LIMIT_<CLASS>"""
+    return {
+        route_class: parse_quota(os.environ.get(f"RATE_LIMIT_{route_class.upper()}", default))
+        for route_class, default in defaults.items()
+    }
+
+
+class MemoryRateLimiter:
+    """Exact token buckets for one process"""
+
+    MAX_BUCKETS = 100_000
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, monotonic time of last update, when the bucket is full again)
+
+    async def acquire(self, key: str, quota: Quota) -> Tuple[bool, float]:
+        """(allowed, seconds until the next request would be allowed)"""
+        now = time.monotonic()
+        tokens, updated, _ = self._buckets.get(key, (quota.burst, now, now))
+        tokens = min(quota.burst, tokens + (now - updated) * quota.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        if len(self._buckets) >= self.MAX_BUCKETS:
+            self._prune(now)
+        self._buckets[key] = (tokens, now, now + (quota.burst - tokens) / quota.rate)
+        return allowed, 0.0 if allowed else (1 - tokens) / quota.rate
+
+    def _prune(self, now: float):
+        """Forget buckets that have refilled; a missing bucket starts full anyway"""
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+
+def sliding_window_wait(previous: int, current: int, elapsed: float, quota: Quota) -> float:
+    """Seconds until previous * (1 - elapsed / window) + current leaves room for one more request"""
+    window = quota.window_seconds
+    room = quota.burst - 1
+    if current <= room:
+        if previous <= 0:
+            return 0.0
+        needed = max(0.0, 1 - (room - current) / previous)  # fraction of the window that must pass
+        return max(0.0, needed * window - elapsed)
+    # Only the next window's decay of this one's count can make room
+    return (window - elapsed) + (1 - room / current) * window
+
+
+class MongoRateLimiter:
+    """Sliding-window counters shared by every worker through one collection.
+
+    Documents are {key, window, count, expires_at}; a TTL index on expires_at
+    cleans them up and a unique (key, window) index makes the upserts safe.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def acquire(self, key: str, quota: Quota) -> Tuple[bool, float]:
+        window_seconds = quota.window_seconds
+        now = time.time()
+        window = int(now // window_seconds)
+        elapsed = now - window * window_seconds
+        expires_at = datetime.fromtimestamp((window + 2) * window_seconds, timezone.utc)
+
+        doc = await self.collection.find_one_and_update(
+            {"key": key, "window": window},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous_doc = await self.collection.find_one({"key": key, "window": window - 1}, {"_id": 0, "count": 1})
+        previous = previous_doc["count"] if previous_doc else 0
+        current = doc["count"] - 1  # requests before this one
+
+        if previous * (1 - elapsed / window_seconds) + current <= quota.burst - 1:
+            return True, 0.0
+        # Rejected requests don't count against the user
+        await self.collection.update_one({"key": key, "window": window}, {"$inc": {"count": -1}})
+        return False, sliding_window_wait(previous, current, elapsed, quota)
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After takes whole seconds; round up so clients don't come back early"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def create_rate_limiter(collection=None):
+    """The limiter RATE_LIMIT_STORE asks for, or None when limits are off"""
+    if RATE_LIMIT_STORE == "off":
+        return None
+    if RATE_LIMIT_STORE == "mongo":
+        return MongoRateLimiter(collection)
+    return MemoryRateLimiter()
+
@@ -1,32 +1,87 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request, Query, Header
 from fastapi.security import HTTPBearer
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import re
+import hashlib
+import hmac
+import time
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, BeforeValidator
+from typing import Annotated, List, Literal, Optional
 import uuid
+import heapq
+from functools import lru_cache
+import asyncio
+import importlib
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import jwt
 from passlib.context import CryptContext
 import httpx
 
+from google_calendar import GoogleCalendarClient, GoogleCalendarError, GoogleCalendarSyncTokenExpired
+from metrics import (
+    RATE_LIMITED, REGISTRY, MongoCommandMetrics, MongoPoolMetrics, RequestStats, current_request,
+    observe_google_call, observe_llm_call, observe_request
+)
+from query_profiler import QUERY_PROFILER, profile_request, recent_reports, QUERY_REPEAT_LIMIT, QUERY_COMMAND_LIMIT, SLOW_QUERY_MS
+from rate_limit import create_rate_limiter, load_quotas, retry_after_header
+from cache import CACHE_VERSION_POLL_SECONDS, create_cache
+from change_feed import CHANGE_FEED_ENABLED, ChangeFeed
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, opened and closed by the app's lifespan (see APP)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+}
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def open_mongo():
+    """Create the Motor client (and its connection pool) on the running event loop"""
+    global client, db
+    client = AsyncIOMotorClient(
+        mongo_url,
+        tz_aware=True,  # BSON dates come back as aware UTC datetimes
+        event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()],  # per-route query counts for /metrics
+        **MONGO_POOL_OPTIONS
+    )
+    db = client[os.environ['DB_NAME']]
+
+def close_mongo():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+# Shared client for outbound HTTP calls other than Google's, owned by the lifespan
+http_client: Optional[httpx.AsyncClient] = None
 
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 168  # 7 days
 
+# Operator endpoints (/metrics, /api/debug/*) need "Authorization: Bearer <INTERNAL_TOKEN>";
+# with no token configured they answer 404
+INTERNAL_TOKEN = os.environ.get('INTERNAL_TOKEN', '')
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -39,14 +94,71 @@ XP_CONFIG = {
     "study_group_bonus": 1.2,  # 20% bonus for group members
 }
 
-# Create the main app
-app = FastAPI()
-
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 security = HTTPBearer(auto_error=False)
 
+# ============ TIMESTAMPS ============
+# Timestamps are moving from ISO strings to BSON dates (see SCHEMA MIGRATIONS);
+# until every document is migrated, readers must accept both.
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """A stored timestamp (BSON date or ISO string) as an aware UTC datetime"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def format_timestamp(value):
+    """API representation of a stored timestamp: always an ISO string"""
+    if isinstance(value, datetime):
+        return parse_timestamp(value).isoformat()
+    return value
+
+def timestamp_between(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Query clause for start <= field <= end matching BSON dates and ISO strings alike"""
+    as_date, as_string = {}, {}
+    if start is not None:
+        as_date["$gte"], as_string["$gte"] = start, start.isoformat()
+    if end is not None:
+        as_date["$lte"], as_string["$lte"] = end, end.isoformat()
+    return {"$or": [{field: as_date}, {field: as_string}]}
+
+Timestamp = Annotated[str, BeforeValidator(format_timestamp)]
+
+# ============ FAST RESPONSES ============
+# Large list endpoints bypass FastAPI's response_model pass, which would
+# validate and serialize every item a second time. Documents we wrote ourselves
+# are projected onto the model's fields as slim records, without validation,
+# and rendered once with orjson (which writes BSON dates as ISO strings).
+# response_model stays on those routes for the OpenAPI schema.
+
+@lru_cache(maxsize=None)
+def record_fields(model: type) -> tuple:
+    """(name, default) for every field of a response model; required fields default to None"""
+    return tuple(
+        (name, None if field.is_required() else field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items()
+    )
+
+def slim_record(model: type, doc: dict) -> dict:
+    """doc restricted to model's fields with defaults filled in"""
+    return {name: doc.get(name, default) for name, default in record_fields(model)}
+
+def list_response(model: type, docs: list, response: Optional[Response] = None) -> ORJSONResponse:
+    """A JSON list of slim records, keeping headers already set on the route's response"""
+    return ORJSONResponse(
+        [slim_record(model, doc) for doc in docs],
+        headers=dict(response.headers) if response is not None else None
+    )
+
 # ============ MODELS ============
 
 class UserCreate(BaseModel):
@@ -91,13 +203,16 @@ class Task(BaseModel):
     estimated_time: Optional[int]
     depends_on: List[str]
     scheduled_time: Optional[str]
-    completed_at: Optional[str]
-    created_at: str
+    completed_at: Optional[Timestamp]
+    created_at: Timestamp
     linked_goal_id: Optional[str] = None
     tags: Optional[List[str]] = []
     status_history: Optional[List[dict]] = []  # [{status, timestamp, note}]
     actual_time: Optional[int] = None  # Actual time spent (from Pomodoro)
     is_overdue: Optional[bool] = False
+    priority_score: Optional[float] = None
+    blocked: Optional[bool] = False  # some prerequisite is not completed yet
+    topo_rank: Optional[int] = None  # longest prerequisite chain below the task; None inside a cycle
 
 class TaskUpdate(BaseModel):
     title: Optional[str] = None
@@ -116,6 +231,14 @@ class TaskUpdate(BaseModel):
     depends_on: Optional[List[str]] = None
     scheduled_time: Optional[str] = None
 
+class TaskBulkOperation(BaseModel):
+    op: str  # "create" | "update" | "complete" | "delete"
+    task_id: Optional[str] = None  # required for everything but create
+    data: Optional[dict] = None  # TaskCreate fields for create, TaskUpdate fields for update
+
+class TaskBulkRequest(BaseModel):
+    operations: List[TaskBulkOperation]
+
 class PomodoroSessionCreate(BaseModel):
     focus_duration: int = 25
     break_duration: int = 5
@@ -129,8 +252,8 @@ class PomodoroSession(BaseModel):
     focus_duration: int
     break_duration: int
     completed: bool
-    started_at: str
-    completed_at: Optional[str]
+    started_at: Timestamp
+    completed_at: Optional[Timestamp]
 
 class GoalCreate(BaseModel):
     title: str
@@ -267,11 +390,35 @@ class ScheduleGenerateRequest(BaseModel):
     available_end: str = "21:00"
     include_breaks: bool = True
     pomodoro_style: bool = True  # 50 min work, 10 min break
+    ai_polish: bool = False  # Ask the LLM to explain the generated plan
+    only_unblocked: bool = False  # Skip tasks whose prerequisites aren't completed yet
+
+class ScheduleRangeGenerateRequest(BaseModel):
+    start_date: str  # YYYY-MM-DD
+    days: int = 7
+    energy_level: str = "medium"
+    available_start: str = "09:00"
+    available_end: str = "21:00"
+    include_breaks: bool = True
+    pomodoro_style: bool = True
+    max_work_minutes_per_day: Optional[int] = None  # Spread work instead of front-loading the first day
+    only_unblocked: bool = False
 
 class ScheduleBlockUpdate(BaseModel):
     start: Optional[str] = None
     end: Optional[str] = None
     task_id: Optional[str] = None
+    on_conflict: Literal["reject", "shift"] = "reject"  # shift moves to the next free slot
+
+class ScheduleBlockMove(BaseModel):
+    block_id: str
+    start: Optional[str] = None
+    end: Optional[str] = None
+    task_id: Optional[str] = None
+
+class ScheduleBlocksPatch(BaseModel):
+    moves: List[ScheduleBlockMove]
+    on_conflict: Literal["reject", "shift"] = "reject"  # applied to every move, in order
 
 class UserPreferences(BaseModel):
     default_energy: str = "medium"
@@ -298,16 +445,30 @@ def create_jwt_token(user_id: str, email: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 async def get_current_user(request: Request, credentials = Depends(security)) -> dict:
+    user_doc = await authenticate(request, credentials)
+    # Lets middleware attribute the request (e.g. bump the user's data version)
+    request.state.user_id = user_doc["user_id"]
+    return user_doc
+
+def require_internal_token(request: Request):
+    """Guard for operator endpoints: hidden unless INTERNAL_TOKEN is set, 403 on a wrong token"""
+    if not INTERNAL_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, supplied = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.encode(), INTERNAL_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Internal token required")
+
+async def authenticate(request: Request, credentials) -> dict:
     session_token = request.cookies.get("session_token")
     if session_token:
-        session_doc = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
+        session_doc = await cache.get_or_set(
+            "sessions", session_token,
+            lambda: db.user_sessions.find_one({"session_token": session_token}, {"_id": 0}),
+            ttl=SESSION_CACHE_SECONDS, shared=False
+        )
         if session_doc:
-            expires_at = session_doc.get("expires_at")
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-            if expires_at > datetime.now(timezone.utc):
+            expires_at = parse_timestamp(session_doc.get("expires_at"))
+            if expires_at and expires_at > datetime.now(timezone.utc):
                 user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
                 if user_doc:
                     return user_doc
@@ -327,6 +488,121 @@ async def get_current_user(request: Request, credentials = Depends(security)) ->
     
     raise HTTPException(status_code=401, detail="Not authenticated")
 
+# ============ DATA VERSIONS ============
+# Monotonic per-user and per-group counters in data_versions, bumped after every
+# successful mutation (see bump_data_versions_middleware) and by background jobs
+# that change what users see. Read endpoints derive ETags from them and answer
+# a matching If-None-Match with 304 before running their queries.
+
+GROUP_PATH = re.compile(r"^/api/groups/(group_[^/]+)")
+
+def user_scope(user_id: str) -> str:
+    return f"user:{user_id}"
+
+def group_scope(group_id: str) -> str:
+    return f"group:{group_id}"
+
+async def member_group_scopes(user_id: str) -> List[str]:
+    """Scopes of every group the user is active in; their pages show the user's XP and streak"""
+    memberships = await db.group_memberships.find(
+        {"user_id": user_id, "is_active": True},
+        {"_id": 0, "group_id": 1}
+    ).to_list(100)
+    return [group_scope(m["group_id"]) for m in memberships]
+
+async def bump_data_versions(scopes: List[str]):
+    """Invalidate every ETag derived from these scopes"""
+    if scopes:
+        await db.data_versions.bulk_write(
+            [UpdateOne({"scope": scope}, {"$inc": {"version": 1}}, upsert=True) for scope in set(scopes)],
+            ordered=False
+        )
+
+async def data_versions_etag(scopes: List[str], *extra) -> str:
+    """Weak ETag over the current versions of scopes (plus anything else the response depends on)"""
+    docs = await db.data_versions.find({"scope": {"$in": scopes}}, {"_id": 0}).to_list(len(scopes))
+    versions = {doc["scope"]: doc.get("version", 0) for doc in docs}
+    key = "|".join([*(f"{scope}={versions.get(scope, 0)}" for scope in sorted(scopes)), *map(str, extra)])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match calls for"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+async def not_modified(request: Request, response: Response, scopes: List[str], *extra) -> Optional[Response]:
+    """A 304 when the client's copy is current; otherwise sets the ETag on response and returns None.
+    
+    Versions are read before the data, so a concurrent write can only make
+    the tag older than the body (costing a refetch), never newer.
+    """
+    etag = await data_versions_etag(scopes, *extra)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# ============ CACHE ============
+# Two-tier (in-process LRU + shared) cache for hot reads; see cache.py. Values
+# come back shared between requests, so handlers copy before changing them.
+
+# Sessions are cached per worker only: a shared-tier hit would cost the same
+# find_one as the session lookup itself. Logout drops the token here; other
+# workers may serve their copy this much longer, which bounds how long a logout
+# takes to apply
+SESSION_CACHE_SECONDS = 5
+LEADERBOARD_CACHE_SECONDS = 30
+OVERVIEW_CACHE_SECONDS = 10 * 60
+
+cache = None  # created by the lifespan
+
+async def cache_version_loop():
+    """Background job applying cache invalidations made by other workers"""
+    while True:
+        try:
+            await cache.sync_versions()
+        except Exception as e:
+            logging.error(f"Cache version sync failed: {e}")
+        await asyncio.sleep(CACHE_VERSION_POLL_SECONDS)
+
+# ============ RATE LIMITS ============
+# Per-user quotas for endpoints that cost LLM calls or heavy queries; see
+# rate_limit.py for the stores and the RATE_LIMIT_<CLASS> overrides.
+
+RATE_LIMITS = load_quotas({
+    "ai": "30/3600,10",  # every call is an LLM request
+    "planner": "60/3600,10",
+    "leaderboard": "120/60,30",
+    "insights": "120/60,30",
+})
+rate_limiter = None  # created by the lifespan
+
+def rate_limit(route_class: str):
+    """Dependency charging the caller one request against their route_class bucket"""
+    quota = RATE_LIMITS[route_class]
+    
+    async def check(current_user: dict = Depends(get_current_user)):
+        if rate_limiter is None:
+            return
+        key = f"{current_user['user_id']}:{route_class}"
+        try:
+            allowed, retry_after = await rate_limiter.acquire(key, quota)
+        except Exception as e:
+            logging.error(f"Rate limiter failed, letting {key} through: {e}")
+            return
+        if not allowed:
+            RATE_LIMITED.inc(route_class=route_class)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many {route_class} requests, please slow down",
+                headers={"Retry-After": retry_after_header(retry_after)}
+            )
+    
+    return check
+
 # ============ XP HELPERS ============
 
 def get_week_start():
@@ -373,7 +649,7 @@ async def award_xp(user_id: str, amount: int, reason: str, group_id: str = None)
         "amount": final_amount,
         "reason": reason,
         "group_id": group_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     # Update group XP if applicable
@@ -383,6 +659,12 @@ async def award_xp(user_id: str, amount: int, reason: str, group_id: str = None)
             {"$inc": {"total_xp": final_amount, "weekly_xp": final_amount}}
         )
     
+    # XP also arrives from background work (badges) with no group_id and outside
+    # any request, so every group showing this user is bumped here
+    scopes = [user_scope(user_id), *await member_group_scopes(user_id)]
+    if group_id:
+        scopes.append(group_scope(group_id))
+    await bump_data_versions(scopes)
     return final_amount
 
 async def check_and_reset_periodic_xp(user_id: str):
@@ -406,6 +688,7 @@ async def check_and_reset_periodic_xp(user_id: str):
     
     if updates:
         await db.users.update_one({"user_id": user_id}, {"$set": updates})
+        await bump_data_versions([user_scope(user_id)])
 
 async def calculate_streak(user_id: str):
     """Calculate the current streak for a user"""
@@ -415,19 +698,19 @@ async def calculate_streak(user_id: str):
     # Get all completed tasks and sessions for the user
     for i in range(365):  # Check up to a year
         check_date = today - timedelta(days=i)
-        day_start = datetime.combine(check_date, datetime.min.time()).replace(tzinfo=timezone.utc).isoformat()
-        day_end = datetime.combine(check_date, datetime.max.time()).replace(tzinfo=timezone.utc).isoformat()
+        day_start = datetime.combine(check_date, datetime.min.time()).replace(tzinfo=timezone.utc)
+        day_end = datetime.combine(check_date, datetime.max.time()).replace(tzinfo=timezone.utc)
         
         # Check for any activity on this day
         task_count = await db.tasks.count_documents({
             "user_id": user_id,
-            "completed_at": {"$gte": day_start, "$lte": day_end}
+            **timestamp_between("completed_at", day_start, day_end)
         })
         
         session_count = await db.pomodoro_sessions.count_documents({
             "user_id": user_id,
             "completed": True,
-            "completed_at": {"$gte": day_start, "$lte": day_end}
+            **timestamp_between("completed_at", day_start, day_end)
         })
         
         if task_count > 0 or session_count > 0:
@@ -444,6 +727,240 @@ async def calculate_streak(user_id: str):
     
     return streak
 
+# ============ ACHIEVEMENTS ============
+
+# Badges are earned when a per-user counter (kept in user_counters) reaches a threshold
+BADGE_RULES = [
+    {"badge_id": "first_task", "name": "First Step", "description": "Complete your first task", "counter": "tasks_completed", "threshold": 1, "xp": 10},
+    {"badge_id": "tasks_10", "name": "Getting Things Done", "description": "Complete 10 tasks", "counter": "tasks_completed", "threshold": 10, "xp": 50},
+    {"badge_id": "tasks_50", "name": "Task Master", "description": "Complete 50 tasks", "counter": "tasks_completed", "threshold": 50, "xp": 150},
+    {"badge_id": "tasks_100", "name": "Centurion", "description": "Complete 100 tasks", "counter": "tasks_completed", "threshold": 100, "xp": 300},
+    {"badge_id": "high_priority_10", "name": "Priority Player", "description": "Complete 10 high priority tasks", "counter": "high_priority_completed", "threshold": 10, "xp": 75},
+    {"badge_id": "first_focus", "name": "Focused", "description": "Finish your first focus session", "counter": "sessions_completed", "threshold": 1, "xp": 10},
+    {"badge_id": "focus_25", "name": "Deep Worker", "description": "Finish 25 focus sessions", "counter": "sessions_completed", "threshold": 25, "xp": 100},
+    {"badge_id": "focus_hours_10", "name": "Ten Hour Club", "description": "Focus for 10 hours in total", "counter": "focus_minutes", "threshold": 600, "xp": 100},
+    {"badge_id": "streak_3", "name": "On a Roll", "description": "Reach a 3 day streak", "counter": "best_streak", "threshold": 3, "xp": 30},
+    {"badge_id": "streak_7", "name": "Week Warrior", "description": "Reach a 7 day streak", "counter": "best_streak", "threshold": 7, "xp": 70},
+    {"badge_id": "streak_30", "name": "Unstoppable", "description": "Reach a 30 day streak", "counter": "best_streak", "threshold": 30, "xp": 300},
+    {"badge_id": "milestone_1", "name": "Milestone Maker", "description": "Reach a goal milestone", "counter": "milestones_reached", "threshold": 1, "xp": 25},
+    {"badge_id": "team_player", "name": "Team Player", "description": "Contribute to group goals 5 times", "counter": "group_contributions", "threshold": 5, "xp": 50},
+]
+
+ACHIEVEMENT_BATCH_SIZE = 200
+ACHIEVEMENT_POLL_SECONDS = 5  # also picks up events queued by other workers
+ACHIEVEMENT_MAX_ATTEMPTS = 5
+ACHIEVEMENT_APPLIED_WINDOW = 500  # recent event ids kept per user to make counting idempotent
+
+achievement_wakeup = asyncio.Event()
+
+async def emit_achievement_events(user_id: str, events: list) -> int:
+    """Queue domain events for the achievement worker.
+    
+    events are (type, key, payload) tuples. The key identifies the
+    underlying fact (e.g. the task id), so the same fact is only ever
+    counted once however often it is emitted or replayed.
+    """
+    if not events:
+        return 0
+    now = datetime.now(timezone.utc).isoformat()
+    docs = [
+        {
+            "event_id": f"{event_type}:{key}",
+            "user_id": user_id,
+            "type": event_type,
+            "payload": payload,
+            "processed": False,
+            "attempts": 0,
+            "created_at": now
+        }
+        for event_type, key, payload in events
+    ]
+    try:
+        result = await db.achievement_events.insert_many(docs, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            logging.warning(f"Failed to queue achievement events for {user_id}: {errors[:1]}")
+        inserted = e.details.get("nInserted", 0)
+    achievement_wakeup.set()
+    return inserted
+
+def achievement_counter_update(event: dict) -> dict:
+    """The user_counters update a domain event contributes"""
+    payload = event.get("payload") or {}
+    if event["type"] == "task_completed":
+        inc = {"tasks_completed": 1}
+        if payload.get("priority") in ("high", "urgent"):
+            inc["high_priority_completed"] = 1
+        return {"$inc": inc}
+    if event["type"] == "session_completed":
+        return {"$inc": {"sessions_completed": 1, "focus_minutes": payload.get("focus_duration", 25)}}
+    if event["type"] == "streak_changed":
+        return {"$max": {"best_streak": payload.get("streak", 0)}}
+    if event["type"] == "goal_milestone":
+        return {"$inc": {"milestones_reached": 1}}
+    if event["type"] == "group_contribution":
+        return {"$inc": {"group_contributions": 1}}
+    return {}
+
+async def award_badge(user_id: str, rule: dict) -> bool:
+    """Add a badge to the user once; its XP is only awarded the first time"""
+    result = await db.users.update_one(
+        {"user_id": user_id, "badges.badge_id": {"$ne": rule["badge_id"]}},
+        {"$push": {"badges": {
+            "badge_id": rule["badge_id"],
+            "name": rule["name"],
+            "description": rule["description"],
+            "awarded_at": datetime.now(timezone.utc).isoformat()
+        }}}
+    )
+    if not result.modified_count:
+        return False
+    if rule.get("xp"):
+        await award_xp(user_id, rule["xp"], f"Badge earned: {rule['name']}")
+    return True
+
+async def apply_achievement_event(event: dict) -> list:
+    """Count one event and award the badges it unlocks; returns the new badge ids.
+    
+    Only rules on the counters this event touched are evaluated. Counting is
+    skipped if the event id is already among the user's applied events.
+    """
+    update = {k: v for k, v in achievement_counter_update(event).items() if v}
+    if not update:
+        return []
+    update["$push"] = {"applied_events": {"$each": [event["event_id"]], "$slice": -ACHIEVEMENT_APPLIED_WINDOW}}
+    
+    try:
+        before = await db.user_counters.find_one_and_update(
+            {"user_id": event["user_id"], "applied_events": {"$ne": event["event_id"]}},
+            update,
+            upsert=True,
+            projection={"_id": 0, "applied_events": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        return []  # already counted: the upsert collided with the existing counters
+    
+    before = before or {}
+    counters = {}
+    for counter, amount in update.get("$inc", {}).items():
+        counters[counter] = before.get(counter, 0) + amount
+    for counter, value in update.get("$max", {}).items():
+        counters[counter] = max(before.get(counter, 0), value)
+    
+    awarded = []
+    for rule in BADGE_RULES:
+        if rule["counter"] in counters and counters[rule["counter"]] >= rule["threshold"]:
+            if await award_badge(event["user_id"], rule):
+                awarded.append(rule["badge_id"])
+    return awarded
+
+async def process_achievement_events() -> int:
+    """Apply a batch of queued events (oldest first); returns how many were handled"""
+    events = await db.achievement_events.find(
+        {"processed": False, "attempts": {"$lt": ACHIEVEMENT_MAX_ATTEMPTS}},
+        {"_id": 0}
+    ).sort("created_at", 1).limit(ACHIEVEMENT_BATCH_SIZE).to_list(ACHIEVEMENT_BATCH_SIZE)
+    
+    for event in events:
+        query = {"user_id": event["user_id"], "event_id": event["event_id"]}
+        try:
+            await apply_achievement_event(event)
+        except Exception as e:
+            logging.error(f"Achievement event {event['event_id']} failed: {e}")
+            await db.achievement_events.update_one(query, {"$inc": {"attempts": 1}})
+            continue
+        await db.achievement_events.update_one(
+            query,
+            {"$set": {"processed": True, "processed_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    return len(events)
+
+async def achievement_worker():
+    """Background job applying achievement events off the request path"""
+    while True:
+        try:
+            while await process_achievement_events() == ACHIEVEMENT_BATCH_SIZE:
+                pass
+        except Exception as e:
+            logging.error(f"Achievement worker failed: {e}")
+        try:
+            await asyncio.wait_for(achievement_wakeup.wait(), ACHIEVEMENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        achievement_wakeup.clear()
+
+async def collect_achievement_history(user_id: str) -> list:
+    """Events for everything already in the database, for backfilling"""
+    events = []
+    async for task in db.tasks.find({"user_id": user_id, "status": "completed"}, {"_id": 0, "task_id": 1, "priority": 1}):
+        events.append(("task_completed", task["task_id"], {"priority": task.get("priority")}))
+    async for session in db.pomodoro_sessions.find(
+        {"user_id": user_id, "completed": True},
+        {"_id": 0, "session_id": 1, "focus_duration": 1}
+    ):
+        events.append(("session_completed", session["session_id"], {"focus_duration": session.get("focus_duration", 25)}))
+    async for goal in db.goals.find({"user_id": user_id}, {"_id": 0, "goal_id": 1, "milestones": 1}):
+        for milestone in goal.get("milestones") or []:
+            if milestone.get("completed"):
+                events.append(("goal_milestone", f"{goal['goal_id']}:{milestone.get('percentage')}", {"goal_id": goal["goal_id"]}))
+    async for goal in db.group_goals.find({"contributors.user_id": user_id}, {"_id": 0, "goal_id": 1, "contributors": 1}):
+        for count, contribution in enumerate(goal.get("contributors") or [], start=1):
+            if contribution.get("user_id") == user_id:
+                events.append(("group_contribution", f"{goal['goal_id']}:{count}", {"goal_id": goal["goal_id"]}))
+    
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "current_streak": 1})
+    if user and user.get("current_streak"):
+        events.append(("streak_changed", f"replay:{user['current_streak']}", {"streak": user["current_streak"]}))
+    return events
+
+@api_router.get("/achievements")
+async def get_achievements(current_user: dict = Depends(get_current_user)):
+    """Earned badges plus progress towards every badge"""
+    user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0, "badges": 1})
+    counters = await db.user_counters.find_one(
+        {"user_id": current_user["user_id"]},
+        {"_id": 0, "user_id": 0, "applied_events": 0}
+    ) or {}
+    badges = [b for b in (user or {}).get("badges", []) if isinstance(b, dict)]
+    earned = {b["badge_id"] for b in badges}
+    
+    return {
+        "badges": badges,
+        "counters": counters,
+        "available": [
+            {
+                **{k: rule[k] for k in ("badge_id", "name", "description", "xp", "threshold")},
+                "current": counters.get(rule["counter"], 0),
+                "progress": min(1.0, counters.get(rule["counter"], 0) / rule["threshold"]),
+                "earned": rule["badge_id"] in earned
+            }
+            for rule in BADGE_RULES
+        ]
+    }
+
+@api_router.post("/achievements/replay")
+async def replay_achievements(rebuild: bool = False, current_user: dict = Depends(get_current_user)):
+    """Backfill achievement events from existing tasks, sessions and goals.
+    
+    Facts already in the event log are not queued again. rebuild=true also
+    recounts the whole event log from zero; badges already earned are kept
+    and never pay XP twice.
+    """
+    user_id = current_user["user_id"]
+    if rebuild:
+        await db.user_counters.delete_one({"user_id": user_id})
+        await db.achievement_events.update_many(
+            {"user_id": user_id},
+            {"$set": {"processed": False, "attempts": 0}}
+        )
+        achievement_wakeup.set()
+    
+    queued = await emit_achievement_events(user_id, await collect_achievement_history(user_id))
+    return {"queued": queued, "rebuild": rebuild}
+
 # ============ AUTH ROUTES ============
 
 @api_router.post("/auth/register")
@@ -519,15 +1036,14 @@ async def create_session(request: Request, response: Response):
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id required")
     
-    async with httpx.AsyncClient() as client_http:
-        resp = await client_http.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
-        if resp.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session_id")
-        
-        user_data = resp.json()
+    resp = await http_client.get(
+        "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+        headers={"X-Session-ID": session_id}
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid session_id")
+    
+    user_data = resp.json()
     
     existing_user = await db.users.find_one({"email": user_data["email"]}, {"_id": 0})
     if existing_user:
@@ -559,13 +1075,17 @@ async def create_session(request: Request, response: Response):
     session_token = user_data.get("session_token", f"session_{uuid.uuid4().hex}")
     expires_at = datetime.now(timezone.utc) + timedelta(days=7)
     
+    old_tokens = await db.user_sessions.distinct("session_token", {"user_id": user_id})
     await db.user_sessions.delete_many({"user_id": user_id})
     await db.user_sessions.insert_one({
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     })
+    # The user's old sessions are gone, and the new token may have been cached as unknown
+    for token in {*old_tokens, session_token}:
+        await cache.delete("sessions", token, shared=False)
     
     response.set_cookie(
         key="session_token",
@@ -610,18 +1130,268 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        await cache.delete("sessions", session_token, shared=False)
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
+# ============ TASK PRIORITY ============
+
+ACTIONABLE_STATUSES = ["pending", "in-progress"]
+PRIORITY_RESCORE_INTERVAL_SECONDS = 15 * 60
+
+def parse_due_date(due_str: str) -> datetime:
+    """Parse a task due date (ISO datetime, YYYY-MM-DD or dd-MM-yyyy) as an aware UTC datetime"""
+    if "T" in due_str:
+        due = datetime.fromisoformat(due_str.replace('Z', '+00:00'))
+    else:
+        # Handle dd-MM-yyyy format
+        parts = due_str.split('-')
+        if len(parts) == 3 and len(parts[0]) == 2:
+            due = datetime(int(parts[2]), int(parts[1]), int(parts[0]), tzinfo=timezone.utc)
+        else:
+            due = datetime.fromisoformat(due_str)
+    if due.tzinfo is None:
+        due = due.replace(tzinfo=timezone.utc)
+    return due
+
+def compute_priority_fields(task: dict, now: Optional[datetime] = None) -> dict:
+    """Stored priority score for a task, plus when it next needs re-scoring.
+    
+    The score only changes when the task crosses an urgency boundary (3 days
+    and 1 day before it is due), so score_refresh_at is the next such boundary,
+    or None once the task is as urgent as it gets or has no due date. due_at
+    is the parsed due date, queryable as a BSON date.
+    """
+    now = now or datetime.now(timezone.utc)
+    refresh_at = None
+    due_at = None
+    if task.get("due_date"):
+        try:
+            due = due_at = parse_due_date(task["due_date"])
+            # calculate_priority_score uses whole days: "soon" under 4 days, "urgent" under 2
+            boundaries = [due - timedelta(days=4), due - timedelta(days=2)]
+            upcoming = [b for b in boundaries if b > now]
+            if upcoming:
+                refresh_at = min(upcoming).astimezone(timezone.utc).isoformat()
+        except (ValueError, TypeError):
+            pass
+    
+    return {
+        "priority_score": calculate_priority_score(task, now),
+        "score_refresh_at": refresh_at,
+        "due_at": due_at
+    }
+
+async def rescore_tasks(include_unscored: bool = False) -> int:
+    """Re-score open tasks whose urgency boundary has passed; returns how many were updated"""
+    now = datetime.now(timezone.utc)
+    query = {"status": {"$ne": "completed"}, "score_refresh_at": {"$lte": now.isoformat()}}
+    if include_unscored:
+        query = {"priority_score": {"$exists": False}}
+    
+    updated = 0
+    operations = []
+    user_ids = set()
+    async for task in db.tasks.find(query, {"_id": 0, "task_id": 1, "user_id": 1, "priority": 1, "due_date": 1}):
+        user_ids.add(task.get("user_id"))
+        operations.append(UpdateOne({"task_id": task["task_id"]}, {"$set": compute_priority_fields(task, now)}))
+        if len(operations) >= 500:
+            await db.tasks.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.tasks.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    # Stored scores drive ?sort_by=priority
+    await bump_data_versions([user_scope(user_id) for user_id in user_ids if user_id])
+    return updated
+
+async def priority_rescore_loop():
+    """Background job keeping stored priority scores fresh"""
+    include_unscored = True  # First pass backfills tasks created before scores were stored
+    while True:
+        try:
+            updated = await rescore_tasks(include_unscored)
+            if updated:
+                logging.info(f"Re-scored {updated} tasks")
+            include_unscored = False
+        except Exception as e:
+            logging.error(f"Task re-scoring failed: {e}")
+        await asyncio.sleep(PRIORITY_RESCORE_INTERVAL_SECONDS)
+
+def prepare_task_response(task: dict, now: datetime) -> dict:
+    """Fill in is_overdue and defaults for fields older task documents lack"""
+    if task.get("due_date") and task.get("status") != "completed":
+        try:
+            task["is_overdue"] = now > parse_due_date(task["due_date"])
+        except:
+            task["is_overdue"] = False
+    else:
+        task["is_overdue"] = False
+    
+    # Ensure default values for new fields
+    task.setdefault("linked_goal_id", None)
+    task.setdefault("tags", [])
+    task.setdefault("status_history", [])
+    task.setdefault("actual_time", None)
+    task.setdefault("blocked", False)
+    return task
+
+# ============ TASK DEPENDENCIES ============
+
+async def load_dependency_graph(user_id: str) -> dict:
+    """task_id -> {depends_on, status, blocked, topo_rank} for all of a user's tasks"""
+    graph = {}
+    async for task in db.tasks.find(
+        {"user_id": user_id},
+        {"_id": 0, "task_id": 1, "depends_on": 1, "status": 1, "blocked": 1, "topo_rank": 1}
+    ):
+        graph[task["task_id"]] = task
+    return graph
+
+def find_dependency_cycle(graph: dict, task_id: str, depends_on: list) -> Optional[list]:
+    """The cycle giving task_id these prerequisites would close, if any"""
+    parents = {}
+    stack = []
+    for dep in depends_on:
+        if dep == task_id:
+            return [task_id, task_id]
+        if dep not in parents:
+            parents[dep] = task_id
+            stack.append(dep)
+    
+    while stack:
+        current = stack.pop()
+        for dep in graph.get(current, {}).get("depends_on") or []:
+            if dep == task_id:
+                path = [current]
+                while path[-1] != task_id:
+                    path.append(parents[path[-1]])
+                return path[::-1] + [task_id]
+            if dep not in parents:
+                parents[dep] = current
+                stack.append(dep)
+    return None
+
+def validate_dependencies(graph: dict, task_id: Optional[str], depends_on: Optional[list]) -> list:
+    """De-duplicated depends_on; raises 400 for unknown prerequisites or a cycle"""
+    deps = list(dict.fromkeys(depends_on or []))
+    unknown = [d for d in deps if d not in graph]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dependencies: {', '.join(unknown)}")
+    # A new task has no dependents yet, so it can't close a cycle
+    cycle = find_dependency_cycle(graph, task_id, deps) if task_id else None
+    if cycle:
+        raise HTTPException(status_code=400, detail=f"Dependency cycle: {' -> '.join(cycle)}")
+    return deps
+
+def is_blocked(graph: dict, depends_on: Optional[list]) -> bool:
+    """Whether any prerequisite is still open (deleted prerequisites don't block)"""
+    return any(graph[d].get("status") != "completed" for d in depends_on or [] if d in graph)
+
+def new_task_rank(graph: dict, depends_on: list) -> int:
+    return 1 + max((graph[d].get("topo_rank") or 0 for d in depends_on), default=-1)
+
+def dependency_ranks(graph: dict) -> tuple:
+    """Topological rank of every task (Kahn's algorithm) and the tasks stuck in cycles.
+    
+    A task's rank is the length of the longest prerequisite chain below it,
+    so sorting by rank is a valid topological order.
+    """
+    indegree = {}
+    dependents = {}
+    for task_id, node in graph.items():
+        deps = {d for d in node.get("depends_on") or [] if d in graph}
+        indegree[task_id] = len(deps)
+        for dep in deps:
+            dependents.setdefault(dep, []).append(task_id)
+    
+    ranks = {}
+    ready = [t for t, n in indegree.items() if n == 0]
+    for task_id in ready:
+        ranks[task_id] = 0
+    while ready:
+        task_id = ready.pop()
+        for dependent in dependents.get(task_id, []):
+            ranks[dependent] = max(ranks.get(dependent, 0), ranks[task_id] + 1)
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                ready.append(dependent)
+    
+    cyclic = [t for t, n in indegree.items() if n > 0]
+    return ranks, cyclic
+
+async def refresh_dependency_state(user_id: str, graph: Optional[dict] = None) -> int:
+    """Re-derive every task's blocked flag and topological rank after dependency edges changed.
+    
+    Only tasks whose values actually changed are written.
+    """
+    if graph is None:
+        graph = await load_dependency_graph(user_id)
+    ranks, _ = dependency_ranks(graph)
+    
+    operations = []
+    for task_id, node in graph.items():
+        update = {}
+        blocked = is_blocked(graph, node.get("depends_on"))
+        if node.get("blocked") != blocked:
+            update["blocked"] = blocked
+        if "topo_rank" not in node or node["topo_rank"] != ranks.get(task_id):
+            update["topo_rank"] = ranks.get(task_id)
+        if update:
+            node.update(update)
+            operations.append(UpdateOne({"task_id": task_id, "user_id": user_id}, {"$set": update}))
+    
+    if operations:
+        await db.tasks.bulk_write(operations, ordered=False)
+    return len(operations)
+
+async def refresh_dependents(user_id: str, task_ids: list) -> int:
+    """Re-check the blocked flag of tasks depending on tasks whose status just changed.
+    
+    Incremental: only the direct dependents and their prerequisites are read.
+    """
+    if not task_ids:
+        return 0
+    dependents = await db.tasks.find(
+        {"user_id": user_id, "depends_on": {"$in": task_ids}},
+        {"_id": 0, "task_id": 1, "depends_on": 1, "blocked": 1}
+    ).to_list(1000)
+    if not dependents:
+        return 0
+    
+    prerequisite_ids = list({d for t in dependents for d in t["depends_on"]})
+    statuses = {
+        t["task_id"]: t for t in await db.tasks.find(
+            {"user_id": user_id, "task_id": {"$in": prerequisite_ids}},
+            {"_id": 0, "task_id": 1, "status": 1}
+        ).to_list(len(prerequisite_ids))
+    }
+    
+    operations = []
+    for task in dependents:
+        blocked = is_blocked(statuses, task["depends_on"])
+        if task.get("blocked") != blocked:
+            operations.append(UpdateOne({"task_id": task["task_id"], "user_id": user_id}, {"$set": {"blocked": blocked}}))
+    if operations:
+        await db.tasks.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def completion_changed(current_task: dict, update_dict: dict) -> bool:
+    """Whether an update moves a task into or out of "completed" (which (un)blocks dependents)"""
+    if "status" not in update_dict:
+        return False
+    return (update_dict["status"] == "completed") != (current_task.get("status") == "completed")
+
 # ============ TASK ROUTES ============
 
-@api_router.post("/tasks", response_model=Task, status_code=201)
-async def create_task(task_data: TaskCreate, current_user: dict = Depends(get_current_user)):
-    task_id = f"task_{uuid.uuid4().hex[:12]}"
-    now = datetime.now(timezone.utc).isoformat()
+TASK_BULK_MAX_OPERATIONS = 200
+
+def build_task_doc(task_data: TaskCreate, user_id: str, now: str) -> dict:
+    """A new task document, priority fields included"""
     task_doc = {
-        "task_id": task_id,
-        "user_id": current_user["user_id"],
+        "task_id": f"task_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
         "title": task_data.title,
         "description": task_data.description or "",
         "subject": task_data.subject or "",
@@ -637,23 +1407,126 @@ async def create_task(task_data: TaskCreate, current_user: dict = Depends(get_cu
         "tags": task_data.tags or [],
         "status_history": [{"status": "pending", "timestamp": now, "note": "Task created"}],
         "actual_time": None,
-        "is_overdue": False
+        "is_overdue": False,
+        "blocked": False,
+        "topo_rank": 0
+    }
+    task_doc.update(compute_priority_fields(task_doc))
+    return task_doc
+
+def build_task_update(current_task: dict, task_data: TaskUpdate, now: str) -> dict:
+    """The $set for an update: status history, completion time and priority fields"""
+    update_dict = {k: v for k, v in task_data.model_dump().items() if v is not None}
+    
+    # Track status history if status is changing
+    if task_data.status and task_data.status != current_task.get("status"):
+        status_history = current_task.get("status_history", [])
+        status_history.append({
+            "status": task_data.status,
+            "timestamp": now,
+            "note": f"Changed from {current_task.get('status', 'unknown')} to {task_data.status}"
+        })
+        update_dict["status_history"] = status_history
+    
+    if task_data.status == "completed" and current_task["status"] != "completed":
+        update_dict["completed_at"] = datetime.fromisoformat(now)
+    
+    if "priority" in update_dict or "due_date" in update_dict:
+        update_dict.update(compute_priority_fields({**current_task, **update_dict}))
+    return update_dict
+
+async def apply_task_completion_effects(user_id: str, completed_tasks: list) -> dict:
+    """XP, streak and linked goal progress for newly completed tasks.
+    
+    Runs once per request however many tasks were completed: one XP award,
+    one streak scan and one progress update per linked goal.
+    """
+    if not completed_tasks:
+        return {"xp_awarded": 0, "current_streak": None}
+    
+    # Award XP for completing tasks
+    xp_amount = sum(XP_CONFIG["task_completed"].get(t["priority"], 30) for t in completed_tasks)
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "study_group_id": 1})
+    
+    # Get user's groups for XP bonus
+    user_groups = await db.group_memberships.find({"user_id": user_id}, {"_id": 0}).to_list(10)
+    primary_group_id = user_groups[0]["group_id"] if user_groups else (user or {}).get("study_group_id")
+    
+    reason = (
+        f"Completed task: {completed_tasks[0]['title']}" if len(completed_tasks) == 1
+        else f"Completed {len(completed_tasks)} tasks"
+    )
+    xp_awarded = await award_xp(user_id, xp_amount, reason, primary_group_id)
+    
+    # Update streak
+    streak = await calculate_streak(user_id)
+    
+    await emit_achievement_events(user_id, [
+        *[("task_completed", t["task_id"], {"priority": t.get("priority")}) for t in completed_tasks],
+        ("streak_changed", f"{datetime.now(timezone.utc).date().isoformat()}:{streak}", {"streak": streak})
+    ])
+    
+    # Update linked goal progress
+    goal_ids = list({t["linked_goal_id"] for t in completed_tasks if t.get("linked_goal_id")})
+    if goal_ids:
+        await refresh_goal_progress({"goal_id": {"$in": goal_ids}})
+    
+    return {"xp_awarded": xp_awarded, "current_streak": streak}
+
+async def refresh_goal_progress(goal_query: dict):
+    """Recompute the stored progress of matching goals from their target tasks"""
+    goals = await db.goals.find(goal_query, {"_id": 0, "goal_id": 1, "target_tasks": 1}).to_list(None)
+    target_ids = list({tid for g in goals for tid in g.get("target_tasks", [])})
+    done = {
+        t["task_id"] for t in await db.tasks.find(
+            {"task_id": {"$in": target_ids}, "status": "completed"},
+            {"_id": 0, "task_id": 1}
+        ).to_list(len(target_ids) or 1)
     }
+    operations = []
+    for goal in goals:
+        targets = goal.get("target_tasks", [])
+        progress = (len([tid for tid in targets if tid in done]) / len(targets)) * 100 if targets else 0
+        operations.append(UpdateOne({"goal_id": goal["goal_id"]}, {"$set": {"progress": progress}}))
+    if operations:
+        await db.goals.bulk_write(operations, ordered=False)
+
+@api_router.post("/tasks", response_model=Task, status_code=201)
+async def create_task(task_data: TaskCreate, current_user: dict = Depends(get_current_user)):
+    task_doc = build_task_doc(task_data, current_user["user_id"], datetime.now(timezone.utc).isoformat())
+    if task_doc["depends_on"]:
+        graph = await load_dependency_graph(current_user["user_id"])
+        task_doc["depends_on"] = validate_dependencies(graph, None, task_doc["depends_on"])
+        task_doc["blocked"] = is_blocked(graph, task_doc["depends_on"])
+        task_doc["topo_rank"] = new_task_rank(graph, task_doc["depends_on"])
     await db.tasks.insert_one(task_doc)
+    if task_doc["due_at"]:
+        await refresh_overdue_count(current_user["user_id"])
     return Task(**{k: v for k, v in task_doc.items() if k != "_id"})
 
 @api_router.get("/tasks", response_model=List[Task])
 async def get_tasks(
+    request: Request,
+    response: Response,
     status: Optional[str] = None,
     priority: Optional[str] = None,
     subject: Optional[str] = None,
     linked_goal_id: Optional[str] = None,
     today_only: Optional[bool] = False,
+    sort_by: Optional[str] = None,  # "priority" for highest stored priority score first
+    blocked: Optional[bool] = None,  # false: only tasks whose prerequisites are all done
     current_user: dict = Depends(get_current_user)
 ):
+    # is_overdue and today_only depend on the date as well as the data
+    cached = await not_modified(request, response, [user_scope(current_user["user_id"])], datetime.now(timezone.utc).date())
+    if cached:
+        return cached
+    
     query = {"user_id": current_user["user_id"]}
     if status:
         query["status"] = status
+    if blocked is not None:
+        query["blocked"] = blocked
     if priority:
         query["priority"] = priority
     if subject:
@@ -669,39 +1542,55 @@ async def get_tasks(
             {"scheduled_time": {"$regex": f"^{today}"}}
         ]
     
-    tasks = await db.tasks.find(query, {"_id": 0}).to_list(1000)
+    cursor = db.tasks.find(query, {"_id": 0})
+    if sort_by == "priority":
+        cursor = cursor.sort("priority_score", -1)
+    tasks = await cursor.to_list(1000)
     
     # Calculate is_overdue for each task
     now = datetime.now(timezone.utc)
     for task in tasks:
-        if task.get("due_date") and task.get("status") != "completed":
-            try:
-                # Parse different date formats
-                due_str = task["due_date"]
-                if "T" in due_str:
-                    due = datetime.fromisoformat(due_str.replace('Z', '+00:00'))
-                else:
-                    # Handle dd-MM-yyyy format
-                    parts = due_str.split('-')
-                    if len(parts) == 3 and len(parts[0]) == 2:
-                        due = datetime(int(parts[2]), int(parts[1]), int(parts[0]), tzinfo=timezone.utc)
-                    else:
-                        due = datetime.fromisoformat(due_str)
-                if due.tzinfo is None:
-                    due = due.replace(tzinfo=timezone.utc)
-                task["is_overdue"] = now > due
-            except:
-                task["is_overdue"] = False
-        else:
-            task["is_overdue"] = False
-        
-        # Ensure default values for new fields
-        task.setdefault("linked_goal_id", None)
-        task.setdefault("tags", [])
-        task.setdefault("status_history", [])
-        task.setdefault("actual_time", None)
+        prepare_task_response(task, now)
+    
+    return list_response(Task, tasks, response)
+
+@api_router.get("/tasks/next", response_model=List[Task])
+async def get_next_tasks(k: int = 5, current_user: dict = Depends(get_current_user)):
+    """Top-k actionable tasks by stored priority score, skipping tasks still waiting on prerequisites"""
+    k = max(1, min(k, 50))
+    tasks = await db.tasks.find(
+        {"user_id": current_user["user_id"], "blocked": {"$ne": True}, "status": {"$in": ACTIONABLE_STATUSES}},
+        {"_id": 0}
+    ).sort("priority_score", -1).limit(k).to_list(k)
+    
+    now = datetime.now(timezone.utc)
+    return list_response(Task, [prepare_task_response(t, now) for t in tasks])
+
+@api_router.get("/tasks/graph")
+async def get_task_graph(include_completed: bool = False, current_user: dict = Depends(get_current_user)):
+    """The user's task dependency graph in topological order (prerequisites first)"""
+    tasks = await db.tasks.find(
+        {"user_id": current_user["user_id"]},
+        {"_id": 0, "task_id": 1, "title": 1, "status": 1, "priority": 1, "priority_score": 1,
+         "depends_on": 1, "blocked": 1, "topo_rank": 1}
+    ).to_list(5000)
+    graph = {t["task_id"]: t for t in tasks}
+    _, cyclic = dependency_ranks(graph)
+    
+    nodes = [t for t in tasks if include_completed or t.get("status") != "completed"]
+    nodes.sort(key=lambda t: (t.get("topo_rank") is None, t.get("topo_rank") or 0, -(t.get("priority_score") or 0)))
+    visible = {t["task_id"] for t in nodes}
+    edges = [
+        {"from": dep, "to": t["task_id"]}
+        for t in nodes for dep in t.get("depends_on") or [] if dep in visible
+    ]
     
-    return [Task(**t) for t in tasks]
+    return {
+        "nodes": nodes,
+        "edges": edges,
+        "order": [t["task_id"] for t in nodes],
+        "cycles": cyclic
+    }
 
 @api_router.get("/tasks/{task_id}", response_model=Task)
 async def get_task(task_id: str, current_user: dict = Depends(get_current_user)):
@@ -723,120 +1612,563 @@ async def update_task(task_id: str, task_data: TaskUpdate, current_user: dict =
     if not current_task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    update_dict = {k: v for k, v in task_data.model_dump().items() if v is not None}
-    now = datetime.now(timezone.utc).isoformat()
-    
-    # Track status history if status is changing
-    if task_data.status and task_data.status != current_task.get("status"):
-        status_history = current_task.get("status_history", [])
-        status_history.append({
-            "status": task_data.status,
-            "timestamp": now,
-            "note": f"Changed from {current_task.get('status', 'unknown')} to {task_data.status}"
-        })
-        update_dict["status_history"] = status_history
-    
-    # Check if task is being completed
-    if task_data.status == "completed" and current_task["status"] != "completed":
-        update_dict["completed_at"] = now
-        
-        # Award XP for completing task
-        xp_amount = XP_CONFIG["task_completed"].get(current_task["priority"], 30)
-        user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-        
-        # Get user's groups for XP bonus
-        user_groups = await db.group_memberships.find({"user_id": current_user["user_id"]}, {"_id": 0}).to_list(10)
-        primary_group_id = user_groups[0]["group_id"] if user_groups else user.get("study_group_id")
-        
-        await award_xp(
-            current_user["user_id"], 
-            xp_amount, 
-            f"Completed task: {current_task['title']}",
-            primary_group_id
-        )
-        
-        # Update streak
-        await calculate_streak(current_user["user_id"])
-        
-        # Update linked goal progress if applicable
-        if current_task.get("linked_goal_id"):
-            goal = await db.goals.find_one({"goal_id": current_task["linked_goal_id"]}, {"_id": 0})
-            if goal:
-                linked_tasks = await db.tasks.find(
-                    {"task_id": {"$in": goal.get("target_tasks", [])}},
-                    {"_id": 0}
-                ).to_list(100)
-                completed = len([t for t in linked_tasks if t.get("status") == "completed"]) + 1
-                new_progress = (completed / len(goal.get("target_tasks", [1]))) * 100 if goal.get("target_tasks") else 0
-                await db.goals.update_one(
-                    {"goal_id": current_task["linked_goal_id"]},
-                    {"$set": {"progress": new_progress}}
-                )
-    
+    update_dict = build_task_update(current_task, task_data, datetime.now(timezone.utc).isoformat())
     if not update_dict:
         raise HTTPException(status_code=400, detail="No fields to update")
     
+    graph = None
+    if "depends_on" in update_dict:
+        graph = await load_dependency_graph(current_user["user_id"])
+        update_dict["depends_on"] = validate_dependencies(graph, task_id, update_dict["depends_on"])
+        graph[task_id]["depends_on"] = update_dict["depends_on"]
+    
     await db.tasks.update_one(
         {"task_id": task_id, "user_id": current_user["user_id"]},
         {"$set": update_dict}
     )
     
+    if graph is not None:
+        if "status" in update_dict:
+            graph[task_id]["status"] = update_dict["status"]
+        await refresh_dependency_state(current_user["user_id"], graph)
+    elif completion_changed(current_task, update_dict):
+        await refresh_dependents(current_user["user_id"], [task_id])
+    
+    if (current_task.get("due_date") or update_dict.get("due_date")) and ("status" in update_dict or "due_date" in update_dict):
+        await refresh_overdue_count(current_user["user_id"])
+    
+    # Completing a task awards XP, updates the streak and linked goal progress
+    if "completed_at" in update_dict:
+        await apply_task_completion_effects(current_user["user_id"], [current_task])
+    
     task = await db.tasks.find_one({"task_id": task_id}, {"_id": 0})
     return Task(**task)
 
 @api_router.delete("/tasks/{task_id}")
 async def delete_task(task_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.tasks.delete_one({"task_id": task_id, "user_id": current_user["user_id"]})
-    if result.deleted_count == 0:
+    task = await db.tasks.find_one_and_delete(
+        {"task_id": task_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "due_at": 1}
+    )
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    if task.get("due_at"):
+        await refresh_overdue_count(current_user["user_id"])
+    
+    # Drop the dangling prerequisite; dependents may be unblocked and re-ranked
+    dependents = await db.tasks.update_many(
+        {"user_id": current_user["user_id"], "depends_on": task_id},
+        {"$pull": {"depends_on": task_id}}
+    )
+    if dependents.modified_count:
+        await refresh_dependency_state(current_user["user_id"])
     return {"message": "Task deleted"}
 
-# ============ POMODORO ROUTES ============
-
-@api_router.post("/pomodoro/start", response_model=PomodoroSession, status_code=201)
-async def start_pomodoro(session_data: PomodoroSessionCreate, current_user: dict = Depends(get_current_user)):
-    session_id = f"pomo_{uuid.uuid4().hex[:12]}"
-    session_doc = {
-        "session_id": session_id,
-        "user_id": current_user["user_id"],
-        "task_id": session_data.task_id,
-        "focus_duration": session_data.focus_duration,
-        "break_duration": session_data.break_duration,
-        "completed": False,
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "completed_at": None
-    }
-    await db.pomodoro_sessions.insert_one(session_doc)
-    return PomodoroSession(**{k: v for k, v in session_doc.items() if k != "_id"})
-
-@api_router.post("/pomodoro/{session_id}/complete", response_model=PomodoroSession)
-async def complete_pomodoro(session_id: str, current_user: dict = Depends(get_current_user)):
-    session = await db.pomodoro_sessions.find_one(
-        {"session_id": session_id, "user_id": current_user["user_id"]},
-        {"_id": 0}
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+@api_router.post("/tasks/bulk")
+async def bulk_task_operations(request: TaskBulkRequest, current_user: dict = Depends(get_current_user)):
+    """Create, update, complete or delete many tasks in one write.
     
-    if session["completed"]:
-        return PomodoroSession(**session)
+    Operations are independent: a failing one is reported in its result and
+    the rest still apply. Completion side effects (XP, streak, goal progress)
+    are computed once for the whole batch.
+    """
+    if not request.operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+    if len(request.operations) > TASK_BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {TASK_BULK_MAX_OPERATIONS} operations per request")
     
-    await db.pomodoro_sessions.update_one(
-        {"session_id": session_id, "user_id": current_user["user_id"]},
-        {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    user_id = current_user["user_id"]
+    now = datetime.now(timezone.utc).isoformat()
+    referenced = [o.task_id for o in request.operations if o.task_id]
+    existing = {
+        t["task_id"]: t for t in await db.tasks.find(
+            {"user_id": user_id, "task_id": {"$in": referenced}},
+            {"_id": 0}
+        ).to_list(len(referenced) or 1)
+    }
     
-    # Award XP for completing pomodoro session
-    user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-    await award_xp(
-        current_user["user_id"],
-        XP_CONFIG["pomodoro_session"],
+    results = []
+    writes = []  # (result index, write, task completed by it, dependency effect)
+    seen = set()
+    graph = None  # loaded once, only if a dependency list is written
+    for i, operation in enumerate(request.operations):
+        result = {"index": i, "op": operation.op, "task_id": operation.task_id, "ok": False}
+        results.append(result)
+        
+        if operation.op == "create":
+            try:
+                task_doc = build_task_doc(TaskCreate(**(operation.data or {})), user_id, now)
+            except ValidationError as e:
+                result["error"] = f"Invalid task: {e.errors()[0]['msg']}"
+                continue
+            if task_doc["depends_on"]:
+                graph = graph or await load_dependency_graph(user_id)
+                try:
+                    task_doc["depends_on"] = validate_dependencies(graph, None, task_doc["depends_on"])
+                except HTTPException as e:
+                    result["error"] = e.detail
+                    continue
+                task_doc["blocked"] = is_blocked(graph, task_doc["depends_on"])
+                task_doc["topo_rank"] = new_task_rank(graph, task_doc["depends_on"])
+            result["task_id"] = task_doc["task_id"]
+            writes.append((i, InsertOne(task_doc), None, None))
+            continue
+        
+        if operation.op not in ("update", "complete", "delete"):
+            result["error"] = f"Unknown operation: {operation.op}"
+            continue
+        current_task = existing.get(operation.task_id)
+        if not current_task:
+            result["error"] = "Task not found"
+            continue
+        if operation.task_id in seen:
+            result["error"] = "Task already changed earlier in this batch"
+            continue
+        seen.add(operation.task_id)
+        
+        if operation.op == "delete":
+            writes.append((i, DeleteOne({"task_id": operation.task_id, "user_id": user_id}), None, "delete"))
+            continue
+        
+        try:
+            task_data = TaskUpdate(**(operation.data or {}))
+        except ValidationError as e:
+            result["error"] = f"Invalid update: {e.errors()[0]['msg']}"
+            continue
+        if operation.op == "complete":
+            task_data.status = "completed"
+        update_dict = build_task_update(current_task, task_data, now)
+        if not update_dict:
+            result["error"] = "No fields to update"
+            continue
+        
+        dependency_effect = "status" if completion_changed(current_task, update_dict) else None
+        if "depends_on" in update_dict:
+            graph = graph or await load_dependency_graph(user_id)
+            try:
+                update_dict["depends_on"] = validate_dependencies(graph, operation.task_id, update_dict["depends_on"])
+            except HTTPException as e:
+                result["error"] = e.detail
+                continue
+            # Later operations in the batch are validated against the new edges
+            graph[operation.task_id]["depends_on"] = update_dict["depends_on"]
+            dependency_effect = "edges"
+        writes.append((
+            i,
+            UpdateOne({"task_id": operation.task_id, "user_id": user_id}, {"$set": update_dict}),
+            current_task if "completed_at" in update_dict else None,
+            dependency_effect
+        ))
+    
+    failed_writes = set()
+    if writes:
+        try:
+            await db.tasks.bulk_write([w[1] for w in writes], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_writes.add(error["index"])
+                results[writes[error["index"]][0]]["error"] = error.get("errmsg", "Write failed")
+    
+    completed_tasks = []
+    dependency_changes = {"status": [], "edges": [], "delete": []}
+    for position, (i, _, completed_task, dependency_effect) in enumerate(writes):
+        if position in failed_writes:
+            continue
+        results[i]["ok"] = True
+        if completed_task:
+            completed_tasks.append(completed_task)
+        if dependency_effect:
+            dependency_changes[dependency_effect].append(results[i]["task_id"])
+    
+    # Dependency bookkeeping once for the whole batch
+    if dependency_changes["delete"]:
+        await db.tasks.update_many(
+            {"user_id": user_id, "depends_on": {"$in": dependency_changes["delete"]}},
+            {"$pull": {"depends_on": {"$in": dependency_changes["delete"]}}}
+        )
+    if dependency_changes["edges"] or dependency_changes["delete"]:
+        await refresh_dependency_state(user_id)
+    elif dependency_changes["status"]:
+        await refresh_dependents(user_id, dependency_changes["status"])
+    
+    if any(r["ok"] for r in results):
+        await refresh_overdue_count(user_id)
+    
+    effects = await apply_task_completion_effects(user_id, completed_tasks)
+    
+    return {
+        "results": results,
+        "succeeded": len([r for r in results if r["ok"]]),
+        "failed": len([r for r in results if not r["ok"]]),
+        "completed": len(completed_tasks),
+        **effects
+    }
+
+# ============ FOCUS ROLLUPS ============
+
+def rollup_key(value: Optional[str]) -> str:
+    """A task id or subject usable as a field name in a rollup histogram"""
+    return (value or "none").replace(".", "_").replace("$", "_")
+
+def focus_rollup_update(session: dict, subject: Optional[str] = None) -> tuple:
+    """(filter, $inc update) adding one completed session to its day's rollup"""
+    started = parse_timestamp(session["started_at"])
+    minutes = session.get("focus_duration", 25)
+    return (
+        {"user_id": session["user_id"], "day": started.strftime("%Y-%m-%d")},
+        {"$inc": {
+            "sessions": 1,
+            "focus_minutes": minutes,
+            f"hours.{started.hour}.sessions": 1,
+            f"hours.{started.hour}.minutes": minutes,
+            f"tasks.{rollup_key(session.get('task_id'))}": minutes,
+            f"subjects.{rollup_key(subject)}": minutes
+        }}
+    )
+
+async def record_focus_session(session: dict):
+    """Add a just-completed session to the user's focus_daily rollup"""
+    subject = None
+    if session.get("task_id"):
+        task = await db.tasks.find_one({"task_id": session["task_id"]}, {"_id": 0, "subject": 1})
+        subject = (task or {}).get("subject") or None
+    query, update = focus_rollup_update(session, subject)
+    await db.focus_daily.update_one(query, update, upsert=True)
+
+async def get_focus_rollups(user_id: str, days: int) -> list:
+    """The user's focus_daily docs for the last `days` UTC days, today included, oldest first"""
+    first_day = datetime.now(timezone.utc) - timedelta(days=days - 1)
+    return await db.focus_daily.find(
+        {"user_id": user_id, "day": {"$gte": first_day.strftime("%Y-%m-%d")}},
+        {"_id": 0}
+    ).sort("day", 1).to_list(400)
+
+def sum_focus(rollups: list) -> tuple:
+    """(sessions, focus minutes) over a list of rollups"""
+    return sum(r.get("sessions", 0) for r in rollups), sum(r.get("focus_minutes", 0) for r in rollups)
+
+FOCUS_PATTERN_WINDOWS = (14, 30, 90)
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def parse_timezone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+
+async def get_focus_patterns(user_id: str, days: int, tz: str) -> dict:
+    """Weekday x hour focus heatmap in the user's timezone, built from daily rollups.
+    
+    Rollups bucket by UTC hour; each bucket is moved to the local weekday and
+    hour its start falls in (exact for whole-hour offsets).
+    """
+    if days not in FOCUS_PATTERN_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"days must be one of {', '.join(map(str, FOCUS_PATTERN_WINDOWS))}")
+    zone = parse_timezone(tz)
+    
+    rollups = await get_focus_rollups(user_id, days)
+    total_sessions, total_focus_minutes = sum_focus(rollups)
+    
+    minutes = [[0] * 24 for _ in WEEKDAYS]
+    sessions = [[0] * 24 for _ in WEEKDAYS]
+    for rollup in rollups:
+        day = datetime.strptime(rollup["day"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        for hour, counts in (rollup.get("hours") or {}).items():
+            local = (day + timedelta(hours=int(hour))).astimezone(zone)
+            minutes[local.weekday()][local.hour] += counts.get("minutes", 0)
+            sessions[local.weekday()][local.hour] += counts.get("sessions", 0)
+    
+    hour_totals = [
+        {
+            "hour": hour,
+            "sessions": sum(sessions[d][hour] for d in range(7)),
+            "total_duration": sum(minutes[d][hour] for d in range(7))
+        }
+        for hour in range(24)
+    ]
+    peak_hours = sorted(
+        [h for h in hour_totals if h["sessions"]],
+        key=lambda h: (h["sessions"], h["total_duration"]),
+        reverse=True
+    )[:3]
+    
+    return {
+        "days": days,
+        "timezone": tz,
+        "heatmap_minutes": minutes,  # [weekday Mon..Sun][hour 0..23]
+        "heatmap_sessions": sessions,
+        "peak_hours": peak_hours,
+        "day_breakdown": [{"day": name, "minutes": sum(minutes[d])} for d, name in enumerate(WEEKDAYS)],
+        "total_sessions": total_sessions,
+        "total_focus_minutes": total_focus_minutes
+    }
+
+async def migrate_focus_rollups(batch: list) -> int:
+    """Roll up completed sessions that predate the rollups.
+    
+    Each session is claimed (rolled_up set, tagged with this run's claim) before
+    it is counted, and only sessions this claim owns are counted, so workers
+    running the migration side by side never add a session twice. A crash
+    after the claim leaves those sessions uncounted rather than double-counted.
+    """
+    claim = uuid.uuid4().hex
+    ids = [doc["_id"] for doc in batch]
+    await db.pomodoro_sessions.update_many(
+        {"_id": {"$in": ids}, "rolled_up": {"$ne": True}},
+        {"$set": {"rolled_up": True, "rollup_claim": claim}}
+    )
+    sessions = await db.pomodoro_sessions.find({"_id": {"$in": ids}, "rollup_claim": claim}, {"_id": 0}).to_list(len(ids))
+    
+    task_ids = list({s["task_id"] for s in sessions if s.get("task_id")})
+    subjects = {
+        t["task_id"]: t.get("subject") or None for t in await db.tasks.find(
+            {"task_id": {"$in": task_ids}},
+            {"_id": 0, "task_id": 1, "subject": 1}
+        ).to_list(len(task_ids) or 1)
+    }
+    operations = []
+    for session in sessions:
+        try:
+            query, update = focus_rollup_update(session, subjects.get(session.get("task_id")))
+        except (KeyError, ValueError):
+            continue
+        operations.append(UpdateOne(query, update, upsert=True))
+    if operations:
+        await db.focus_daily.bulk_write(operations, ordered=False)
+    return len(operations)
+
+# ============ BURNOUT ============
+# Rolling-window counters per user in burnout_state: focus sessions and minutes
+# per day for the last few days, bumped as sessions complete, and the number of
+# overdue open tasks, recounted on task writes and when the next due date passes.
+# The burnout check evaluates them in constant time; burnout_sweep_loop keeps a
+# precomputed result (and an at_risk flag) ready ahead of time.
+
+BURNOUT_WINDOW_DAYS = 4
+BURNOUT_SWEEP_INTERVAL_SECONDS = 10 * 60
+
+def burnout_window_start(now: datetime) -> str:
+    """First day (UTC, YYYY-MM-DD) inside the rolling window; today is the window's last day"""
+    return (now - timedelta(days=BURNOUT_WINDOW_DAYS - 1)).strftime("%Y-%m-%d")
+
+async def record_burnout_focus(session: dict):
+    """Count a just-completed session in its day's bucket"""
+    day = parse_timestamp(session["started_at"]).strftime("%Y-%m-%d")
+    await db.burnout_state.update_one(
+        {"user_id": session["user_id"]},
+        {
+            "$inc": {f"days.{day}.sessions": 1, f"days.{day}.minutes": session.get("focus_duration", 25), "version": 1},
+            "$set": {"stale": True}
+        },
+        upsert=True
+    )
+
+async def refresh_overdue_count(user_id: str, now: Optional[datetime] = None):
+    """Recount the user's overdue open tasks and note when the next one falls due"""
+    now = now or datetime.now(timezone.utc)
+    open_tasks = {"user_id": user_id, "status": {"$ne": "completed"}}
+    overdue = await db.tasks.count_documents({**open_tasks, "due_at": {"$lte": now}})
+    upcoming = await db.tasks.find_one(
+        {**open_tasks, "due_at": {"$gt": now}},
+        {"_id": 0, "due_at": 1},
+        sort=[("due_at", 1)]
+    )
+    await db.burnout_state.update_one(
+        {"user_id": user_id},
+        {
+            "$set": {"overdue_count": overdue, "overdue_next_at": upcoming["due_at"] if upcoming else None, "stale": True},
+            "$inc": {"version": 1}
+        },
+        upsert=True
+    )
+
+async def rebuild_burnout_state(user_id: str, now: datetime):
+    """Seed the counters for a user from focus rollups and their tasks"""
+    await refresh_overdue_count(user_id, now)
+    state = await db.burnout_state.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+    rollups = await db.focus_daily.find(
+        {"user_id": user_id, "day": {"$gte": burnout_window_start(now)}},
+        {"_id": 0, "day": 1, "sessions": 1, "focus_minutes": 1}
+    ).to_list(BURNOUT_WINDOW_DAYS + 2)
+    # Lost to a concurrent session if the version moved; the next load rebuilds again
+    await db.burnout_state.update_one(
+        {"user_id": user_id, "version": state["version"]},
+        {
+            "$set": {
+                "days": {r["day"]: {"sessions": r.get("sessions", 0), "minutes": r.get("focus_minutes", 0)} for r in rollups},
+                "initialized": True
+            },
+            "$inc": {"version": 1}
+        }
+    )
+
+async def load_burnout_state(user_id: str, now: datetime) -> dict:
+    """The user's counters, seeded on first use and with overdue tasks up to date"""
+    state = await db.burnout_state.find_one({"user_id": user_id}, {"_id": 0})
+    if not state or not state.get("initialized"):
+        await rebuild_burnout_state(user_id, now)
+    elif state.get("overdue_next_at") and parse_timestamp(state["overdue_next_at"]) <= now:
+        await refresh_overdue_count(user_id, now)
+        await bump_data_versions([user_scope(user_id)])
+    else:
+        return state
+    return await db.burnout_state.find_one({"user_id": user_id}, {"_id": 0})
+
+def evaluate_burnout(state: dict, now: datetime) -> dict:
+    """Burnout risk from a user's counters"""
+    since = burnout_window_start(now)
+    days = [bucket for day, bucket in (state.get("days") or {}).items() if day >= since]
+    session_count = sum(bucket.get("sessions", 0) for bucket in days)
+    total_focus = sum(bucket.get("minutes", 0) for bucket in days)
+    overdue_count = state.get("overdue_count", 0)
+    daily_avg = total_focus / BURNOUT_WINDOW_DAYS
+    
+    warnings = []
+    risk_level = "low"
+    
+    if daily_avg > 240:
+        warnings.append("You've been averaging over 4 hours of focus time daily. Consider taking breaks.")
+        risk_level = "medium"
+    
+    if session_count > 24:
+        warnings.append("High number of Pomodoro sessions detected. Make sure you're resting properly.")
+        risk_level = "medium"
+    
+    if overdue_count > 5:
+        warnings.append(f"You have {overdue_count} overdue tasks. Consider prioritizing or rescheduling.")
+        risk_level = "high" if risk_level == "medium" else "medium"
+    
+    if daily_avg > 360 and session_count > 32:
+        risk_level = "high"
+        warnings.append("Warning: Signs of potential burnout detected. Please take a break!")
+    
+    if not warnings:
+        warnings.append("Looking good! Your workload appears balanced.")
+    
+    return {
+        "risk_level": risk_level,
+        "warnings": warnings,
+        "stats": {
+            "avg_daily_focus_minutes": round(daily_avg, 0),
+            "sessions_last_4_days": session_count,
+            "overdue_tasks": overdue_count
+        }
+    }
+
+async def store_burnout_result(state: dict, result: dict, now: datetime):
+    """Keep the evaluation unless the counters changed meanwhile; drop buckets that left the window"""
+    since = burnout_window_start(now)
+    update = {"$set": {
+        "result": result,
+        "result_day": now.strftime("%Y-%m-%d"),
+        "at_risk": result["risk_level"] != "low",
+        "stale": False,
+        "evaluated_at": now
+    }}
+    expired = {f"days.{day}": "" for day in (state.get("days") or {}) if day < since}
+    if expired:
+        update["$unset"] = expired
+    await db.burnout_state.update_one({"user_id": state["user_id"], "version": state.get("version")}, update)
+
+async def get_burnout_check(user_id: str) -> dict:
+    """The precomputed result when it is current, otherwise a fresh evaluation"""
+    now = datetime.now(timezone.utc)
+    state = await load_burnout_state(user_id, now)
+    if state.get("result") and not state.get("stale") and state.get("result_day") == now.strftime("%Y-%m-%d"):
+        return state["result"]
+    result = evaluate_burnout(state, now)
+    await store_burnout_result(state, result, now)
+    return result
+
+async def burnout_sweep() -> int:
+    """Recount overdue tasks past their boundary and re-evaluate out-of-date users; returns users at risk"""
+    now = datetime.now(timezone.utc)
+    overdue_users = await db.burnout_state.distinct("user_id", {"overdue_next_at": {"$lte": now}})
+    for user_id in overdue_users:
+        await refresh_overdue_count(user_id, now)
+    # Tasks just became overdue, so cached task lists and overviews are stale
+    await bump_data_versions([user_scope(user_id) for user_id in overdue_users])
+    
+    at_risk = 0
+    async for state in db.burnout_state.find(
+        {"initialized": True, "$or": [{"stale": True}, {"result_day": {"$ne": now.strftime("%Y-%m-%d")}}]},
+        {"_id": 0, "result": 0}
+    ):
+        result = evaluate_burnout(state, now)
+        await store_burnout_result(state, result, now)
+        if result["risk_level"] != "low":
+            at_risk += 1
+    return at_risk
+
+async def burnout_sweep_loop():
+    """Background job precomputing burnout checks"""
+    while True:
+        try:
+            at_risk = await burnout_sweep()
+            if at_risk:
+                logging.info(f"Flagged {at_risk} users at risk of burnout")
+        except Exception as e:
+            logging.error(f"Burnout sweep failed: {e}")
+        await asyncio.sleep(BURNOUT_SWEEP_INTERVAL_SECONDS)
+
+# ============ POMODORO ROUTES ============
+
+@api_router.post("/pomodoro/start", response_model=PomodoroSession, status_code=201)
+async def start_pomodoro(session_data: PomodoroSessionCreate, current_user: dict = Depends(get_current_user)):
+    session_id = f"pomo_{uuid.uuid4().hex[:12]}"
+    session_doc = {
+        "session_id": session_id,
+        "user_id": current_user["user_id"],
+        "task_id": session_data.task_id,
+        "focus_duration": session_data.focus_duration,
+        "break_duration": session_data.break_duration,
+        "completed": False,
+        "started_at": datetime.now(timezone.utc),
+        "completed_at": None
+    }
+    await db.pomodoro_sessions.insert_one(session_doc)
+    return PomodoroSession(**{k: v for k, v in session_doc.items() if k != "_id"})
+
+@api_router.post("/pomodoro/{session_id}/complete", response_model=PomodoroSession)
+async def complete_pomodoro(session_id: str, current_user: dict = Depends(get_current_user)):
+    session = await db.pomodoro_sessions.find_one(
+        {"session_id": session_id, "user_id": current_user["user_id"]},
+        {"_id": 0}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if session["completed"]:
+        return PomodoroSession(**session)
+    
+    # Only the request that flips completed counts the session
+    result = await db.pomodoro_sessions.update_one(
+        {"session_id": session_id, "user_id": current_user["user_id"], "completed": False},
+        {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc), "rolled_up": True}}
+    )
+    if not result.modified_count:
+        session = await db.pomodoro_sessions.find_one({"session_id": session_id}, {"_id": 0})
+        return PomodoroSession(**session)
+    
+    await record_focus_session(session)
+    await record_burnout_focus(session)
+    
+    # Award XP for completing pomodoro session
+    user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+    await award_xp(
+        current_user["user_id"],
+        XP_CONFIG["pomodoro_session"],
         "Completed Pomodoro session",
         user.get("study_group_id")
     )
     
     # Update streak
-    await calculate_streak(current_user["user_id"])
+    streak = await calculate_streak(current_user["user_id"])
+    
+    await emit_achievement_events(current_user["user_id"], [
+        ("session_completed", session_id, {"focus_duration": session.get("focus_duration", 25)}),
+        ("streak_changed", f"{datetime.now(timezone.utc).date().isoformat()}:{streak}", {"streak": streak})
+    ])
     
     session = await db.pomodoro_sessions.find_one({"session_id": session_id}, {"_id": 0})
     return PomodoroSession(**session)
@@ -846,36 +2178,27 @@ async def get_pomodoro_sessions(
     days: int = 7,
     current_user: dict = Depends(get_current_user)
 ):
-    start_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    start_date = datetime.now(timezone.utc) - timedelta(days=days)
     sessions = await db.pomodoro_sessions.find(
-        {"user_id": current_user["user_id"], "started_at": {"$gte": start_date}},
+        {"user_id": current_user["user_id"], **timestamp_between("started_at", start_date)},
         {"_id": 0}
     ).to_list(1000)
-    return [PomodoroSession(**s) for s in sessions]
+    return list_response(PomodoroSession, sessions)
 
 @api_router.get("/pomodoro/stats")
 async def get_pomodoro_stats(current_user: dict = Depends(get_current_user)):
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    week_start = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    
-    today_sessions = await db.pomodoro_sessions.count_documents({
-        "user_id": current_user["user_id"],
-        "completed": True,
-        "started_at": {"$gte": today_start}
-    })
-    
-    week_sessions = await db.pomodoro_sessions.find(
-        {"user_id": current_user["user_id"], "completed": True, "started_at": {"$gte": week_start}},
-        {"_id": 0}
-    ).to_list(1000)
+    now = datetime.now(timezone.utc)
+    rollups = await get_focus_rollups(current_user["user_id"], 7)
     
-    total_focus_time = sum(s.get("focus_duration", 25) for s in week_sessions)
+    today = now.strftime("%Y-%m-%d")
+    today_sessions = sum(r.get("sessions", 0) for r in rollups if r["day"] == today)
+    week_sessions, total_focus_time = sum_focus(rollups)
     
     return {
         "today_sessions": today_sessions,
-        "week_sessions": len(week_sessions),
+        "week_sessions": week_sessions,
         "total_focus_time_minutes": total_focus_time,
-        "average_daily_sessions": len(week_sessions) / 7
+        "average_daily_sessions": week_sessions / 7
     }
 
 # ============ GOALS ROUTES ============
@@ -915,7 +2238,11 @@ async def create_goal(goal_data: GoalCreate, current_user: dict = Depends(get_cu
     return Goal(**{k: v for k, v in goal_doc.items() if k != "_id"})
 
 @api_router.get("/goals", response_model=List[Goal])
-async def get_goals(current_user: dict = Depends(get_current_user)):
+async def get_goals(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    cached = await not_modified(request, response, [user_scope(current_user["user_id"])])
+    if cached:
+        return cached
+    
     goals = await db.goals.find(
         {"user_id": current_user["user_id"]},
         {"_id": 0}
@@ -954,7 +2281,7 @@ async def get_goals(current_user: dict = Depends(get_current_user)):
             if progress >= milestone.get("percentage", 0) and not milestone.get("completed"):
                 milestone["completed"] = True
     
-    return [Goal(**{k: v for k, v in g.items() if k != "linked_tasks_data"}) for g in goals]
+    return list_response(Goal, goals, response)
 
 # New endpoint to get goal with linked task details
 @api_router.get("/goals/{goal_id}/details")
@@ -1014,6 +2341,9 @@ async def update_goal(goal_id: str, goal_data: GoalUpdate, current_user: dict =
                     f"Milestone reached: {milestone.get('title', 'Milestone')} for '{current_goal['title']}'",
                     user.get("study_group_id")
                 )
+                await emit_achievement_events(current_user["user_id"], [
+                    ("goal_milestone", f"{goal_id}:{milestone.get('percentage')}", {"goal_id": goal_id})
+                ])
         
         update_dict["milestones"] = current_milestones
         update_dict["xp_earned"] = xp_earned
@@ -1046,7 +2376,7 @@ async def delete_goal(goal_id: str, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=404, detail="Goal not found")
     return {"message": "Goal deleted"}
 
-@api_router.get("/goals/{goal_id}/review")
+@api_router.get("/goals/{goal_id}/review", dependencies=[Depends(rate_limit("ai"))])
 async def get_goal_weekly_review(goal_id: str, current_user: dict = Depends(get_current_user)):
     """AI-powered weekly review for a specific goal"""
     from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -1089,7 +2419,7 @@ Structure: 1) Acknowledge progress 2) Note any concerns 3) Ask reflective questi
     ).with_model("openai", "gpt-4o")
     
     message = UserMessage(text=f"Give me a weekly review for this goal:\n{context}")
-    review = await chat.send_message(message)
+    review = await send_llm_message(chat, message)
     
     return {
         "goal_id": goal_id,
@@ -1121,11 +2451,12 @@ async def complete_linked_task(goal_id: str, task_id: str, current_user: dict =
     # Complete the task
     result = await db.tasks.update_one(
         {"task_id": task_id, "user_id": current_user["user_id"]},
-        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}}
     )
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await refresh_overdue_count(current_user["user_id"])
     
     # Award XP for completing task
     user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
@@ -1160,6 +2491,9 @@ async def complete_linked_task(goal_id: str, task_id: str, current_user: dict =
                 f"Milestone: {milestone.get('title')} for '{goal['title']}'",
                 user.get("study_group_id")
             )
+            await emit_achievement_events(current_user["user_id"], [
+                ("goal_milestone", f"{goal_id}:{milestone.get('percentage')}", {"goal_id": goal_id})
+            ])
     
     await db.goals.update_one(
         {"goal_id": goal_id},
@@ -1183,7 +2517,7 @@ class GoalBreakdownRequest(BaseModel):
     streak: Optional[int] = 0
     lastProgressDate: Optional[str] = None
 
-@api_router.post("/goals/{goal_id}/breakdown")
+@api_router.post("/goals/{goal_id}/breakdown", dependencies=[Depends(rate_limit("ai"))])
 async def breakdown_goal(goal_id: str, request: GoalBreakdownRequest, current_user: dict = Depends(get_current_user)):
     """Use AI to break down a goal into actionable subtasks"""
     from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -1214,7 +2548,7 @@ Return ONLY a JSON array of objects with 'title' field. Example:
         context += f"\nDescription: {request.description}"
     
     message = UserMessage(text=f"Break down this goal into actionable steps:\n{context}")
-    response = await chat.send_message(message)
+    response = await send_llm_message(chat, message)
     
     try:
         json_start = response.find('[')
@@ -1230,7 +2564,7 @@ Return ONLY a JSON array of objects with 'title' field. Example:
 
 # ============ LEADERBOARD ROUTES ============
 
-@api_router.get("/leaderboard")
+@api_router.get("/leaderboard", dependencies=[Depends(rate_limit("leaderboard"))])
 async def get_leaderboard(
     period: str = "weekly",  # weekly, monthly, alltime
     limit: int = 20,
@@ -1239,12 +2573,42 @@ async def get_leaderboard(
     """Get the leaderboard for students"""
     await check_and_reset_periodic_xp(current_user["user_id"])
     
-    # Determine which XP field to sort by
-    xp_field = "total_xp"
+    xp_field = leaderboard_xp_field(period)
+    board = await cache.get_or_set(
+        "leaderboard", f"{period}:{limit}", lambda: build_leaderboard(period, limit),
+        ttl=LEADERBOARD_CACHE_SECONDS, local_ttl=5
+    )
+    leaderboard = [{**entry, "is_current_user": entry["user_id"] == current_user["user_id"]} for entry in board]
+    
+    # Get current user's rank if not in top
+    current_user_in_list = any(u["is_current_user"] for u in leaderboard)
+    current_user_rank = None
+    
+    if not current_user_in_list:
+        # Count users with more XP
+        user_xp = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+        if user_xp:
+            higher_count = await db.users.count_documents({
+                xp_field: {"$gt": user_xp.get(xp_field, 0)}
+            })
+            current_user_rank = higher_count + 1
+    
+    return {
+        "period": period,
+        "leaderboard": leaderboard,
+        "current_user_rank": current_user_rank
+    }
+
+def leaderboard_xp_field(period: str) -> str:
     if period == "weekly":
-        xp_field = "weekly_xp"
-    elif period == "monthly":
-        xp_field = "monthly_xp"
+        return "weekly_xp"
+    if period == "monthly":
+        return "monthly_xp"
+    return "total_xp"
+
+async def build_leaderboard(period: str, limit: int) -> list:
+    """Top users for a period, the same for every viewer (cached for LEADERBOARD_CACHE_SECONDS)"""
+    xp_field = leaderboard_xp_field(period)
     
     # Get top users
     users = await db.users.find(
@@ -1252,26 +2616,28 @@ async def get_leaderboard(
         {"_id": 0, "password_hash": 0}
     ).sort(xp_field, -1).limit(limit).to_list(limit)
     
+    # Focus minutes this period for every listed user in one aggregation over the rollups
+    if period == "weekly":
+        start_date = get_week_start().isoformat()
+    elif period == "monthly":
+        start_date = get_month_start().isoformat()
+    else:
+        start_date = "2020-01-01"
+    focus_by_user = {
+        row["_id"]: row["focus_minutes"] async for row in db.focus_daily.aggregate([
+            {"$match": {"user_id": {"$in": [u["user_id"] for u in users]}, "day": {"$gte": start_date[:10]}}},
+            {"$group": {"_id": "$user_id", "focus_minutes": {"$sum": "$focus_minutes"}}}
+        ])
+    }
+    
     leaderboard = []
     for i, user in enumerate(users):
-        # Calculate focus hours this period
-        if period == "weekly":
-            start_date = get_week_start().isoformat()
-        elif period == "monthly":
-            start_date = get_month_start().isoformat()
-        else:
-            start_date = "2020-01-01"
-        
-        sessions = await db.pomodoro_sessions.find(
-            {"user_id": user["user_id"], "completed": True, "started_at": {"$gte": start_date}},
-            {"_id": 0}
-        ).to_list(1000)
-        focus_minutes = sum(s.get("focus_duration", 25) for s in sessions)
+        focus_minutes = focus_by_user.get(user["user_id"], 0)
         
         tasks_completed = await db.tasks.count_documents({
             "user_id": user["user_id"],
             "status": "completed",
-            "completed_at": {"$gte": start_date}
+            **timestamp_between("completed_at", parse_timestamp(start_date))
         })
         
         leaderboard.append({
@@ -1285,36 +2651,28 @@ async def get_leaderboard(
             "focus_hours": round(focus_minutes / 60, 1),
             "tasks_completed": tasks_completed,
             "badges": user.get("badges", []),
-            "study_group_id": user.get("study_group_id"),
-            "is_current_user": user["user_id"] == current_user["user_id"]
+            "study_group_id": user.get("study_group_id")
         })
-    
-    # Get current user's rank if not in top
-    current_user_in_list = any(u["is_current_user"] for u in leaderboard)
-    current_user_rank = None
-    
-    if not current_user_in_list:
-        # Count users with more XP
-        user_xp = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-        if user_xp:
-            higher_count = await db.users.count_documents({
-                xp_field: {"$gt": user_xp.get(xp_field, 0)}
-            })
-            current_user_rank = higher_count + 1
-    
-    return {
-        "period": period,
-        "leaderboard": leaderboard,
-        "current_user_rank": current_user_rank
-    }
+    return leaderboard
 
-@api_router.get("/leaderboard/groups")
+@api_router.get("/leaderboard/groups", dependencies=[Depends(rate_limit("leaderboard"))])
 async def get_group_leaderboard(
     period: str = "weekly",
     limit: int = 10,
     current_user: dict = Depends(get_current_user)
 ):
     """Get the study groups leaderboard"""
+    board = await cache.get_or_set(
+        "group_leaderboard", f"{period}:{limit}", lambda: build_group_leaderboard(period, limit),
+        ttl=LEADERBOARD_CACHE_SECONDS, local_ttl=5
+    )
+    return {
+        "period": period,
+        "leaderboard": [{**entry, "is_member": current_user.get("study_group_id") == entry["group_id"]} for entry in board]
+    }
+
+async def build_group_leaderboard(period: str, limit: int) -> list:
+    """Top groups for a period, the same for every viewer (cached for LEADERBOARD_CACHE_SECONDS)"""
     xp_field = "weekly_xp" if period == "weekly" else "total_xp"
     
     groups = await db.study_groups.find(
@@ -1333,14 +2691,9 @@ async def get_group_leaderboard(
             "xp": group.get(xp_field, 0),
             "total_xp": group.get("total_xp", 0),
             "member_count": member_count,
-            "owner_id": group["owner_id"],
-            "is_member": current_user.get("study_group_id") == group["group_id"]
+            "owner_id": group["owner_id"]
         })
-    
-    return {
-        "period": period,
-        "leaderboard": leaderboard
-    }
+    return leaderboard
 
 # ============ STUDY GROUPS ROUTES ============
 
@@ -1519,10 +2872,12 @@ async def get_my_groups(current_user: dict = Depends(get_current_user)):
     for membership in memberships:
         group = await db.study_groups.find_one({"group_id": membership["group_id"]}, {"_id": 0})
         if group:
-            member_count = await db.group_memberships.count_documents({
-                "group_id": group["group_id"],
-                "is_active": True
-            })
+            member_count = group.get("member_count") if change_feed.live else None
+            if member_count is None:
+                member_count = await db.group_memberships.count_documents({
+                    "group_id": group["group_id"],
+                    "is_active": True
+                })
             # Get unread message count
             last_read = membership.get("last_read_at", "2000-01-01")
             unread_count = await db.group_messages.count_documents({
@@ -1754,8 +3109,22 @@ async def leave_study_group_v2(group_id: str, current_user: dict = Depends(get_c
     return {"message": "Successfully left the group"}
 
 @api_router.get("/groups/{group_id}/details")
-async def get_group_details_v2(group_id: str, current_user: dict = Depends(get_current_user)):
+async def get_group_details_v2(
+    group_id: str,
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user)
+):
     """Get detailed info about a group including members"""
+    # Members' XP and streaks show here, so member mutations bump the group too;
+    # the date is in the tag because streaks roll over at midnight
+    cached = await not_modified(
+        request, response, [group_scope(group_id), user_scope(current_user["user_id"])],
+        datetime.now(timezone.utc).date()
+    )
+    if cached:
+        return cached
+    
     group = await db.study_groups.find_one({"group_id": group_id}, {"_id": 0})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
@@ -1980,24 +3349,28 @@ async def contribute_to_group_goal(
     
     now = datetime.now(timezone.utc).isoformat()
     
-    # Add contribution
-    new_count = goal.get("current_count", 0) + 1
-    is_completed = new_count >= goal.get("target_count", 10)
-    
     contribution = {
         "user_id": current_user["user_id"],
         "user_name": current_user["name"],
         "contributed_at": now
     }
     
-    await db.group_goals.update_one(
-        {"goal_id": goal_id},
-        {
-            "$inc": {"current_count": 1},
-            "$push": {"contributors": contribution},
-            "$set": {"completed": is_completed}
-        }
+    # Add contribution; the returned count is this contribution's own, even under concurrency
+    goal = await db.group_goals.find_one_and_update(
+        {"goal_id": goal_id, "completed": {"$ne": True}},
+        {"$inc": {"current_count": 1}, "$push": {"contributors": contribution}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if not goal:
+        raise HTTPException(status_code=400, detail="This goal is already completed")
+    new_count = goal["current_count"]
+    
+    # Only the contribution that flips the goal completes it
+    is_completed = new_count >= goal.get("target_count", 10) and (await db.group_goals.update_one(
+        {"goal_id": goal_id, "completed": {"$ne": True}},
+        {"$set": {"completed": True}}
+    )).modified_count == 1
     
     # Award XP for contribution
     await award_xp(
@@ -2006,6 +3379,9 @@ async def contribute_to_group_goal(
         f"Contributed to group goal: {goal['title']}",
         group_id
     )
+    await emit_achievement_events(current_user["user_id"], [
+        ("group_contribution", f"{goal_id}:{new_count}", {"goal_id": goal_id, "group_id": group_id})
+    ])
     
     # Send achievement message if goal completed
     if is_completed:
@@ -2021,7 +3397,6 @@ async def contribute_to_group_goal(
         
         # Award bonus XP to all contributors
         unique_contributors = set(c["user_id"] for c in goal.get("contributors", []))
-        unique_contributors.add(current_user["user_id"])
         for user_id in unique_contributors:
             await award_xp(user_id, 50, f"Group goal completed: {goal['title']}", group_id)
     
@@ -2053,9 +3428,19 @@ async def set_primary_group(group_id: str, current_user: dict = Depends(get_curr
 # ============ ANALYTICS ROUTES ============
 
 @api_router.get("/analytics/overview")
-async def get_analytics_overview(current_user: dict = Depends(get_current_user)):
+async def get_analytics_overview(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
-    
+    # The focus window rolls over daily
+    cached = await not_modified(request, response, [user_scope(user_id)], datetime.now(timezone.utc).date())
+    if cached:
+        return cached
+    # The ETag covers everything the overview depends on, so it makes a versioned cache key
+    return await cache.get_or_set(
+        "overview", f"{user_id}:{response.headers['ETag']}", lambda: build_analytics_overview(user_id),
+        ttl=OVERVIEW_CACHE_SECONDS, local_ttl=60
+    )
+
+async def build_analytics_overview(user_id: str) -> dict:
     total_tasks = await db.tasks.count_documents({"user_id": user_id})
     completed_tasks = await db.tasks.count_documents({"user_id": user_id, "status": "completed"})
     overdue_tasks = await db.tasks.count_documents({
@@ -2064,19 +3449,15 @@ async def get_analytics_overview(current_user: dict = Depends(get_current_user))
         "due_date": {"$lt": datetime.now(timezone.utc).isoformat()}
     })
     
-    week_start = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    week_sessions = await db.pomodoro_sessions.find(
-        {"user_id": user_id, "completed": True, "started_at": {"$gte": week_start}},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    total_focus_time = sum(s.get("focus_duration", 25) for s in week_sessions)
+    week_sessions, total_focus_time = sum_focus(
+        await get_focus_rollups(user_id, 7)
+    )
     
     active_goals = await db.goals.count_documents({"user_id": user_id, "completed": False})
     completed_goals = await db.goals.count_documents({"user_id": user_id, "completed": True})
     
     completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-    focus_score = min(len(week_sessions) / 28 * 100, 100)
+    focus_score = min(week_sessions / 28 * 100, 100)
     productivity_score = (completion_rate + focus_score) / 2
     
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
@@ -2089,9 +3470,9 @@ async def get_analytics_overview(current_user: dict = Depends(get_current_user))
             "completion_rate": round(completion_rate, 1)
         },
         "pomodoro": {
-            "sessions_this_week": len(week_sessions),
+            "sessions_this_week": week_sessions,
             "total_focus_time_minutes": total_focus_time,
-            "average_daily_sessions": round(len(week_sessions) / 7, 1)
+            "average_daily_sessions": round(week_sessions / 7, 1)
         },
         "goals": {
             "active": active_goals,
@@ -2109,86 +3490,90 @@ async def get_analytics_overview(current_user: dict = Depends(get_current_user))
 @api_router.get("/analytics/daily-stats")
 async def get_daily_stats(days: int = 7, current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
-    daily_stats = []
+    now = datetime.now(timezone.utc)
+    first_day = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    rollups = {r["day"]: r for r in await get_focus_rollups(user_id, days)}
     
+    # One query for the whole range, bucketed by completion day
+    completed_per_day = {}
+    async for task in db.tasks.find(
+        {"user_id": user_id, **timestamp_between("completed_at", first_day)},
+        {"_id": 0, "completed_at": 1}
+    ):
+        day = parse_timestamp(task["completed_at"]).strftime("%Y-%m-%d")
+        completed_per_day[day] = completed_per_day.get(day, 0) + 1
+    
+    daily_stats = []
     for i in range(days):
-        day_date = datetime.now(timezone.utc) - timedelta(days=i)
-        day_start = day_date.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        day_end = day_date.replace(hour=23, minute=59, second=59, microsecond=999999).isoformat()
-        
-        tasks_completed = await db.tasks.count_documents({
-            "user_id": user_id,
-            "completed_at": {"$gte": day_start, "$lte": day_end}
-        })
-        
-        sessions = await db.pomodoro_sessions.find({
-            "user_id": user_id,
-            "completed": True,
-            "started_at": {"$gte": day_start, "$lte": day_end}
-        }, {"_id": 0}).to_list(100)
-        
-        focus_time = sum(s.get("focus_duration", 25) for s in sessions)
+        day_date = now - timedelta(days=i)
+        day = day_date.strftime("%Y-%m-%d")
+        rollup = rollups.get(day, {})
         
         daily_stats.append({
-            "date": day_date.strftime("%Y-%m-%d"),
+            "date": day,
             "day": day_date.strftime("%a"),
-            "tasks_completed": tasks_completed,
-            "pomodoro_sessions": len(sessions),
-            "focus_time_minutes": focus_time
+            "tasks_completed": completed_per_day.get(day, 0),
+            "pomodoro_sessions": rollup.get("sessions", 0),
+            "focus_time_minutes": rollup.get("focus_minutes", 0)
         })
     
     return list(reversed(daily_stats))
 
+@api_router.get("/analytics/focus-patterns")
+async def get_focus_patterns_route(days: int = 14, tz: str = "UTC", current_user: dict = Depends(get_current_user)):
+    """Weekday x hour focus heatmap in the given timezone (no LLM involved)"""
+    return await get_focus_patterns(current_user["user_id"], days, tz)
+
 # ============ AI ROUTES ============
 
-@api_router.post("/ai/focus-patterns")
-async def ai_focus_patterns(current_user: dict = Depends(get_current_user)):
-    """Analyze user's focus patterns to find optimal study times"""
-    from emergentintegrations.llm.chat import LlmChat, UserMessage
-    
-    user_id = current_user["user_id"]
-    two_weeks_ago = (datetime.now(timezone.utc) - timedelta(days=14)).isoformat()
+async def send_llm_message(chat, message):
+    """chat.send_message, timed per route for /metrics"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await chat.send_message(message)
+        outcome = "ok"
+        return response
+    finally:
+        observe_llm_call(time.perf_counter() - start, outcome)
+
+@api_router.post("/ai/focus-patterns", dependencies=[Depends(rate_limit("ai"))])
+async def ai_focus_patterns(
+    days: int = 14,
+    tz: str = "UTC",
+    include_analysis: bool = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """Focus patterns plus an LLM take on optimal study times.
     
-    # Get sessions from last 2 weeks
-    sessions = await db.pomodoro_sessions.find(
-        {"user_id": user_id, "completed": True, "started_at": {"$gte": two_weeks_ago}},
-        {"_id": 0}
-    ).to_list(500)
+    The narrative is cached until the underlying numbers change (or the
+    day does), so repeat calls don't wait on the LLM.
+    """
+    user_id = current_user["user_id"]
+    patterns = await get_focus_patterns(user_id, days, tz)
+    if not include_analysis:
+        return {**patterns, "analysis": None}
     
-    # Analyze patterns by hour
-    hour_data = {}
-    day_data = {"Mon": 0, "Tue": 0, "Wed": 0, "Thu": 0, "Fri": 0, "Sat": 0, "Sun": 0}
+    cache_key = f"focus_patterns:{days}:{tz}"
+    fingerprint = f"{datetime.now(timezone.utc).strftime('%Y-%m-%d')}:{patterns['total_sessions']}:{patterns['total_focus_minutes']}"
+    cached = await db.ai_insight_cache.find_one({"user_id": user_id, "key": cache_key}, {"_id": 0})
+    if cached and cached.get("fingerprint") == fingerprint:
+        return {**patterns, "analysis": cached["text"], "analysis_cached": True}
     
-    for session in sessions:
-        try:
-            started = datetime.fromisoformat(session["started_at"].replace('Z', '+00:00'))
-            hour = started.hour
-            day = started.strftime("%a")
-            
-            if hour not in hour_data:
-                hour_data[hour] = {"sessions": 0, "total_duration": 0}
-            
-            hour_data[hour]["sessions"] += 1
-            hour_data[hour]["total_duration"] += session.get("focus_duration", 25)
-            day_data[day] += session.get("focus_duration", 25)
-        except:
-            continue
-    
-    # Find peak hours
-    peak_hours = sorted(hour_data.items(), key=lambda x: x[1]["sessions"], reverse=True)[:3]
-    peak_days = sorted(day_data.items(), key=lambda x: x[1], reverse=True)[:3]
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
     
     # Build analysis context
     context = f"""
-    Focus Pattern Analysis (Last 14 days):
-    - Total sessions: {len(sessions)}
-    - Total focus time: {sum(s.get('focus_duration', 25) for s in sessions)} minutes
+    Focus Pattern Analysis (Last {days} days, times in {tz}):
+    - Total sessions: {patterns['total_sessions']}
+    - Total focus time: {patterns['total_focus_minutes']} minutes
     
     Sessions by hour (top performers):
-    {chr(10).join([f"- {h}:00: {d['sessions']} sessions ({d['total_duration']} min)" for h, d in peak_hours])}
+    {chr(10).join([f"- {h['hour']}:00: {h['sessions']} sessions ({h['total_duration']} min)" for h in patterns['peak_hours']])}
     
     Focus time by day of week:
-    {chr(10).join([f"- {day}: {minutes} min" for day, minutes in sorted(day_data.items(), key=lambda x: x[1], reverse=True)])}
+    {chr(10).join([f"- {d['day']}: {d['minutes']} min" for d in sorted(patterns['day_breakdown'], key=lambda x: x['minutes'], reverse=True)])}
     """
     
     chat = LlmChat(
@@ -2198,37 +3583,33 @@ async def ai_focus_patterns(current_user: dict = Depends(get_current_user)):
     ).with_model("openai", "gpt-4o")
     
     message = UserMessage(text=f"Analyze my focus patterns and suggest optimal study times:\n{context}")
-    response = await chat.send_message(message)
+    response = await send_llm_message(chat, message)
     
-    return {
-        "analysis": response,
-        "peak_hours": [{"hour": h, **d} for h, d in peak_hours],
-        "day_breakdown": [{"day": d, "minutes": m} for d, m in sorted(day_data.items(), key=lambda x: ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"].index(x[0]))],
-        "total_sessions": len(sessions),
-        "total_focus_minutes": sum(s.get("focus_duration", 25) for s in sessions)
-    }
+    await db.ai_insight_cache.update_one(
+        {"user_id": user_id, "key": cache_key},
+        {"$set": {"fingerprint": fingerprint, "text": response, "created_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    
+    return {**patterns, "analysis": response, "analysis_cached": False}
 
-@api_router.post("/ai/study-coach")
+@api_router.post("/ai/study-coach", dependencies=[Depends(rate_limit("ai"))])
 async def ai_study_coach(current_user: dict = Depends(get_current_user)):
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     
     user_id = current_user["user_id"]
     
     tasks = await db.tasks.find({"user_id": user_id}, {"_id": 0}).to_list(100)
-    week_start = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    sessions = await db.pomodoro_sessions.find(
-        {"user_id": user_id, "started_at": {"$gte": week_start}},
-        {"_id": 0}
-    ).to_list(100)
+    total_sessions, total_focus = sum_focus(
+        await get_focus_rollups(user_id, 7)
+    )
     goals = await db.goals.find({"user_id": user_id}, {"_id": 0}).to_list(20)
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     
     completed_tasks = len([t for t in tasks if t["status"] == "completed"])
     pending_tasks = len([t for t in tasks if t["status"] == "pending"])
     overdue_tasks = len([t for t in tasks if t.get("due_date") and t["due_date"] < datetime.now(timezone.utc).isoformat() and t["status"] != "completed"])
-    total_sessions = len([s for s in sessions if s["completed"]])
-    total_focus = sum(s.get("focus_duration", 25) for s in sessions if s["completed"])
-    
+
     context = f"""
     Student Productivity Data (Last 7 days):
     - Total tasks: {len(tasks)}
@@ -2254,7 +3635,7 @@ async def ai_study_coach(current_user: dict = Depends(get_current_user)):
     ).with_model("openai", "gpt-4o")
     
     message = UserMessage(text=f"Based on this data, give me personalized study tips:\n{context}")
-    response = await chat.send_message(message)
+    response = await send_llm_message(chat, message)
     
     return {"advice": response, "data_summary": {
         "tasks_completed": completed_tasks,
@@ -2262,7 +3643,7 @@ async def ai_study_coach(current_user: dict = Depends(get_current_user)):
         "sessions_completed": total_sessions
     }}
 
-@api_router.post("/ai/break-down-task")
+@api_router.post("/ai/break-down-task", dependencies=[Depends(rate_limit("ai"))])
 async def ai_break_down_task(request: AIRequest, current_user: dict = Depends(get_current_user)):
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     
@@ -2277,7 +3658,7 @@ async def ai_break_down_task(request: AIRequest, current_user: dict = Depends(ge
     
     context = request.context or ""
     message = UserMessage(text=f"Break down this task into smaller steps:\nTask: {request.task_title}\nContext: {context}")
-    response = await chat.send_message(message)
+    response = await send_llm_message(chat, message)
     
     import json
     try:
@@ -2292,28 +3673,26 @@ async def ai_break_down_task(request: AIRequest, current_user: dict = Depends(ge
     
     return {"original_task": request.task_title, "subtasks": subtasks}
 
-@api_router.post("/ai/weekly-summary")
+@api_router.post("/ai/weekly-summary", dependencies=[Depends(rate_limit("ai"))])
 async def ai_weekly_summary(current_user: dict = Depends(get_current_user)):
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     
     user_id = current_user["user_id"]
-    week_start = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
+    week_start = datetime.now(timezone.utc) - timedelta(days=7)
     
     tasks = await db.tasks.find({"user_id": user_id}, {"_id": 0}).to_list(200)
-    sessions = await db.pomodoro_sessions.find(
-        {"user_id": user_id, "started_at": {"$gte": week_start}},
-        {"_id": 0}
-    ).to_list(200)
+    total_sessions, total_focus = sum_focus(
+        await get_focus_rollups(user_id, 7)
+    )
     goals = await db.goals.find({"user_id": user_id}, {"_id": 0}).to_list(20)
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     
-    completed_this_week = len([t for t in tasks if t.get("completed_at") and t["completed_at"] >= week_start])
-    total_focus = sum(s.get("focus_duration", 25) for s in sessions if s["completed"])
+    completed_this_week = len([t for t in tasks if t.get("completed_at") and parse_timestamp(t["completed_at"]) >= week_start])
     
     context = f"""
     Weekly Summary Data:
     - Tasks completed this week: {completed_this_week}
-    - Total Pomodoro sessions: {len([s for s in sessions if s["completed"]])}
+    - Total Pomodoro sessions: {total_sessions}
     - Total focus time: {total_focus} minutes ({round(total_focus/60, 1)} hours)
     - Goals in progress: {len([g for g in goals if not g["completed"]])}
     - Goals completed: {len([g for g in goals if g["completed"]])}
@@ -2328,73 +3707,25 @@ async def ai_weekly_summary(current_user: dict = Depends(get_current_user)):
     ).with_model("openai", "gpt-4o")
     
     message = UserMessage(text=f"Write my weekly study summary:\n{context}")
-    response = await chat.send_message(message)
+    response = await send_llm_message(chat, message)
     
     return {
         "summary": response,
         "stats": {
             "tasks_completed": completed_this_week,
             "focus_hours": round(total_focus / 60, 1),
-            "sessions": len([s for s in sessions if s["completed"]]),
+            "sessions": total_sessions,
             "xp_earned": user.get('weekly_xp', 0)
         }
     }
 
-@api_router.post("/ai/burnout-check")
+@api_router.post("/ai/burnout-check", dependencies=[Depends(rate_limit("insights"))])
 async def ai_burnout_check(current_user: dict = Depends(get_current_user)):
-    user_id = current_user["user_id"]
-    
-    check_start = (datetime.now(timezone.utc) - timedelta(days=4)).isoformat()
-    
-    sessions = await db.pomodoro_sessions.find(
-        {"user_id": user_id, "completed": True, "started_at": {"$gte": check_start}},
-        {"_id": 0}
-    ).to_list(200)
-    
-    tasks = await db.tasks.find(
-        {"user_id": user_id, "status": {"$ne": "completed"}},
-        {"_id": 0}
-    ).to_list(200)
-    
-    overdue_count = len([t for t in tasks if t.get("due_date") and t["due_date"] < datetime.now(timezone.utc).isoformat()])
-    total_focus = sum(s.get("focus_duration", 25) for s in sessions)
-    daily_avg = total_focus / 4
-    
-    warnings = []
-    risk_level = "low"
-    
-    if daily_avg > 240:
-        warnings.append("You've been averaging over 4 hours of focus time daily. Consider taking breaks.")
-        risk_level = "medium"
-    
-    if len(sessions) > 24:
-        warnings.append("High number of Pomodoro sessions detected. Make sure you're resting properly.")
-        risk_level = "medium"
-    
-    if overdue_count > 5:
-        warnings.append(f"You have {overdue_count} overdue tasks. Consider prioritizing or rescheduling.")
-        risk_level = "high" if risk_level == "medium" else "medium"
-    
-    if daily_avg > 360 and len(sessions) > 32:
-        risk_level = "high"
-        warnings.append("Warning: Signs of potential burnout detected. Please take a break!")
-    
-    if not warnings:
-        warnings.append("Looking good! Your workload appears balanced.")
-    
-    return {
-        "risk_level": risk_level,
-        "warnings": warnings,
-        "stats": {
-            "avg_daily_focus_minutes": round(daily_avg, 0),
-            "sessions_last_4_days": len(sessions),
-            "overdue_tasks": overdue_count
-        }
-    }
+    return await get_burnout_check(current_user["user_id"])
 
 # ============ SMART PLANNER ============
 
-def calculate_priority_score(task: dict) -> float:
+def calculate_priority_score(task: dict, now: Optional[datetime] = None) -> float:
     """Calculate priority score based on priority and urgency"""
     priority_weights = {"low": 1, "medium": 2, "high": 3}
     urgency_weights = {"none": 1, "soon": 2, "urgent": 3}
@@ -2406,8 +3737,8 @@ def calculate_priority_score(task: dict) -> float:
     urgency = "none"
     if task.get("due_date"):
         try:
-            due = datetime.fromisoformat(task["due_date"].replace('Z', '+00:00'))
-            now = datetime.now(timezone.utc)
+            due = parse_due_date(task["due_date"])
+            now = now or datetime.now(timezone.utc)
             days_until = (due - now).days
             
             if days_until <= 1:
@@ -2431,186 +3762,231 @@ def get_energy_task_filter(energy_level: str, task_priority: str) -> bool:
     else:  # low energy
         return task_priority in ["low", "medium"]  # Only lighter tasks
 
+PLANNER_MAX_RANGE_DAYS = 62
+
+# Until migration 0005 has backfilled iso_date, schedules saved before it
+# existed are matched by the raw date they were saved with
+legacy_schedule_dates = True
+
+def date_spellings(iso_date: str) -> List[str]:
+    """The ways a client may have sent a date: YYYY-MM-DD and dd-MM-yyyy"""
+    year, month, day = iso_date.split("-")
+    return [iso_date, f"{day}-{month}-{year}"]
+
+def schedule_filter(user_id: str, date: str) -> dict:
+    """Query for a user's schedule on a date, whichever format the date was saved in"""
+    iso_date = to_iso_date(date)
+    if not legacy_schedule_dates:
+        return {"user_id": user_id, "iso_date": iso_date}
+    return {"user_id": user_id, "$or": [
+        {"iso_date": iso_date},
+        {"date": {"$in": date_spellings(iso_date)}, "iso_date": {"$exists": False}}
+    ]}
+
+async def refresh_legacy_schedule_dates():
+    """Stop matching raw dates once migration 0005 is done"""
+    global legacy_schedule_dates
+    state = await db.schema_migrations.find_one({"migration_id": "0005_schedules_iso_date"}, {"done": 1})
+    legacy_schedule_dates = not (state or {}).get("done")
+
+def parse_planner_date(date: str) -> datetime:
+    try:
+        return datetime.strptime(to_iso_date(date), "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {date}")
+
+@api_router.get("/planner/schedule")
+async def get_schedule_range(
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get all saved schedules between two dates (inclusive)"""
+    start = parse_planner_date(from_date)
+    end = parse_planner_date(to_date)
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (end - start).days >= PLANNER_MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range can span at most {PLANNER_MAX_RANGE_DAYS} days")
+    
+    query = {
+        "user_id": current_user["user_id"],
+        "iso_date": {"$gte": start.strftime("%Y-%m-%d"), "$lte": end.strftime("%Y-%m-%d")}
+    }
+    if legacy_schedule_dates:
+        days = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+        query = {"user_id": query["user_id"], "$or": [
+            {"iso_date": query["iso_date"]},
+            {"date": {"$in": [spelling for day in days for spelling in date_spellings(day)]}, "iso_date": {"$exists": False}}
+        ]}
+    schedules = await db.schedules.find(query, {"_id": 0}).to_list(PLANNER_MAX_RANGE_DAYS * 2)
+    schedules.sort(key=lambda schedule: schedule.get("iso_date") or to_iso_date(schedule["date"]))
+    
+    return {"from": start.strftime("%Y-%m-%d"), "to": end.strftime("%Y-%m-%d"), "schedules": schedules}
+
 @api_router.get("/planner/schedule/{date}")
-async def get_schedule(date: str, current_user: dict = Depends(get_current_user)):
-    """Get the schedule for a specific date"""
-    schedule = await db.schedules.find_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
-    )
+async def get_schedule(date: str, response: Response, current_user: dict = Depends(get_current_user)):
+    """Get the schedule for a specific date.
+    
+    The ETag carries the schedule version; send it back as If-Match when
+    editing blocks to detect concurrent edits.
+    """
+    schedule = await db.schedules.find_one(schedule_filter(current_user["user_id"], date), {"_id": 0})
     
     if not schedule:
-        return {"schedule_id": None, "date": date, "blocks": [], "energy_level": "medium"}
+        return {"schedule_id": None, "date": date, "blocks": [], "energy_level": "medium", "version": 0}
     
+    schedule.setdefault("version", 0)
+    response.headers["ETag"] = f'"{schedule["version"]}"'
     return schedule
 
-@api_router.post("/planner/generate")
-async def generate_schedule(request: ScheduleGenerateRequest, current_user: dict = Depends(get_current_user)):
-    """Generate an AI-optimized daily schedule"""
-    from emergentintegrations.llm.chat import LlmChat, UserMessage
-    import json
-    
-    user_id = current_user["user_id"]
-    
-    # Get pending tasks
-    tasks = await db.tasks.find(
-        {"user_id": user_id, "status": {"$ne": "completed"}},
-        {"_id": 0}
-    ).to_list(100)
-    
-    # Calculate priority scores and filter by energy
+def score_tasks_for_planning(tasks: list, energy_level: str) -> list:
+    """Attach energy-weighted priority scores to tasks and sort them (highest first)"""
     scored_tasks = []
     for task in tasks:
-        score = calculate_priority_score(task)
-        task["priority_score"] = score
+        # Stored scores are kept fresh by the re-scoring job; only legacy tasks lack one
+        if task.get("priority_score") is None:
+            task["priority_score"] = calculate_priority_score(task)
         
-        # Energy-based filtering
-        if request.energy_level == "low" and task.get("priority") == "high":
+        # Energy-based weighting
+        if energy_level == "low" and task.get("priority") == "high":
             task["priority_score"] *= 0.5  # Reduce priority for demanding tasks on low energy days
-        elif request.energy_level == "high" and task.get("priority") == "high":
+        elif energy_level == "high" and task.get("priority") == "high":
             task["priority_score"] *= 1.3  # Boost priority for important tasks on high energy days
         
         scored_tasks.append(task)
     
-    # Sort by priority score (descending)
     scored_tasks.sort(key=lambda x: x["priority_score"], reverse=True)
+    return scored_tasks
+
+@api_router.post("/planner/generate", dependencies=[Depends(rate_limit("planner"))])
+async def generate_schedule(request: ScheduleGenerateRequest, current_user: dict = Depends(get_current_user)):
+    """Generate an optimized daily schedule with the local planner engine"""
+    user_id = current_user["user_id"]
+    
+    try:
+        hhmm_to_minutes(request.available_start)
+        hhmm_to_minutes(request.available_end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="available_start and available_end must be HH:MM")
+    
+    # Get pending tasks
+    query = {"user_id": user_id, "status": {"$ne": "completed"}}
+    if request.only_unblocked:
+        query["blocked"] = False
+    tasks = await db.tasks.find(query, {"_id": 0}).to_list(100)
+    
+    # Calculate priority scores weighted by energy level
+    scored_tasks = score_tasks_for_planning(tasks, request.energy_level)
     
     # Get Google Calendar events if connected
-    google_events = []
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-    if user and user.get("google_tokens"):
+    iso_date = to_iso_date(request.date)
+    google_events = await get_cached_calendar_events(user, iso_date, iso_date)
+    
+    # Deterministic plan: this is the critical path and takes milliseconds
+    plan = generate_rule_based_schedule(scored_tasks, request, google_events)
+    schedule_doc = build_schedule_doc(user_id, request, plan, google_events)
+    
+    # Optional LLM polish: explain the plan, never re-plan it
+    if request.ai_polish:
         try:
-            from google.oauth2.credentials import Credentials
-            from googleapiclient.discovery import build
-            from google.auth.transport.requests import Request as GoogleRequest
-            
-            tokens = user["google_tokens"]
-            creds = Credentials(
-                token=tokens.get('access_token'),
-                refresh_token=tokens.get('refresh_token'),
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=os.environ.get('GOOGLE_CLIENT_ID'),
-                client_secret=os.environ.get('GOOGLE_CLIENT_SECRET')
-            )
-            
-            if creds.expired and creds.refresh_token:
-                creds.refresh(GoogleRequest())
-                await db.users.update_one(
-                    {"user_id": user_id},
-                    {"$set": {"google_tokens.access_token": creds.token}}
-                )
-            
-            service = build('calendar', 'v3', credentials=creds)
-            
-            # Get events for the requested date
-            date_start = f"{request.date}T00:00:00Z"
-            date_end = f"{request.date}T23:59:59Z"
-            
-            events_result = service.events().list(
-                calendarId='primary',
-                timeMin=date_start,
-                timeMax=date_end,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            google_events = events_result.get('items', [])
+            schedule_doc["explanation"] = await explain_blocks_with_ai(request.date, request.energy_level, schedule_doc["blocks"])
         except Exception as e:
-            logging.warning(f"Failed to fetch Google Calendar events: {e}")
-    
-    # Build context for AI
-    tasks_context = "\n".join([
-        f"- {t['title']} (priority: {t.get('priority', 'medium')}, score: {t['priority_score']:.1f}, est: {t.get('estimated_time', 30)}min)"
-        for t in scored_tasks[:15]  # Top 15 tasks
-    ])
+            logging.warning(f"AI schedule explanation failed, keeping engine explanation: {e}")
+    
+    # Upsert: update if exists, insert if not. A regenerated plan is a new version
+    saved = await db.schedules.find_one_and_update(
+        schedule_filter(user_id, request.date),
+        {"$set": schedule_doc, "$inc": {"version": 1}},
+        upsert=True,
+        projection={"_id": 0, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    schedule_doc["version"] = saved["version"]
     
-    events_context = ""
-    if google_events:
-        events_context = "\nExisting calendar events (LOCKED - cannot move):\n" + "\n".join([
-            f"- {e.get('summary', 'Event')} ({e['start'].get('dateTime', e['start'].get('date', ''))[:16]} - {e['end'].get('dateTime', e['end'].get('date', ''))[:16]})"
-            for e in google_events
-        ])
+    return schedule_doc
+
+@api_router.post("/planner/generate-range", dependencies=[Depends(rate_limit("planner"))])
+async def generate_schedule_range(request: ScheduleRangeGenerateRequest, current_user: dict = Depends(get_current_user)):
+    """Plan several consecutive days in one pass.
     
-    ai_prompt = f"""You are a productivity planner.
-
-Given:
-- Energy level: {request.energy_level}
-- Available hours: {request.available_start} to {request.available_end}
-- Pomodoro style: {request.pomodoro_style} (50 min work, 10 min break)
-- Include breaks: {request.include_breaks}
-
-Tasks (sorted by priority score):
-{tasks_context}
-{events_context}
-
-Generate a realistic daily schedule.
-Rules:
-- High priority + urgent tasks first
-- Break tasks into ≤50 minute sessions
-- Include 10 min breaks between work blocks
-- For low energy: schedule easier tasks, more breaks
-- For high energy: tackle harder tasks in morning
-- Avoid scheduling over locked events
-- Return JSON only
-
-Output format:
-{{
-  "schedule": [
-    {{"start": "09:00", "end": "09:50", "type": "task", "title": "Task name", "task_id": "task_xxx"}},
-    {{"start": "09:50", "end": "10:00", "type": "break", "title": "Short break"}},
-    {{"start": "10:00", "end": "10:50", "type": "task", "title": "Another task"}}
-  ],
-  "explanation": "Brief explanation of the schedule logic"
-}}"""
+    Tasks are scored and calendar events fetched once for the whole range. Each
+    day is planned from the work the previous days left over, so nothing is
+    double-booked and long tasks continue where they stopped.
+    """
+    user_id = current_user["user_id"]
     
-    chat = LlmChat(
-        api_key=os.environ.get('EMERGENT_LLM_KEY'),
-        session_id=f"planner_{user_id}_{request.date}",
-        system_message="You are an AI productivity planner. Generate optimal daily schedules based on task priorities, energy levels, and existing commitments. Always return valid JSON."
-    ).with_model("openai", "gpt-4o")
+    try:
+        hhmm_to_minutes(request.available_start)
+        hhmm_to_minutes(request.available_end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="available_start and available_end must be HH:MM")
+    if not 1 <= request.days <= PLANNER_MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {PLANNER_MAX_RANGE_DAYS}")
+    
+    start = parse_planner_date(request.start_date)
+    dates = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(request.days)]
+    
+    query = {"user_id": user_id, "status": {"$ne": "completed"}}
+    if request.only_unblocked:
+        query["blocked"] = False
+    tasks = await db.tasks.find(query, {"_id": 0}).to_list(1000)
+    remaining_tasks = score_tasks_for_planning(tasks, request.energy_level)
     
-    message = UserMessage(text=ai_prompt)
-    response = await chat.send_message(message)
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    google_events = await get_cached_calendar_events(user, dates[0], dates[-1])
+    
+    schedule_docs = []
+    unscheduled = []
+    for date in dates:
+        day_request = ScheduleGenerateRequest(
+            date=date,
+            energy_level=request.energy_level,
+            available_start=request.available_start,
+            available_end=request.available_end,
+            include_breaks=request.include_breaks,
+            pomodoro_style=request.pomodoro_style
+        )
+        day_events = events_on_day(google_events, date)
+        plan = generate_rule_based_schedule(remaining_tasks, day_request, day_events, request.max_work_minutes_per_day)
+        schedule_docs.append(build_schedule_doc(user_id, day_request, plan, day_events))
+        
+        # Carry only the unfinished work over to the next day
+        unscheduled = plan["unscheduled"]
+        leftover = {u["task_id"]: u.get("remaining_minutes") for u in unscheduled}
+        remaining_tasks = [
+            {**t, "estimated_time": leftover[t["task_id"]] or t.get("estimated_time")}
+            for t in remaining_tasks if t["task_id"] in leftover
+        ]
     
-    # Parse AI response
-    try:
-        json_start = response.find('{')
-        json_end = response.rfind('}') + 1
-        if json_start != -1 and json_end > json_start:
-            ai_schedule = json.loads(response[json_start:json_end])
-        else:
-            raise ValueError("No JSON found")
-    except Exception as e:
-        logging.error(f"Failed to parse AI schedule: {e}")
-        # Fallback: generate rule-based schedule
-        ai_schedule = generate_rule_based_schedule(scored_tasks, request, google_events)
+    await db.schedules.bulk_write([
+        UpdateOne(schedule_filter(user_id, doc["date"]), {"$set": doc, "$inc": {"version": 1}}, upsert=True)
+        for doc in schedule_docs
+    ])
     
+    return {
+        "start_date": dates[0],
+        "end_date": dates[-1],
+        "schedules": schedule_docs,
+        "unscheduled": unscheduled
+    }
+
+def build_schedule_doc(user_id: str, request: ScheduleGenerateRequest, plan: dict, google_events: list) -> dict:
+    """Turn an engine plan plus the day's calendar events into a schedule document"""
     # Add Google Calendar events as locked blocks
-    blocks = []
-    for event in google_events:
-        start_dt = event['start'].get('dateTime', event['start'].get('date', ''))
-        end_dt = event['end'].get('dateTime', event['end'].get('date', ''))
-        
-        blocks.append({
-            "id": f"gcal_{event.get('id', uuid.uuid4().hex[:8])}",
-            "start": start_dt[11:16] if 'T' in start_dt else "00:00",
-            "end": end_dt[11:16] if 'T' in end_dt else "23:59",
-            "type": "event",
-            "title": event.get('summary', 'Calendar Event'),
-            "is_locked": True,
-            "color": "#8B5CF6"  # Purple for calendar events
-        })
+    blocks = [google_event_to_block(event) for event in google_events]
     
-    # Add AI-generated schedule blocks
-    for block in ai_schedule.get("schedule", []):
-        block_id = block.get("task_id") or f"block_{uuid.uuid4().hex[:8]}"
+    # Add engine-generated schedule blocks
+    for block in plan["schedule"]:
         blocks.append({
-            "id": block_id,
+            "id": f"block_{uuid.uuid4().hex[:8]}",
             "start": block["start"],
             "end": block["end"],
             "type": block["type"],
             "title": block["title"],
             "task_id": block.get("task_id"),
+            "priority_score": block.get("priority_score"),
             "is_locked": False,
             "color": "#22C55E" if block["type"] == "task" else "#6B7280"
         })
@@ -2618,89 +3994,366 @@ Output format:
     # Sort blocks by start time
     blocks.sort(key=lambda x: x["start"])
     
-    # Save schedule
-    schedule_id = f"sched_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc).isoformat()
-    
-    schedule_doc = {
-        "schedule_id": schedule_id,
+    return {
+        "schedule_id": f"sched_{uuid.uuid4().hex[:12]}",
         "user_id": user_id,
         "date": request.date,
+        "iso_date": to_iso_date(request.date),
         "blocks": blocks,
         "energy_level": request.energy_level,
         "available_hours": calculate_available_hours(request.available_start, request.available_end),
-        "explanation": ai_schedule.get("explanation", ""),
+        "explanation": plan["explanation"],
+        "unscheduled": plan["unscheduled"],
         "created_at": now,
         "updated_at": now
     }
+
+# ============ PLANNER ENGINE ============
+
+MINUTES_PER_DAY = 24 * 60
+
+PLANNER_CONFIG = {
+    "default_task_minutes": 30,  # used when a task has no estimated_time
+    "pomodoro_work": 50,
+    "pomodoro_break": 10,
+    "plain_work": 60,  # chunk size when pomodoro_style is off
+    "low_energy_work": 25,  # shorter chunks (so more breaks) on low energy days
+    "min_chunk": 15,  # don't squeeze work into gaps shorter than this
+}
+
+def hhmm_to_minutes(value: str) -> int:
+    """Convert an HH:MM string to minutes since midnight"""
+    hours, minutes = (int(part) for part in value.split(":")[:2])
+    if not (0 <= hours < 24 and 0 <= minutes < 60) and (hours, minutes) != (24, 0):
+        raise ValueError(f"Time out of range: {value}")
+    return hours * 60 + minutes
+
+def minutes_to_hhmm(value: int) -> str:
+    """Convert minutes since midnight to an HH:MM string (end of day is 23:59)"""
+    value = max(0, min(value, MINUTES_PER_DAY - 1))
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+def to_iso_date(date: str) -> str:
+    """Normalize a planner date (YYYY-MM-DD or the frontend's dd-MM-yyyy) to YYYY-MM-DD"""
+    parts = date.split('-')
+    if len(parts) == 3 and len(parts[0]) == 2:
+        return f"{parts[2]}-{parts[1]}-{parts[0]}"
+    return date
+
+def google_event_to_block(event: dict) -> dict:
+    """Convert a Google Calendar event into a locked schedule block"""
+    start_dt = event['start'].get('dateTime', event['start'].get('date', ''))
+    end_dt = event['end'].get('dateTime', event['end'].get('date', ''))
     
-    # Upsert: update if exists, insert if not
-    await db.schedules.update_one(
-        {"user_id": user_id, "date": request.date},
-        {"$set": schedule_doc},
-        upsert=True
-    )
+    return {
+        "id": f"gcal_{event.get('id', uuid.uuid4().hex[:8])}",
+        "start": start_dt[11:16] if 'T' in start_dt else "00:00",
+        "end": end_dt[11:16] if 'T' in end_dt else "23:59",
+        "type": "event",
+        "title": event.get('summary', 'Calendar Event'),
+        "is_locked": True,
+        "color": "#8B5CF6"  # Purple for calendar events
+    }
+
+def events_on_day(events: list, date: str) -> list:
+    """Events from a multi-day fetch that touch the given YYYY-MM-DD day"""
+    day_events = []
+    for event in events:
+        start_dt = event['start'].get('dateTime', event['start'].get('date', ''))
+        end_dt = event['end'].get('dateTime', event['end'].get('date', ''))
+        if 'T' in end_dt:
+            touches = start_dt[:10] <= date <= end_dt[:10]
+        else:
+            touches = start_dt[:10] <= date < end_dt[:10]  # all-day end dates are exclusive
+        if touches:
+            day_events.append(event)
+    return day_events
+
+def get_event_window(event: dict, date: str) -> Optional[tuple]:
+    """Return the (start, end) minutes an event blocks on `date`, or None if it doesn't block time.
     
-    return schedule_doc
+    Events marked "free" in Google (transparency=transparent, the default for
+    all-day events) don't block. Opaque all-day events block the whole day and
+    events spilling over midnight are clipped to the day.
+    """
+    if event.get("transparency") == "transparent":
+        return None
+    
+    date = to_iso_date(date)
+    start_dt = event['start'].get('dateTime', event['start'].get('date', ''))
+    end_dt = event['end'].get('dateTime', event['end'].get('date', ''))
+    
+    if 'T' not in start_dt:
+        return (0, MINUTES_PER_DAY)
+    if start_dt[:10] > date:
+        return None
+    
+    start = hhmm_to_minutes(start_dt[11:16]) if start_dt[:10] == date else 0
+    end = hhmm_to_minutes(end_dt[11:16]) if 'T' in end_dt and end_dt[:10] <= date else MINUTES_PER_DAY
+    if end_dt[:10] < date or end <= start:
+        return None
+    return (start, end)
 
-def generate_rule_based_schedule(tasks: list, request: ScheduleGenerateRequest, google_events: list) -> dict:
-    """Fallback rule-based schedule generator"""
-    schedule = []
-    current_time = datetime.strptime(request.available_start, "%H:%M")
-    end_time = datetime.strptime(request.available_end, "%H:%M")
-    
-    work_duration = 50 if request.pomodoro_style else 60
-    break_duration = 10 if request.include_breaks else 0
-    
-    # Get locked event times
-    locked_times = []
-    for event in google_events:
-        start_dt = event['start'].get('dateTime', '')
-        end_dt = event['end'].get('dateTime', '')
-        if start_dt and end_dt:
-            locked_times.append((start_dt[11:16], end_dt[11:16]))
-    
-    task_index = 0
-    while current_time < end_time and task_index < len(tasks):
-        block_start = current_time.strftime("%H:%M")
-        block_end = (current_time + timedelta(minutes=work_duration)).strftime("%H:%M")
-        
-        # Check if this conflicts with a locked event
-        conflicts = False
-        for lock_start, lock_end in locked_times:
-            if block_start < lock_end and block_end > lock_start:
-                conflicts = True
-                # Skip to after the locked event
-                current_time = datetime.strptime(lock_end, "%H:%M")
-                break
-        
-        if conflicts:
+class ScheduleIntervalIndex:
+    """Interval index over the minutes of one day.
+    
+    A lazy segment tree stores how many intervals cover each minute, so
+    overlap checks, insert/delete and stepping to the next free or busy
+    minute are all O(log n). Intervals are half-open [start, end) minute
+    offsets registered under a key, which is what gets reported on conflict.
+    """
+    
+    def __init__(self, size: int = MINUTES_PER_DAY):
+        self.size = size
+        self.intervals = {}
+        self._max = [0] * (4 * size)
+        self._min = [0] * (4 * size)
+        self._lazy = [0] * (4 * size)
+    
+    def _clip(self, start: int, end: int) -> tuple:
+        return max(0, start), min(self.size, end)
+    
+    def _push(self, node: int):
+        if self._lazy[node]:
+            for child in (2 * node, 2 * node + 1):
+                self._max[child] += self._lazy[node]
+                self._min[child] += self._lazy[node]
+                self._lazy[child] += self._lazy[node]
+            self._lazy[node] = 0
+    
+    def _add(self, node: int, lo: int, hi: int, start: int, end: int, delta: int):
+        if end <= lo or hi <= start:
+            return
+        if start <= lo and hi <= end:
+            self._max[node] += delta
+            self._min[node] += delta
+            self._lazy[node] += delta
+            return
+        self._push(node)
+        mid = (lo + hi) // 2
+        self._add(2 * node, lo, mid, start, end, delta)
+        self._add(2 * node + 1, mid, hi, start, end, delta)
+        self._max[node] = max(self._max[2 * node], self._max[2 * node + 1])
+        self._min[node] = min(self._min[2 * node], self._min[2 * node + 1])
+    
+    def _query_max(self, node: int, lo: int, hi: int, start: int, end: int) -> int:
+        if end <= lo or hi <= start:
+            return 0
+        if start <= lo and hi <= end:
+            return self._max[node]
+        self._push(node)
+        mid = (lo + hi) // 2
+        return max(
+            self._query_max(2 * node, lo, mid, start, end),
+            self._query_max(2 * node + 1, mid, hi, start, end)
+        )
+    
+    def _first(self, node: int, lo: int, hi: int, pos: int, free: bool) -> int:
+        """First minute >= pos that is free (coverage 0) or busy (coverage > 0)"""
+        if hi <= pos:
+            return self.size
+        if free and self._min[node] > 0:
+            return self.size
+        if not free and self._max[node] == 0:
+            return self.size
+        if hi - lo == 1:
+            return lo
+        self._push(node)
+        mid = (lo + hi) // 2
+        found = self._first(2 * node, lo, mid, pos, free)
+        if found == self.size:
+            found = self._first(2 * node + 1, mid, hi, pos, free)
+        return found
+    
+    def insert(self, key: str, start: int, end: int):
+        """Add (or move) the interval registered under key"""
+        if key in self.intervals:
+            self.delete(key)
+        start, end = self._clip(start, end)
+        if start >= end:
+            return
+        self.intervals[key] = (start, end)
+        self._add(1, 0, self.size, start, end, 1)
+    
+    def delete(self, key: str):
+        """Remove the interval registered under key, if any"""
+        interval = self.intervals.pop(key, None)
+        if interval:
+            self._add(1, 0, self.size, interval[0], interval[1], -1)
+    
+    def overlaps(self, start: int, end: int) -> bool:
+        start, end = self._clip(start, end)
+        return start < end and self._query_max(1, 0, self.size, start, end) > 0
+    
+    def conflicts(self, start: int, end: int) -> list:
+        """Keys of the intervals overlapping [start, end)"""
+        if not self.overlaps(start, end):
+            return []
+        return [key for key, (s, e) in self.intervals.items() if s < end and start < e]
+    
+    def next_free(self, pos: int) -> int:
+        return self._first(1, 0, self.size, max(0, pos), True)
+    
+    def next_busy(self, pos: int) -> int:
+        return self._first(1, 0, self.size, max(0, pos), False)
+    
+    def free_gaps(self, start: int, end: int):
+        """Yield the free (start, end) gaps inside [start, end)"""
+        pos = start
+        while pos < end:
+            gap_start = self.next_free(pos)
+            if gap_start >= end:
+                return
+            gap_end = min(self.next_busy(gap_start), end)
+            yield (gap_start, gap_end)
+            pos = gap_end
+    
+    def find_slot(self, earliest: int, wanted: int, window_end: int, min_length: int = 1) -> Optional[tuple]:
+        """First-fit: up to `wanted` free minutes at or after `earliest`, at least min(wanted, min_length) long"""
+        for gap_start, gap_end in self.free_gaps(earliest, window_end):
+            length = min(wanted, gap_end - gap_start)
+            if length >= min(wanted, min_length):
+                return (gap_start, gap_start + length)
+        return None
+
+def order_tasks_for_planning(tasks: list) -> list:
+    """Order tasks so prerequisites come first, highest priority score first among ready tasks.
+    
+    Dependencies on tasks outside the list (completed or unknown) count as
+    satisfied. Tasks caught in a dependency cycle are appended by score.
+    """
+    by_id = {t["task_id"]: t for t in tasks}
+    indegree = {}
+    dependents = {}
+    for task in tasks:
+        deps = {d for d in (task.get("depends_on") or []) if d in by_id and d != task["task_id"]}
+        indegree[task["task_id"]] = len(deps)
+        for dep in deps:
+            dependents.setdefault(dep, []).append(task["task_id"])
+    
+    heap = [(-t.get("priority_score", 0), i, t["task_id"]) for i, t in enumerate(tasks) if indegree[t["task_id"]] == 0]
+    heapq.heapify(heap)
+    position = {t["task_id"]: i for i, t in enumerate(tasks)}
+    
+    ordered = []
+    while heap:
+        _, _, task_id = heapq.heappop(heap)
+        ordered.append(by_id[task_id])
+        for dependent in dependents.get(task_id, []):
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                heapq.heappush(heap, (-by_id[dependent].get("priority_score", 0), position[dependent], dependent))
+    
+    if len(ordered) < len(tasks):
+        placed = {t["task_id"] for t in ordered}
+        cyclic = [t for t in tasks if t["task_id"] not in placed]
+        cyclic.sort(key=lambda t: t.get("priority_score", 0), reverse=True)
+        ordered.extend(cyclic)
+    
+    return ordered
+
+def generate_rule_based_schedule(
+    tasks: list,
+    request: ScheduleGenerateRequest,
+    google_events: list,
+    work_limit: Optional[int] = None
+) -> dict:
+    """Deterministic constraint-based schedule generator.
+    
+    Packs tasks (in dependency order, then by priority score) into the free
+    time left between locked calendar events, splitting each task's
+    estimated_time into pomodoro-sized chunks with breaks in between.
+    work_limit caps the total minutes of work planned for the day.
+    """
+    window_start = hhmm_to_minutes(request.available_start)
+    window_end = hhmm_to_minutes(request.available_end)
+    
+    index = ScheduleIntervalIndex()
+    busy = [w for w in (get_event_window(e, request.date) for e in google_events) if w]
+    for i, (start, end) in enumerate(busy):
+        index.insert(f"event_{i}", start, end)
+    
+    if request.energy_level == "low":
+        work_duration = PLANNER_CONFIG["low_energy_work"]
+    elif request.pomodoro_style:
+        work_duration = PLANNER_CONFIG["pomodoro_work"]
+    else:
+        work_duration = PLANNER_CONFIG["plain_work"]
+    break_duration = PLANNER_CONFIG["pomodoro_break"] if request.include_breaks else 0
+    
+    placements = []
+    unscheduled = []
+    finished_at = {}  # task_id -> end minute of its last chunk
+    work_planned = 0
+    pending_ids = {t["task_id"] for t in tasks}
+    
+    for task in order_tasks_for_planning(tasks):
+        deps = [d for d in (task.get("depends_on") or []) if d in pending_ids and d != task["task_id"]]
+        if any(d not in finished_at for d in deps):
+            unscheduled.append({"task_id": task["task_id"], "title": task["title"], "reason": "blocked_by_dependency"})
             continue
         
-        task = tasks[task_index]
-        schedule.append({
-            "start": block_start,
-            "end": block_end,
-            "type": "task",
-            "title": task["title"],
-            "task_id": task.get("task_id")
-        })
+        earliest = max([window_start] + [finished_at[d] for d in deps])
+        remaining = task.get("estimated_time") or PLANNER_CONFIG["default_task_minutes"]
+        chunks = []
         
-        current_time += timedelta(minutes=work_duration)
+        while remaining > 0:
+            wanted = min(remaining, work_duration)
+            if work_limit is not None:
+                wanted = min(wanted, work_limit - work_planned)
+                if wanted <= 0:
+                    break
+            slot = index.find_slot(earliest, wanted, window_end, PLANNER_CONFIG["min_chunk"])
+            if not slot:
+                break
+            index.insert(f"{task['task_id']}_{len(chunks)}", *slot)
+            chunks.append(slot)
+            remaining -= slot[1] - slot[0]
+            work_planned += slot[1] - slot[0]
+            earliest = slot[1]
+            
+            if break_duration:
+                brk = index.find_slot(slot[1], break_duration, window_end)
+                if brk and brk[0] == slot[1]:
+                    index.insert(f"break_{slot[1]}", *brk)
+                    placements.append({"start": brk[0], "end": brk[1], "type": "break", "title": "Short break"})
         
-        # Add break
-        if request.include_breaks and current_time < end_time:
-            schedule.append({
-                "start": current_time.strftime("%H:%M"),
-                "end": (current_time + timedelta(minutes=break_duration)).strftime("%H:%M"),
-                "type": "break",
-                "title": "Short break"
+        for part, (start, end) in enumerate(chunks, start=1):
+            title = task["title"] if len(chunks) == 1 else f"{task['title']} ({part}/{len(chunks)})"
+            placements.append({
+                "start": start,
+                "end": end,
+                "type": "task",
+                "title": title,
+                "task_id": task["task_id"],
+                "priority_score": task.get("priority_score")
             })
-            current_time += timedelta(minutes=break_duration)
         
-        task_index += 1
+        if remaining > 0:
+            unscheduled.append({
+                "task_id": task["task_id"],
+                "title": task["title"],
+                "reason": "no_free_time",
+                "remaining_minutes": remaining
+            })
+        else:
+            finished_at[task["task_id"]] = earliest
+    
+    placements.sort(key=lambda b: b["start"])
+    schedule = [{**b, "start": minutes_to_hhmm(b["start"]), "end": minutes_to_hhmm(b["end"])} for b in placements]
+    
+    planned_tasks = len({b["task_id"] for b in placements if b["type"] == "task"})
+    explanation = (
+        f"Planned {work_planned} minutes of work across {planned_tasks} tasks between "
+        f"{request.available_start} and {request.available_end}, highest priority first and "
+        f"prerequisites before the tasks that depend on them, in {work_duration}-minute sessions "
+        f"around {len(busy)} calendar events."
+    )
+    if unscheduled:
+        explanation += f" {len(unscheduled)} tasks didn't fit and were left unscheduled."
     
-    return {"schedule": schedule, "explanation": "Rule-based schedule generated as fallback"}
+    return {"schedule": schedule, "explanation": explanation, "unscheduled": unscheduled}
 
 def calculate_available_hours(start: str, end: str) -> float:
     """Calculate hours between two HH:MM times"""
@@ -2708,75 +4361,206 @@ def calculate_available_hours(start: str, end: str) -> float:
     end_dt = datetime.strptime(end, "%H:%M")
     return (end_dt - start_dt).seconds / 3600
 
+def build_block_index(blocks: list, exclude_id: Optional[str] = None) -> ScheduleIntervalIndex:
+    """Index a day's blocks by time; breaks are soft and don't count as conflicts"""
+    index = ScheduleIntervalIndex()
+    for block in blocks:
+        if block.get("id") == exclude_id or block.get("type") == "break":
+            continue
+        try:
+            index.insert(block["id"], hhmm_to_minutes(block["start"]), hhmm_to_minutes(block["end"]))
+        except (KeyError, ValueError):
+            continue
+    return index
+
+SCHEDULE_WRITE_RETRIES = 5  # lost compare-and-set races retried before giving up
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Schedule version from an If-Match header ('3', '"3"' or 'W/"3"')"""
+    if if_match is None:
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a schedule version")
+
+def apply_block_moves(blocks: list, moves: list, on_conflict: str) -> list:
+    """Apply block moves to a day's blocks, all-or-nothing.
+    
+    Moved blocks are taken out of the day first and placed back in request
+    order, so a batch may swap or shuffle blocks freely. Each is checked
+    against the unmoved blocks and the moves placed before it.
+    """
+    by_id = {b.get("id"): b for b in blocks}
+    seen = set()
+    timed = []
+    for move in moves:
+        block = by_id.get(move.block_id)
+        if not block:
+            raise HTTPException(status_code=404, detail=f"Block not found: {move.block_id}")
+        if block.get("is_locked"):
+            raise HTTPException(status_code=400, detail="Cannot modify locked blocks")
+        if move.block_id in seen:
+            raise HTTPException(status_code=400, detail=f"Block moved twice: {move.block_id}")
+        seen.add(move.block_id)
+        
+        if move.start or move.end:
+            try:
+                start = hhmm_to_minutes(move.start or block["start"])
+                end = hhmm_to_minutes(move.end or block["end"])
+            except ValueError:
+                raise HTTPException(status_code=400, detail="start and end must be HH:MM")
+            if end <= start:
+                raise HTTPException(status_code=400, detail="Block must end after it starts")
+            timed.append((block, start, end))
+        if move.task_id is not None:
+            block["task_id"] = move.task_id
+    
+    # Reject or shift moves that overlap other blocks
+    moved_ids = {block["id"] for block, _, _ in timed}
+    index = build_block_index([b for b in blocks if b.get("id") not in moved_ids])
+    for block, start, end in timed:
+        conflicts = index.conflicts(start, end)
+        if conflicts:
+            if on_conflict != "shift":
+                titles = [b["title"] for b in blocks if b.get("id") in conflicts]
+                raise HTTPException(status_code=409, detail=f"Block overlaps: {', '.join(titles)}")
+            slot = index.find_slot(start, end - start, MINUTES_PER_DAY, end - start)
+            if not slot:
+                raise HTTPException(status_code=409, detail="No free slot later in the day for this block")
+            start, end = slot
+        if block.get("type") != "break":  # breaks stay soft once moved, too
+            index.insert(block["id"], start, end)
+        block["start"] = minutes_to_hhmm(start)
+        block["end"] = minutes_to_hhmm(end)
+    
+    # Unmoved breaks a moved (non-break) block now covers are dropped
+    covering = [block for block, _, _ in timed if block.get("type") != "break"]
+    blocks = [
+        b for b in blocks
+        if b.get("type") != "break" or b.get("id") in moved_ids or not any(
+            b["end"] > block["start"] and b["start"] < block["end"] for block in covering
+        )
+    ]
+    blocks.sort(key=lambda x: x["start"])
+    return blocks
+
+async def write_schedule_blocks(user_id: str, date: str, if_match: Optional[str], change) -> dict:
+    """Read-modify-write a day's blocks with optimistic concurrency.
+    
+    change(blocks) returns the new block list. The write only lands if the
+    schedule version is still the one read; otherwise another edit won. With
+    If-Match the caller's version must match (409 if not), without it the
+    change is re-applied on the fresh schedule.
+    """
+    expected = parse_if_match(if_match)
+    for _ in range(SCHEDULE_WRITE_RETRIES):
+        schedule = await db.schedules.find_one(schedule_filter(user_id, date), {"_id": 0})
+        if not schedule:
+            raise HTTPException(status_code=404, detail="Schedule not found")
+        
+        version = schedule.get("version", 0)
+        if expected is not None and expected != version:
+            raise HTTPException(status_code=409, detail=f"Schedule was modified (current version {version})")
+        
+        blocks = change(schedule.get("blocks", []))
+        result = await db.schedules.update_one(
+            {**schedule_filter(user_id, date), "version": version if "version" in schedule else {"$exists": False}},
+            {"$set": {
+                "blocks": blocks,
+                "version": version + 1,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        if result.matched_count:
+            return {"blocks": blocks, "version": version + 1}
+        if expected is not None:
+            raise HTTPException(status_code=409, detail="Schedule was modified")
+    
+    raise HTTPException(status_code=409, detail="Schedule is being edited concurrently, try again")
+
 @api_router.put("/planner/schedule/{date}/block/{block_id}")
 async def update_schedule_block(
     date: str, 
     block_id: str, 
     update: ScheduleBlockUpdate, 
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update a specific block in a schedule (drag-and-drop support)"""
-    schedule = await db.schedules.find_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
+    move = ScheduleBlockMove(block_id=block_id, start=update.start, end=update.end, task_id=update.task_id)
+    result = await write_schedule_blocks(
+        current_user["user_id"], date, if_match,
+        lambda blocks: apply_block_moves(blocks, [move], update.on_conflict)
     )
     
-    if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
-    
-    # Find and update the block
-    blocks = schedule.get("blocks", [])
-    for i, block in enumerate(blocks):
-        if block.get("id") == block_id:
-            if block.get("is_locked"):
-                raise HTTPException(status_code=400, detail="Cannot modify locked blocks")
-            
-            if update.start:
-                blocks[i]["start"] = update.start
-            if update.end:
-                blocks[i]["end"] = update.end
-            if update.task_id is not None:
-                blocks[i]["task_id"] = update.task_id
-            break
-    else:
-        raise HTTPException(status_code=404, detail="Block not found")
-    
-    # Re-sort blocks
-    blocks.sort(key=lambda x: x["start"])
+    response.headers["ETag"] = f'"{result["version"]}"'
+    return {"message": "Block updated", **result}
+
+@api_router.patch("/planner/schedule/{date}/blocks")
+async def patch_schedule_blocks(
+    date: str,
+    patch: ScheduleBlocksPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Move several blocks in one atomic write (e.g. dragging a run of blocks)"""
+    if not patch.moves:
+        raise HTTPException(status_code=400, detail="No moves given")
     
-    await db.schedules.update_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"$set": {"blocks": blocks, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    result = await write_schedule_blocks(
+        current_user["user_id"], date, if_match,
+        lambda blocks: apply_block_moves(blocks, patch.moves, patch.on_conflict)
     )
     
-    return {"message": "Block updated", "blocks": blocks}
+    response.headers["ETag"] = f'"{result["version"]}"'
+    return {"message": f"{len(patch.moves)} blocks updated", **result}
 
 @api_router.delete("/planner/schedule/{date}/block/{block_id}")
-async def delete_schedule_block(date: str, block_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_schedule_block(
+    date: str,
+    block_id: str,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     """Delete a block from the schedule"""
-    schedule = await db.schedules.find_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
+    query = {
+        **schedule_filter(current_user["user_id"], date),
+        "blocks": {"$elemMatch": {"id": block_id, "is_locked": {"$ne": True}}}
+    }
+    expected = parse_if_match(if_match)
+    if expected is not None:
+        query["version"] = expected if expected else {"$in": [0, None]}
+    
+    # Single atomic $pull: concurrent edits to other blocks are never overwritten
+    schedule = await db.schedules.find_one_and_update(
+        query,
+        {
+            "$pull": {"blocks": {"id": block_id}},
+            "$inc": {"version": 1},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        projection={"_id": 0, "version": 1},
+        return_document=ReturnDocument.BEFORE
     )
     
     if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
-    
-    blocks = schedule.get("blocks", [])
-    original_count = len(blocks)
-    blocks = [b for b in blocks if b.get("id") != block_id or b.get("is_locked")]
-    
-    if len(blocks) == original_count:
+        current = await db.schedules.find_one(
+            {**schedule_filter(current_user["user_id"], date), "blocks.id": block_id},
+            {"_id": 0, "version": 1}
+        )
+        if current and expected is not None and current.get("version", 0) != expected:
+            raise HTTPException(status_code=409, detail=f"Schedule was modified (current version {current.get('version', 0)})")
         raise HTTPException(status_code=404, detail="Block not found or is locked")
     
-    await db.schedules.update_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"$set": {"blocks": blocks, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
-    
-    return {"message": "Block deleted"}
+    version = schedule.get("version", 0) + 1
+    response.headers["ETag"] = f'"{version}"'
+    return {"message": "Block deleted", "version": version}
 
-@api_router.post("/planner/reschedule-task/{task_id}")
+@api_router.post("/planner/reschedule-task/{task_id}", dependencies=[Depends(rate_limit("ai"))])
 async def reschedule_task(task_id: str, current_user: dict = Depends(get_current_user)):
     """Auto-reschedule a skipped task with increased priority"""
     from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -2800,7 +4584,11 @@ async def reschedule_task(task_id: str, current_user: dict = Depends(get_current
     # Update task with increased priority
     await db.tasks.update_one(
         {"task_id": task_id},
-        {"$set": {"priority": new_priority, "rescheduled_count": task.get("rescheduled_count", 0) + 1}}
+        {"$set": {
+            "priority": new_priority,
+            "rescheduled_count": task.get("rescheduled_count", 0) + 1,
+            **compute_priority_fields({**task, "priority": new_priority})
+        }}
     )
     
     # Generate AI explanation
@@ -2811,7 +4599,7 @@ async def reschedule_task(task_id: str, current_user: dict = Depends(get_current
     ).with_model("openai", "gpt-4o")
     
     message = UserMessage(text=f"Task '{task['title']}' was rescheduled. Priority changed from {current_priority} to {new_priority}. Explain why this happened and encourage the user.")
-    explanation = await chat.send_message(message)
+    explanation = await send_llm_message(chat, message)
     
     return {
         "task_id": task_id,
@@ -2820,22 +4608,13 @@ async def reschedule_task(task_id: str, current_user: dict = Depends(get_current
         "explanation": explanation
     }
 
-@api_router.get("/planner/explain/{date}")
-async def explain_schedule(date: str, current_user: dict = Depends(get_current_user)):
-    """AI explains why the schedule was arranged this way"""
+async def explain_blocks_with_ai(date: str, energy_level: str, blocks: list) -> str:
+    """Ask the LLM for a friendly explanation of a list of schedule blocks"""
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     
-    schedule = await db.schedules.find_one(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
-    )
-    
-    if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
-    
     blocks_summary = "\n".join([
         f"- {b['start']}-{b['end']}: {b['title']} ({b['type']})"
-        for b in schedule.get("blocks", [])[:10]
+        for b in blocks[:10]
     ])
     
     chat = LlmChat(
@@ -2844,12 +4623,25 @@ async def explain_schedule(date: str, current_user: dict = Depends(get_current_u
         system_message="You are a productivity coach. Explain a daily schedule in a friendly, helpful way. Keep it under 100 words."
     ).with_model("openai", "gpt-4o")
     
-    message = UserMessage(text=f"""Explain this schedule for {date} (energy level: {schedule.get('energy_level', 'medium')}):
+    message = UserMessage(text=f"""Explain this schedule for {date} (energy level: {energy_level}):
 {blocks_summary}
 
 Why was it arranged this way? What's the strategy?""")
     
-    explanation = await chat.send_message(message)
+    return await send_llm_message(chat, message)
+
+@api_router.get("/planner/explain/{date}")
+async def explain_schedule(date: str, current_user: dict = Depends(get_current_user)):
+    """AI explains why the schedule was arranged this way"""
+    schedule = await db.schedules.find_one(
+        schedule_filter(current_user["user_id"], date),
+        {"_id": 0}
+    )
+    
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    
+    explanation = await explain_blocks_with_ai(date, schedule.get('energy_level', 'medium'), schedule.get("blocks", []))
     
     return {"date": date, "explanation": explanation}
 
@@ -2860,6 +4652,175 @@ GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_CALENDAR_REDIRECT_URI', 
     os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001') + '/api/calendar/callback')
 
+async def save_refreshed_google_token(user_id: str, access_token: str, expires_at: float):
+    await db.users.update_one(
+        {"user_id": user_id},
+        {"$set": {"google_tokens.access_token": access_token, "google_tokens.expires_at": expires_at}}
+    )
+
+# One pooled client per worker; caches refreshed access tokens per user
+google_calendar = GoogleCalendarClient(
+    client_id=GOOGLE_CLIENT_ID,
+    client_secret=GOOGLE_CLIENT_SECRET,
+    on_token_refresh=save_refreshed_google_token,
+    on_request=observe_google_call
+)
+
+# ============ CALENDAR EVENT CACHE ============
+
+CALENDAR_CACHE_MAX_AGE_SECONDS = 5 * 60  # older caches are re-synced before being read
+CALENDAR_SYNC_WAIT_SECONDS = 3  # then served stale if Google is slower than this
+CALENDAR_SYNC_INTERVAL_SECONDS = 10 * 60  # background refresh cadence
+CALENDAR_SYNC_LOOKBACK_DAYS = 30  # how far back a full sync starts
+CALENDAR_SYNC_ERROR_BACKOFF_SECONDS = 60  # reads don't retry a failed sync sooner than this
+
+calendar_syncs = {}  # user_id -> this worker's in-flight sync
+
+def calendar_sync_task(user: dict, max_age_seconds: Optional[float] = None) -> asyncio.Task:
+    """The user's in-flight sync, or a new one. Callers await (or shield) the shared task"""
+    task = calendar_syncs.get(user["user_id"])
+    if task is None:
+        task = calendar_syncs[user["user_id"]] = start_background_task(sync_calendar_events(user, max_age_seconds))
+        task.add_done_callback(lambda done: finish_calendar_sync(user["user_id"], done))
+    return task
+
+def finish_calendar_sync(user_id: str, task: asyncio.Task):
+    if calendar_syncs.get(user_id) is task:
+        del calendar_syncs[user_id]
+    if not task.cancelled() and task.exception():
+        logging.warning(f"Calendar sync for {user_id} failed: {task.exception()!r}")
+
+def calendar_sync_backing_off(state: dict) -> bool:
+    """Whether the last sync failed recently (and nothing has succeeded since)"""
+    last_error_at = state.get("last_error_at")
+    if not last_error_at or last_error_at <= (state.get("synced_at") or ""):
+        return False
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=CALENDAR_SYNC_ERROR_BACKOFF_SECONDS)).isoformat()
+    return last_error_at >= cutoff
+
+def event_day_span(event: dict) -> tuple:
+    """First and last YYYY-MM-DD day an event touches (all-day end dates are exclusive)"""
+    start = event['start'].get('dateTime', event['start'].get('date', ''))
+    end = event['end'].get('dateTime', event['end'].get('date', ''))
+    first_day = start[:10]
+    if 'T' in end:
+        last_day = end[:10]
+    else:
+        last_day = (datetime.strptime(end[:10], "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    return first_day, max(first_day, last_day)
+
+async def sync_calendar_events(user: dict, max_age_seconds: Optional[float] = None) -> dict:
+    """Pull changes from Google into the calendar_events cache.
+    
+    Uses the stored sync token for an incremental sync, falling back to a full
+    sync (from CALENDAR_SYNC_LOOKBACK_DAYS ago) when there is none or Google
+    has expired it. With max_age_seconds, a cache that is fresh enough (another
+    worker may just have synced) is left alone, and a recent failure is not
+    retried yet. Start it through calendar_sync_task, one per user at a time.
+    """
+    user_id = user["user_id"]
+    state = await db.calendar_sync.find_one({"user_id": user_id}, {"_id": 0}) or {}
+    if max_age_seconds is not None:
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)).isoformat()
+        if state.get("synced_at") and state["synced_at"] >= cutoff:
+            return {"full_sync": False, "changes": 0, "synced_at": state["synced_at"]}
+        if calendar_sync_backing_off(state):
+            raise GoogleCalendarError(f"Backing off after a failed sync: {state.get('last_error')}")
+    sync_token = state.get("sync_token")
+    full_sync = not sync_token
+    time_min = (datetime.now(timezone.utc) - timedelta(days=CALENDAR_SYNC_LOOKBACK_DAYS)).isoformat()
+    
+    try:
+        try:
+            items, next_token = await google_calendar.sync_events(user_id, user["google_tokens"], sync_token, time_min)
+        except GoogleCalendarSyncTokenExpired:
+            full_sync = True
+            items, next_token = await google_calendar.sync_events(user_id, user["google_tokens"], None, time_min)
+    except GoogleCalendarError as e:
+        await db.calendar_sync.update_one(
+            {"user_id": user_id},
+            {"$set": {"last_error": str(e), "last_error_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        raise
+    
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    for event in items:
+        if event.get("status") == "cancelled":
+            operations.append(DeleteOne({"user_id": user_id, "event_id": event["id"]}))
+            continue
+        first_day, last_day = event_day_span(event)
+        operations.append(UpdateOne(
+            {"user_id": user_id, "event_id": event["id"]},
+            {"$set": {"first_day": first_day, "last_day": last_day, "event": event, "synced_at": now}},
+            upsert=True
+        ))
+    
+    if operations:
+        await db.calendar_events.bulk_write(operations, ordered=True)
+    if full_sync:
+        # Only after the upserts, so readers never see the calendar empty
+        await db.calendar_events.delete_many({"user_id": user_id, "synced_at": {"$lt": now}})
+    
+    await db.calendar_sync.update_one(
+        {"user_id": user_id},
+        {"$set": {"sync_token": next_token, "synced_at": now, "last_error": None}},
+        upsert=True
+    )
+    return {"full_sync": full_sync, "changes": len(items), "synced_at": now}
+
+async def get_cached_calendar_events(user: dict, first_day: str, last_day: str) -> list:
+    """Google events touching [first_day, last_day] from the local cache.
+    
+    A cache older than CALENDAR_CACHE_MAX_AGE_SECONDS is synced first, but
+    only waited on for CALENDAR_SYNC_WAIT_SECONDS: if Google is slow or down
+    the sync carries on in the background and cached events are served.
+    Concurrent reads share one sync, and a failed sync isn't retried until
+    CALENDAR_SYNC_ERROR_BACKOFF_SECONDS have passed.
+    """
+    if not user or not user.get("google_tokens"):
+        return []
+    
+    state = await db.calendar_sync.find_one(
+        {"user_id": user["user_id"]}, {"_id": 0, "synced_at": 1, "last_error_at": 1}
+    ) or {}
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=CALENDAR_CACHE_MAX_AGE_SECONDS)).isoformat()
+    if (not state.get("synced_at") or state["synced_at"] < cutoff) and not calendar_sync_backing_off(state):
+        sync = calendar_sync_task(user, CALENDAR_CACHE_MAX_AGE_SECONDS)
+        try:
+            await asyncio.wait_for(asyncio.shield(sync), CALENDAR_SYNC_WAIT_SECONDS)
+        except (asyncio.TimeoutError, GoogleCalendarError) as e:
+            logging.warning(f"Calendar sync for {user['user_id']} failed or timed out, serving cache: {e!r}")
+    
+    docs = await db.calendar_events.find(
+        {"user_id": user["user_id"], "first_day": {"$lte": last_day}, "last_day": {"$gte": first_day}},
+        {"_id": 0, "event": 1}
+    ).to_list(5000)
+    events = [d["event"] for d in docs]
+    events.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
+    return events
+
+async def calendar_sync_loop():
+    """Background job refreshing connected users' calendar caches"""
+    while True:
+        await asyncio.sleep(CALENDAR_SYNC_INTERVAL_SECONDS)
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=CALENDAR_SYNC_INTERVAL_SECONDS)).isoformat()
+        try:
+            async for user in db.users.find(
+                {"google_calendar_connected": True},
+                {"_id": 0, "user_id": 1, "google_tokens": 1}
+            ):
+                state = await db.calendar_sync.find_one({"user_id": user["user_id"]}, {"_id": 0, "synced_at": 1})
+                if state and state.get("synced_at") and state["synced_at"] >= cutoff:
+                    continue
+                try:
+                    await calendar_sync_task(user, CALENDAR_SYNC_INTERVAL_SECONDS)
+                except GoogleCalendarError:
+                    pass  # logged when the sync finishes
+        except Exception as e:
+            logging.error(f"Calendar sync loop failed: {e}")
+
 @api_router.get("/calendar/auth-url")
 async def get_calendar_auth_url(current_user: dict = Depends(get_current_user)):
     """Get Google Calendar OAuth authorization URL"""
@@ -2885,26 +4846,15 @@ async def get_calendar_auth_url(current_user: dict = Depends(get_current_user)):
 async def calendar_callback(code: str, state: str):
     """Handle Google Calendar OAuth callback"""
     # Exchange code for tokens
-    async with httpx.AsyncClient() as client:
-        token_resp = await client.post(
-            'https://oauth2.googleapis.com/token',
-            data={
-                'code': code,
-                'client_id': GOOGLE_CLIENT_ID,
-                'client_secret': GOOGLE_CLIENT_SECRET,
-                'redirect_uri': GOOGLE_REDIRECT_URI,
-                'grant_type': 'authorization_code'
-            }
-        )
-    
-    if token_resp.status_code != 200:
-        logging.error(f"Token exchange failed: {token_resp.text}")
+    try:
+        tokens = await google_calendar.exchange_code(code, GOOGLE_REDIRECT_URI)
+    except GoogleCalendarError as e:
+        logging.error(str(e))
         return Response(
             content=f"<script>window.opener.postMessage({{type: 'GOOGLE_CALENDAR_ERROR', error: 'Failed to connect'}}, '*'); window.close();</script>",
             media_type="text/html"
         )
-    
-    tokens = token_resp.json()
+    google_calendar.forget(state)
     
     # Save tokens to user
     await db.users.update_one(
@@ -2915,6 +4865,10 @@ async def calendar_callback(code: str, state: str):
         }}
     )
     
+    # Fill the event cache from scratch in the background
+    await db.calendar_sync.delete_one({"user_id": state})
+    calendar_sync_task({"user_id": state, "google_tokens": tokens})
+    
     # Return success and close popup
     frontend_url = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:3000').replace('/api', '')
     return Response(
@@ -2933,65 +4887,47 @@ async def get_calendar_events(
     if not user or not user.get("google_tokens"):
         raise HTTPException(status_code=400, detail="Google Calendar not connected")
     
-    try:
-        from google.oauth2.credentials import Credentials
-        from googleapiclient.discovery import build
-        from google.auth.transport.requests import Request as GoogleRequest
-        
-        tokens = user["google_tokens"]
-        creds = Credentials(
-            token=tokens.get('access_token'),
-            refresh_token=tokens.get('refresh_token'),
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=GOOGLE_CLIENT_ID,
-            client_secret=GOOGLE_CLIENT_SECRET
-        )
-        
-        # Refresh if expired
-        if creds.expired and creds.refresh_token:
-            creds.refresh(GoogleRequest())
-            await db.users.update_one(
-                {"user_id": current_user["user_id"]},
-                {"$set": {"google_tokens.access_token": creds.token}}
-            )
-        
-        service = build('calendar', 'v3', credentials=creds)
-        
-        # Default to today if no date provided
-        if not date:
-            date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        
-        date_start = f"{date}T00:00:00Z"
-        date_end = f"{date}T23:59:59Z"
-        
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=date_start,
-            timeMax=date_end,
-            singleEvents=True,
-            orderBy='startTime',
-            maxResults=50
-        ).execute()
-        
-        events = []
-        for event in events_result.get('items', []):
-            start = event['start'].get('dateTime', event['start'].get('date', ''))
-            end = event['end'].get('dateTime', event['end'].get('date', ''))
-            
-            events.append({
-                "id": event.get('id'),
-                "title": event.get('summary', 'Untitled Event'),
-                "start": start,
-                "end": end,
-                "is_all_day": 'date' in event['start'],
-                "color": event.get('colorId', '#8B5CF6')
-            })
-        
-        return {"date": date, "events": events}
+    # Default to today if no date provided
+    if not date:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    iso_date = to_iso_date(date)
+    
+    items = await get_cached_calendar_events(user, iso_date, iso_date)
+    state = await db.calendar_sync.find_one({"user_id": current_user["user_id"]}, {"_id": 0}) or {}
+    
+    events = []
+    for event in items:
+        start = event['start'].get('dateTime', event['start'].get('date', ''))
+        end = event['end'].get('dateTime', event['end'].get('date', ''))
         
-    except Exception as e:
-        logging.error(f"Failed to fetch calendar events: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to fetch events: {str(e)}")
+        events.append({
+            "id": event.get('id'),
+            "title": event.get('summary', 'Untitled Event'),
+            "start": start,
+            "end": end,
+            "is_all_day": 'date' in event['start'],
+            "color": event.get('colorId', '#8B5CF6')
+        })
+    
+    return {
+        "date": date,
+        "events": events,
+        "synced_at": state.get("synced_at"),
+        "sync_error": state.get("last_error")
+    }
+
+@api_router.post("/calendar/sync")
+async def sync_calendar(current_user: dict = Depends(get_current_user)):
+    """Sync the Google Calendar event cache now"""
+    user = await db.users.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+    
+    if not user or not user.get("google_tokens"):
+        raise HTTPException(status_code=400, detail="Google Calendar not connected")
+    
+    try:
+        return await asyncio.shield(calendar_sync_task(user))
+    except GoogleCalendarError as e:
+        raise HTTPException(status_code=502, detail=f"Calendar sync failed: {str(e)}")
 
 @api_router.delete("/calendar/disconnect")
 async def disconnect_calendar(current_user: dict = Depends(get_current_user)):
@@ -3000,6 +4936,9 @@ async def disconnect_calendar(current_user: dict = Depends(get_current_user)):
         {"user_id": current_user["user_id"]},
         {"$unset": {"google_tokens": ""}, "$set": {"google_calendar_connected": False}}
     )
+    google_calendar.forget(current_user["user_id"])
+    await db.calendar_events.delete_many({"user_id": current_user["user_id"]})
+    await db.calendar_sync.delete_one({"user_id": current_user["user_id"]})
     return {"message": "Google Calendar disconnected"}
 
 @api_router.get("/calendar/status")
@@ -3015,12 +4954,66 @@ async def get_calendar_status(current_user: dict = Depends(get_current_user)):
 async def root():
     return {"message": "StudySmart API", "version": "1.0.0"}
 
-@api_router.get("/health")
-async def health():
-    return {"status": "healthy"}
+@api_router.get("/debug/queries", dependencies=[Depends(require_internal_token)])
+async def get_query_reports(since: int = 0, violations_only: bool = False):
+    """Requests the query profiler flagged (development and staging only)"""
+    if not QUERY_PROFILER:
+        raise HTTPException(status_code=404, detail="Query profiler is disabled")
+    return {
+        "limits": {"repeat": QUERY_REPEAT_LIMIT, "commands": QUERY_COMMAND_LIMIT, "slow_ms": SLOW_QUERY_MS},
+        "reports": recent_reports(since, violations_only)
+    }
+
+# ============ HEALTH ============
+# Liveness says the process is serving; readiness says this worker should get
+# traffic. Balancers and orchestrators should restart on the first and route on
+# the second, so a Mongo outage takes workers out of rotation instead of
+# restarting them.
+#
+# Uvicorn stops accepting connections before the app hears about shutdown, so
+# draining has to start earlier: a pre-stop hook creates DRAIN_FILE (e.g.
+# `touch /tmp/drain && sleep 15`), every worker's readiness turns 503 and the
+# balancer stops routing to the instance before SIGTERM arrives.
 
-# Include the router in the main app
-app.include_router(api_router)
+READINESS_TIMEOUT_SECONDS = float(os.environ.get("READINESS_TIMEOUT_SECONDS", "2"))
+DRAIN_FILE = os.environ.get("DRAIN_FILE", "")
+
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@api_router.get("/health")
+@api_router.get("/health/ready")
+async def readiness():
+    """Ready when Mongo answers a ping, every background worker runs and the app isn't draining"""
+    checks = {}
+    try:
+        start = time.perf_counter()
+        await asyncio.wait_for(client.admin.command("ping"), READINESS_TIMEOUT_SECONDS)
+        checks["mongo"] = {"ok": True, "ms": round((time.perf_counter() - start) * 1000, 1)}
+    except Exception as e:
+        checks["mongo"] = {"ok": False, "error": str(e) or type(e).__name__}
+    
+    stopped = sorted(name for name, task in workers.items() if task.done())
+    checks["workers"] = {"ok": bool(workers) and not stopped, "running": sorted(set(workers) - set(stopped)), "stopped": stopped}
+    if checks["mongo"]["ok"]:
+        try:
+            # Shared across workers, so reported rather than failed on
+            checks["achievement_queue"] = {"pending": await asyncio.wait_for(
+                db.achievement_events.count_documents({"processed": False}, limit=10_000),
+                READINESS_TIMEOUT_SECONDS
+            )}
+        except Exception as e:
+            logging.warning(f"Readiness: achievement queue check failed: {e}")
+    
+    checks["warmup"] = {"ok": warmup["done"], "seconds": warmup["seconds"], "errors": warmup["errors"]}
+    # Only one worker leads the feed and reads fall back without it, so it never fails readiness
+    checks["change_feed"] = {"state": change_feed.state, "live": change_feed.live}
+    
+    draining = bool(DRAIN_FILE) and os.path.exists(DRAIN_FILE)
+    ready = checks["mongo"]["ok"] and checks["workers"]["ok"] and warmup["done"] and not draining
+    status = "ready" if ready else "draining" if draining else "unavailable"
+    return ORJSONResponse({"status": status, "checks": checks}, status_code=200 if ready else 503)
 
 # Get frontend URL from env or default
 FRONTEND_URLS = [
@@ -3029,13 +5022,44 @@ FRONTEND_URLS = [
     os.environ.get("FRONTEND_URL", "http://localhost:3000"),
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=FRONTEND_URLS,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+async def bump_data_versions_middleware(request: Request, call_next):
+    """After a successful mutation, bump the caller's data version and those of their groups"""
+    response = await call_next(request)
+    user_id = getattr(request.state, "user_id", None)
+    if request.method in MUTATING_METHODS and response.status_code < 400 and user_id:
+        scopes = [user_scope(user_id)]
+        path_group = GROUP_PATH.match(request.url.path)
+        if path_group:
+            scopes.append(group_scope(path_group.group(1)))
+        scopes.extend(await member_group_scopes(user_id))
+        try:
+            await bump_data_versions(scopes)
+        except Exception as e:
+            logging.error(f"Data version bump failed for {user_id}: {e}")
+    return response
+
+async def metrics_middleware(request: Request, call_next):
+    """Request count, latency and Mongo commands per route for /metrics (and the query profiler)"""
+    stats = RequestStats(request.scope, keep_commands=QUERY_PROFILER)
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_request(stats, request.method, status, elapsed)
+        if QUERY_PROFILER:
+            profile_request(stats, request.method, request.url.path, status, elapsed)
+        current_request.reset(token)
+
+async def metrics():
+    """Prometheus scrape endpoint (scrape with bearer_token set to INTERNAL_TOKEN)"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 logging.basicConfig(
     level=logging.INFO,
@@ -3043,6 +5067,477 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# ============ SCHEMA MIGRATIONS ============
+# Resumable, batched data migrations. Progress lives in schema_migrations so a
+# restart continues after the last converted _id instead of starting over.
+# One worker migrates at a time, holding a lease document in the same
+# collection (renewed between batches); the others check back until every
+# migration is done. Migrations are independent of each other, so one failing
+# doesn't hold back the rest; it is retried on the next round.
+
+MIGRATION_BATCH_SIZE = 500
+MIGRATION_LEASE_ID = "_lease"
+MIGRATION_LEASE_SECONDS = 5 * 60
+MIGRATION_POLL_SECONDS = 60
+migration_owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class MigrationLeaseLost(Exception):
+    """Another worker took over the schema migrations"""
+
+async def take_migration_lease() -> bool:
+    """Take or renew the migration lease; False while another worker holds a live one"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.schema_migrations.find_one_and_update(
+            {"migration_id": MIGRATION_LEASE_ID, "$or": [{"owner": migration_owner}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"owner": migration_owner, "lease_until": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_migration_lease():
+    await db.schema_migrations.update_one(
+        {"migration_id": MIGRATION_LEASE_ID, "owner": migration_owner},
+        {"$set": {"lease_until": datetime.now(timezone.utc)}}
+    )
+
+# ISO-string timestamps converted to BSON dates, oldest collections first
+TIMESTAMP_MIGRATIONS = [
+    ("0001_user_sessions_dates", "user_sessions", ["expires_at", "created_at"]),
+    ("0002_pomodoro_sessions_dates", "pomodoro_sessions", ["started_at", "completed_at"]),
+    ("0003_tasks_completed_at_date", "tasks", ["completed_at"]),
+    ("0004_xp_transactions_dates", "xp_transactions", ["created_at"]),
+]
+
+async def run_batched_migration(migration_id: str, collection: str, pending: dict, projection: dict, migrate_batch) -> int:
+    """Feed documents matching pending to migrate_batch in _id order, one batch at a time"""
+    state = await db.schema_migrations.find_one({"migration_id": migration_id}) or {}
+    if state.get("done"):
+        return 0
+    
+    coll = db[collection]
+    last_id = state.get("last_id")
+    total = 0
+    while True:
+        query = {"$and": [pending, {"_id": {"$gt": last_id}}]} if last_id is not None else pending
+        batch = await coll.find(query, projection).sort("_id", 1).to_list(MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        
+        converted = await migrate_batch(batch)
+        total += converted
+        last_id = batch[-1]["_id"]
+        await db.schema_migrations.update_one(
+            {"migration_id": migration_id},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}, "$inc": {"converted": converted}},
+            upsert=True
+        )
+        if not await take_migration_lease():
+            raise MigrationLeaseLost()
+        await asyncio.sleep(0)  # let requests through between batches
+    
+    await db.schema_migrations.update_one(
+        {"migration_id": migration_id},
+        {"$set": {"done": True, "updated_at": datetime.now(timezone.utc)}, "$setOnInsert": {"converted": 0}},
+        upsert=True
+    )
+    return total
+
+async def run_timestamp_migration(migration_id: str, collection: str, fields: List[str]) -> int:
+    """Convert string timestamps in fields to dates"""
+    async def convert(batch: list) -> int:
+        ops = []
+        for doc in batch:
+            strings = {field: doc[field] for field in fields if isinstance(doc.get(field), str)}
+            dates = {field: parse_timestamp(value) for field, value in strings.items()}
+            dates = {field: value for field, value in dates.items() if value is not None}
+            if dates:
+                # Only convert values nobody rewrote since we read them
+                ops.append(UpdateOne({"_id": doc["_id"], **{f: strings[f] for f in dates}}, {"$set": dates}))
+        if not ops:
+            return 0
+        return (await db[collection].bulk_write(ops, ordered=False)).modified_count
+    
+    pending = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    return await run_batched_migration(migration_id, collection, pending, {field: 1 for field in fields}, convert)
+
+async def migrate_schedule_iso_dates(batch: list) -> int:
+    """Schedules saved before iso_date existed.
+    
+    A day regenerated meanwhile already has a newer document with iso_date set;
+    the legacy one is then dropped instead of becoming a duplicate.
+    """
+    newer = {
+        (doc["user_id"], doc["iso_date"]) for doc in await db.schedules.find(
+            {
+                "user_id": {"$in": list({doc.get("user_id") for doc in batch})},
+                "iso_date": {"$in": list({to_iso_date(doc["date"]) for doc in batch})}
+            },
+            {"_id": 0, "user_id": 1, "iso_date": 1}
+        ).to_list(None)
+    }
+    ops = []
+    for doc in batch:
+        iso_date = to_iso_date(doc["date"])
+        if (doc.get("user_id"), iso_date) in newer:
+            ops.append(DeleteOne({"_id": doc["_id"], "iso_date": {"$exists": False}}))
+        else:
+            ops.append(UpdateOne({"_id": doc["_id"], "iso_date": {"$exists": False}}, {"$set": {"iso_date": iso_date}}))
+    result = await db.schedules.bulk_write(ops, ordered=False)
+    return result.modified_count + result.deleted_count
+
+async def migrate_task_dependency_state(batch: list) -> int:
+    """Tasks saved before blocked flags / topological ranks existed, refreshed per owner"""
+    updated = 0
+    for user_id in {doc["user_id"] for doc in batch if doc.get("user_id")}:
+        updated += await refresh_dependency_state(user_id)
+    return updated
+
+async def migrate_task_due_at(batch: list) -> int:
+    """Tasks saved before due dates were stored as dates"""
+    ops = []
+    for doc in batch:
+        try:
+            due_at = parse_due_date(doc["due_date"])
+        except (ValueError, TypeError):
+            due_at = None
+        ops.append(UpdateOne({"_id": doc["_id"], "due_at": {"$exists": False}}, {"$set": {"due_at": due_at}}))
+    return (await db.tasks.bulk_write(ops, ordered=False)).modified_count
+
+# Backfills of derived fields: (migration_id, collection, pending query, projection, batch handler)
+DATA_MIGRATIONS = [
+    ("0005_schedules_iso_date", "schedules", {"iso_date": {"$exists": False}}, {"date": 1, "user_id": 1}, migrate_schedule_iso_dates),
+    ("0006_tasks_dependency_state", "tasks", {"blocked": {"$exists": False}}, {"user_id": 1}, migrate_task_dependency_state),
+    ("0007_focus_rollups", "pomodoro_sessions", {"completed": True, "rolled_up": {"$ne": True}}, {"_id": 1}, migrate_focus_rollups),
+    ("0008_tasks_due_at", "tasks", {"due_at": {"$exists": False}, "due_date": {"$nin": [None, ""]}}, {"due_date": 1}, migrate_task_due_at),
+]
+
+def schema_migrations():
+    """(migration_id, runner, args) for every migration, in order"""
+    return [
+        *[(migration_id, run_timestamp_migration, (migration_id, collection, fields))
+          for migration_id, collection, fields in TIMESTAMP_MIGRATIONS],
+        *[(migration[0], run_batched_migration, migration) for migration in DATA_MIGRATIONS],
+    ]
+
+async def pending_schema_migrations() -> list:
+    done = {doc["migration_id"] async for doc in db.schema_migrations.find({"done": True}, {"_id": 0, "migration_id": 1})}
+    return [migration for migration in schema_migrations() if migration[0] not in done]
+
+async def apply_schema_migrations(pending: list):
+    """Run pending migrations in order; a failed one is logged and retried next round"""
+    for migration_id, run, args in pending:
+        try:
+            await run(*args)
+        except MigrationLeaseLost:
+            logging.warning(f"Schema migration {migration_id} handed over: another worker took the lease")
+            return
+        except Exception as e:
+            logging.error(f"Schema migration {migration_id} failed: {e}")
+
+async def run_schema_migrations():
+    """Background job: apply pending migrations under the lease, until none are left"""
+    while True:
+        try:
+            pending = await pending_schema_migrations()
+            if pending and await take_migration_lease():
+                try:
+                    await apply_schema_migrations(pending)
+                finally:
+                    await release_migration_lease()
+                pending = await pending_schema_migrations()
+            # Workers that didn't migrate learn here that 0005 is done
+            await refresh_legacy_schedule_dates()
+            if not pending:
+                return
+        except Exception as e:
+            logging.error(f"Schema migrations check failed: {e}")
+        await asyncio.sleep(MIGRATION_POLL_SECONDS)
+
+background_tasks = set()  # one-off jobs still running, e.g. a first calendar sync
+workers = {}  # name -> long-running background loop, checked by readiness
+
+def start_background_task(coro):
+    """Run a one-off job, tracked until it finishes so shutdown can cancel it"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def create_schedule_day_index():
+    """One schedule per user and day. Replaces the earlier non-unique index;
+    legacy schedules without iso_date are left out until migration 0005 fixes them."""
+    existing = (await db.schedules.index_information()).get("user_id_1_iso_date_1")
+    if existing and not existing.get("unique"):
+        try:
+            await db.schedules.drop_index("user_id_1_iso_date_1")
+        except OperationFailure:
+            pass  # another worker dropped it first
+    try:
+        await db.schedules.create_index(
+            [("user_id", 1), ("iso_date", 1)],
+            name="user_id_1_iso_date_1",
+            unique=True,
+            partialFilterExpression={"iso_date": {"$exists": True}}
+        )
+    except OperationFailure as e:
+        logging.error(f"Unique schedule index not created, duplicate days need cleaning up: {e}")
+        await db.schedules.create_index([("user_id", 1), ("iso_date", 1)], name="user_id_1_iso_date_1")
+
+async def create_unblocked_tasks_index():
+    """Serves /tasks/next and the unblocked planner queries, sort included.
+    Supersedes the earlier (user_id, blocked, status) index, which is dropped."""
+    await db.tasks.create_index([("user_id", 1), ("blocked", 1), ("status", 1), ("priority_score", -1)])
+    if "user_id_1_blocked_1_status_1" in await db.tasks.index_information():
+        try:
+            await db.tasks.drop_index("user_id_1_blocked_1_status_1")
+        except OperationFailure:
+            pass  # another worker dropped it first
+
+async def create_indexes():
+    """Create the indexes hot queries rely on; backfills run later as schema migrations"""
+    await create_schedule_day_index()
+    await db.schedules.create_index([("user_id", 1), ("date", 1)])
+    await db.tasks.create_index([("user_id", 1), ("status", 1), ("priority_score", -1)])
+    await db.tasks.create_index([("score_refresh_at", 1)])
+    await create_unblocked_tasks_index()
+    await db.tasks.create_index([("user_id", 1), ("depends_on", 1)])
+    await db.calendar_events.create_index([("user_id", 1), ("event_id", 1)], unique=True)
+    await db.calendar_events.create_index([("user_id", 1), ("first_day", 1), ("last_day", 1)])
+    await db.calendar_sync.create_index([("user_id", 1)], unique=True)
+    await db.achievement_events.create_index([("user_id", 1), ("event_id", 1)], unique=True)
+    await db.achievement_events.create_index([("processed", 1), ("created_at", 1)])
+    await db.user_counters.create_index([("user_id", 1)], unique=True)
+    await db.focus_daily.create_index([("user_id", 1), ("day", 1)], unique=True)
+    await db.ai_insight_cache.create_index([("user_id", 1), ("key", 1)], unique=True)
+    await db.user_sessions.create_index([("session_token", 1)])
+    await db.user_sessions.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    await db.schema_migrations.create_index([("migration_id", 1)], unique=True)
+    await db.tasks.create_index([("user_id", 1), ("due_at", 1)])
+    await db.burnout_state.create_index([("user_id", 1)], unique=True)
+    await db.burnout_state.create_index([("overdue_next_at", 1)])
+    await db.burnout_state.create_index([("at_risk", 1)])
+    await db.data_versions.create_index([("scope", 1)], unique=True)
+    await db.group_memberships.create_index([("user_id", 1), ("is_active", 1)])
+    await db.rate_limits.create_index([("key", 1), ("window", 1)], unique=True)
+    await db.rate_limits.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    await db.cache_entries.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    await db.goals.create_index([("target_tasks", 1)])
+    await db.group_memberships.create_index([("group_id", 1), ("is_active", 1)])
+
+# ============ PREWARM ============
+# The first AI request on a fresh worker used to import emergentintegrations
+# (which pulls in litellm) on the event loop, seconds of stall that showed up
+# as p99 spikes after every deploy. These imports, and clients whose first use
+# builds TLS contexts or loads native backends, are warmed in a thread once the
+# server accepts traffic; readiness holds the worker out of rotation until then.
+# benchmarks/profile_imports.py shows where import time goes.
+
+PREWARM_ENABLED = os.environ.get("PREWARM", "1").lower() not in ("0", "false", "no")
+PREWARM_MODULES = ["emergentintegrations.llm.chat"]
+
+warmup = {"done": False, "seconds": None, "errors": []}
+
+def reset_warmup():
+    warmup.update(done=not PREWARM_ENABLED, seconds=None, errors=[])
+
+async def prewarm():
+    """Load heavy modules and build shared clients, then mark warmup done even if some of it failed"""
+    start = time.perf_counter()
+    for module in PREWARM_MODULES:
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except Exception as e:
+            warmup["errors"].append(f"{module}: {e}")
+    try:
+        google_calendar.http  # the pooled client is built on first use
+        await asyncio.to_thread(pwd_context.handler("bcrypt").get_backend)
+    except Exception as e:
+        warmup["errors"].append(str(e))
+    warmup.update(done=True, seconds=round(time.perf_counter() - start, 3))
+    for error in warmup["errors"]:
+        logging.warning(f"Prewarm: {error}")
+    logging.info(f"Prewarm finished in {warmup['seconds']}s")
+
+# ============ CHANGE FEED ============
+# Derived data follows the change stream instead of every write path having to
+# remember it: the handlers below note what a batch of changes touched and
+# apply_changes acts on it once per batch. Deletes carry only the _id (no
+# pre-images), so they are caught by the request middleware's version bumps
+# and the next rebuild rather than here.
+
+# Leaderboard boards cost a full scan to rebuild; XP moves constantly, so they
+# are invalidated at most this often (their TTL still bounds staleness).
+CHANGE_FEED_INVALIDATE_SECONDS = float(os.environ.get("CHANGE_FEED_INVALIDATE_SECONDS", "10"))
+LEADERBOARD_FIELDS = {"name", "picture", "total_xp", "weekly_xp", "monthly_xp", "current_streak", "badges"}
+
+change_feed = ChangeFeed()
+feed_pending = {"scopes": set(), "member_counts": set(), "goal_tasks": set(), "namespaces": set()}
+feed_invalidated_at = {}  # namespace -> monotonic time of the last invalidation
+
+def changed_fields(change: dict) -> Optional[set]:
+    """Top-level fields an update touched; None for inserts and replaces, which may touch anything"""
+    description = change.get("updateDescription")
+    if description is None:
+        return None
+    paths = [*description.get("updatedFields", {}), *description.get("removedFields", [])]
+    return {path.split(".")[0] for path in paths}
+
+@change_feed.on("tasks", "pomodoro_sessions")
+async def on_user_activity_change(change: dict):
+    doc = change.get("fullDocument") or {}
+    if doc.get("user_id"):
+        feed_pending["scopes"].add(user_scope(doc["user_id"]))
+    fields = changed_fields(change)
+    if change["ns"]["coll"] == "tasks":
+        if doc.get("task_id") and (fields is None or "status" in fields):
+            feed_pending["goal_tasks"].add(doc["task_id"])
+            feed_pending["namespaces"].add("leaderboard")
+    elif fields is None or "completed" in fields:
+        feed_pending["namespaces"].add("leaderboard")  # focus hours
+
+@change_feed.on("users")
+async def on_user_change(change: dict):
+    doc = change.get("fullDocument") or {}
+    if doc.get("user_id"):
+        feed_pending["scopes"].add(user_scope(doc["user_id"]))
+    fields = changed_fields(change)
+    if fields is None or fields & LEADERBOARD_FIELDS:
+        feed_pending["namespaces"].add("leaderboard")
+    if fields is None or "study_group_id" in fields:
+        feed_pending["namespaces"].add("group_leaderboard")
+
+@change_feed.on("group_memberships")
+async def on_membership_change(change: dict):
+    doc = change.get("fullDocument") or {}
+    if not doc.get("group_id"):
+        return
+    fields = changed_fields(change)
+    if fields is None or "is_active" in fields:
+        feed_pending["member_counts"].add(doc["group_id"])
+        feed_pending["scopes"].add(group_scope(doc["group_id"]))
+        if doc.get("user_id"):
+            feed_pending["scopes"].add(user_scope(doc["user_id"]))
+
+@change_feed.on("group_messages")
+async def on_group_message(change: dict):
+    doc = change.get("fullDocument") or {}
+    if doc.get("group_id"):
+        feed_pending["scopes"].add(group_scope(doc["group_id"]))
+
+async def refresh_member_counts(group_ids: List[str]):
+    """Materialize study_groups.member_count (active memberships) for the given groups"""
+    counts = {
+        row["_id"]: row["count"] async for row in db.group_memberships.aggregate([
+            {"$match": {"group_id": {"$in": group_ids}, "is_active": True}},
+            {"$group": {"_id": "$group_id", "count": {"$sum": 1}}}
+        ])
+    }
+    await db.study_groups.bulk_write(
+        [UpdateOne({"group_id": group_id}, {"$set": {"member_count": counts.get(group_id, 0)}}) for group_id in group_ids],
+        ordered=False
+    )
+
+@change_feed.on_flush
+async def apply_changes():
+    """Apply what the batch touched; anything not applied stays pending for the replay"""
+    if feed_pending["scopes"]:
+        await bump_data_versions(list(feed_pending["scopes"]))
+        feed_pending["scopes"].clear()
+    if feed_pending["member_counts"]:
+        await refresh_member_counts(list(feed_pending["member_counts"]))
+        feed_pending["member_counts"].clear()
+    if feed_pending["goal_tasks"]:
+        await refresh_goal_progress({"target_tasks": {"$in": list(feed_pending["goal_tasks"])}})
+        feed_pending["goal_tasks"].clear()
+    
+    now = time.monotonic()
+    for namespace in list(feed_pending["namespaces"]):
+        # Otherwise left pending and retried on a later flush
+        if now - feed_invalidated_at.get(namespace, 0) >= CHANGE_FEED_INVALIDATE_SECONDS:
+            await cache.invalidate(namespace)
+            feed_invalidated_at[namespace] = now
+            feed_pending["namespaces"].discard(namespace)
+
+@change_feed.on_rebuild
+async def rebuild_derived_data():
+    """No resume point: recompute what the handlers maintain, for everyone"""
+    async for groups in change_feed.batches(db.study_groups, {}, {"_id": 1, "group_id": 1}):
+        await refresh_member_counts([group["group_id"] for group in groups])
+    async for goals in change_feed.batches(db.goals, {"target_tasks.0": {"$exists": True}}, {"_id": 1}):
+        await refresh_goal_progress({"_id": {"$in": [goal["_id"] for goal in goals]}})
+    for namespace in ("leaderboard", "group_leaderboard", "overview"):
+        await cache.invalidate(namespace)
+
+# ============ APP ============
+
+WORKER_SHUTDOWN_SECONDS = 10
+
+def start_background_workers():
+    for name, loop in (
+        ("priority_rescore", priority_rescore_loop),
+        ("calendar_sync", calendar_sync_loop),
+        ("achievements", achievement_worker),
+        ("burnout_sweep", burnout_sweep_loop),
+        ("cache_versions", cache_version_loop),
+    ):
+        workers[name] = asyncio.create_task(loop(), name=name)
+    if CHANGE_FEED_ENABLED:
+        workers["change_feed"] = asyncio.create_task(change_feed.run(db, db.change_feed_state), name="change_feed")
+    start_background_task(run_schema_migrations())
+    if PREWARM_ENABLED:
+        start_background_task(prewarm())
+
+async def stop_background_workers():
+    tasks = [*workers.values(), *background_tasks]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=WORKER_SHUTDOWN_SECONDS)
+    workers.clear()
+    background_tasks.clear()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Owns the Mongo pool, outbound HTTP clients and background workers for one server process.
+    
+    Shutdown runs after uvicorn has closed its listeners and finished in-flight
+    requests; taking the worker out of rotation before that is DRAIN_FILE's job.
+    """
+    global http_client, rate_limiter, cache
+    open_mongo()
+    rate_limiter = create_rate_limiter(db.rate_limits)
+    cache = create_cache(db.cache_entries, db.cache_versions)
+    http_client = httpx.AsyncClient(timeout=httpx.Timeout(15.0, connect=5.0))
+    reset_warmup()
+    try:
+        await create_indexes()
+        await cache.sync_versions()
+        await refresh_legacy_schedule_dates()
+        start_background_workers()
+        yield
+    finally:
+        await stop_background_workers()
+        await google_calendar.aclose()
+        await http_client.aclose()
+        http_client = None
+        close_mongo()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_api_route("/metrics", metrics, include_in_schema=False, dependencies=[Depends(require_internal_token)])
+    app.middleware("http")(bump_data_versions_middleware)
+    app.middleware("http")(metrics_middleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=FRONTEND_URLS,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+app = create_app()
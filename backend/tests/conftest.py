@@ -0,0 +1,36 @@
+"""
+Query budget mode: with QUERY_BUDGET_CHECK=1, and the server under test running
+with QUERY_PROFILER=1 and the same INTERNAL_TOKEN, a test fails when any request
+it made repeated a query shape too often or ran more Mongo commands than its
+route's budget.
+"""
+import os
+
+import pytest
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://study-wizard-14.preview.emergentagent.com')
+QUERY_BUDGET_CHECK = os.environ.get('QUERY_BUDGET_CHECK') == '1'
+INTERNAL_HEADERS = {"Authorization": f"Bearer {os.environ.get('INTERNAL_TOKEN', '')}"}
+
+
+def latest_query_report() -> int:
+    reports = requests.get(f"{BASE_URL}/api/debug/queries", headers=INTERNAL_HEADERS).json()["reports"]
+    return reports[-1]["seq"] if reports else 0
+
+
+@pytest.fixture(autouse=True)
+def query_budget():
+    if not QUERY_BUDGET_CHECK:
+        yield
+        return
+
+    since = latest_query_report()
+    yield
+    reports = requests.get(f"{BASE_URL}/api/debug/queries", headers=INTERNAL_HEADERS, params={
+        "since": since, "violations_only": True
+    }).json()["reports"]
+    if reports:
+        pytest.fail("Query budget exceeded:\n" + "\n".join(
+            f"  {r['method']} {r['route']}: {violation}" for r in reports for violation in r["violations"]
+        ))
@@ -0,0 +1,227 @@
+"""
+Tests for the async Google Calendar client against a local fake Google server:
+- Token refresh on expiry / 401, cached and persisted once
+- Event pagination (no silent truncation)
+- Timeouts and malformed responses surface as GoogleCalendarError
+- Incremental sync with sync tokens, and 410 when a token has expired
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from google_calendar import GoogleCalendarClient, GoogleCalendarError, GoogleCalendarSyncTokenExpired  # noqa: E402
+
+API_BASE = "http://fake-google.local/calendar/v3"
+TOKEN_URI = "http://fake-google.local/token"
+
+
+class FakeGoogle:
+    """In-process stand-in for the OAuth token endpoint and Calendar events API"""
+
+    def __init__(self, events=50, page_size=20, valid_token="fresh-token"):
+        self.events = [
+            {"id": f"evt_{i}", "summary": f"Event {i}",
+             "start": {"dateTime": f"2030-01-07T{8 + i % 10:02d}:00:00Z"},
+             "end": {"dateTime": f"2030-01-07T{8 + i % 10:02d}:30:00Z"}}
+            for i in range(events)
+        ]
+        self.page_size = page_size
+        self.valid_token = valid_token
+        self.token_requests = 0
+        self.event_requests = 0
+        self.version = 1  # bumped on every change; sync tokens are "v<version>"
+        self.changes = {}  # event id -> version it last changed in
+        self.expired_tokens = set()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/token":
+            self.token_requests += 1
+            return httpx.Response(200, json={"access_token": self.valid_token, "expires_in": 3600})
+
+        self.event_requests += 1
+        if request.headers.get("Authorization") != f"Bearer {self.valid_token}":
+            return httpx.Response(401, json={"error": "invalid_token"})
+        sync_token = request.url.params.get("syncToken")
+        if sync_token in self.expired_tokens:
+            return httpx.Response(410, json={"error": "fullSyncRequired"})
+        events = self.events
+        if sync_token:
+            since = int(sync_token[1:])
+            events = [e for e in self.events if self.changes.get(e["id"], 0) > since]
+        start = int(request.url.params.get("pageToken", 0))
+        page = {"items": events[start:start + self.page_size]}
+        if start + self.page_size < len(events):
+            page["nextPageToken"] = str(start + self.page_size)
+        else:
+            page["nextSyncToken"] = f"v{self.version}"
+        return httpx.Response(200, json=page)
+
+    def change(self, index, **fields):
+        self.version += 1
+        self.events[index] = {**self.events[index], **fields}
+        self.changes[self.events[index]["id"]] = self.version
+
+
+def make_client(fake, saved=None):
+    async def on_token_refresh(user_id, access_token, expires_at):
+        if saved is not None:
+            saved.append((user_id, access_token))
+
+    return GoogleCalendarClient(
+        client_id="client",
+        client_secret="secret",
+        api_base=API_BASE,
+        token_uri=TOKEN_URI,
+        http=httpx.AsyncClient(transport=httpx.MockTransport(fake)),
+        on_token_refresh=on_token_refresh
+    )
+
+
+def test_rejected_token_is_refreshed_once_and_persisted():
+    fake = FakeGoogle()
+    saved = []
+    client = make_client(fake, saved)
+    tokens = {"access_token": "old-token", "refresh_token": "refresh"}
+
+    async def run():
+        first = await client.list_events("user_1", tokens, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        second = await client.list_events("user_1", tokens, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        await client.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert len(first) == len(second) == 50
+    assert fake.token_requests == 1
+    assert saved == [("user_1", "fresh-token")]
+
+
+def test_expired_token_refreshed_before_request():
+    fake = FakeGoogle()
+    client = make_client(fake)
+    tokens = {"access_token": "old-token", "refresh_token": "refresh", "expires_at": time.time() - 10}
+
+    async def run():
+        events = await client.list_events("user_2", tokens, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        await client.aclose()
+        return events
+
+    assert len(asyncio.run(run())) == 50
+    # No request was wasted on the expired token
+    assert fake.event_requests == 3
+
+
+def test_concurrent_callers_share_one_refresh():
+    fake = FakeGoogle(events=5)
+    client = make_client(fake)
+    tokens = {"refresh_token": "refresh"}
+
+    async def run():
+        results = await asyncio.gather(*[
+            client.list_events("user_3", tokens, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+            for _ in range(10)
+        ])
+        await client.aclose()
+        return results
+
+    assert all(len(r) == 5 for r in asyncio.run(run()))
+    assert fake.token_requests == 1
+
+
+def test_missing_refresh_token_raises():
+    fake = FakeGoogle()
+    client = make_client(fake)
+
+    async def run():
+        try:
+            await client.list_events("user_4", {"access_token": "old-token"}, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(GoogleCalendarError):
+        asyncio.run(run())
+
+
+def test_timeout_raises_calendar_error():
+    def slow(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    client = make_client(slow)
+
+    async def run():
+        try:
+            await client.list_events("user_5", {"access_token": "t"}, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(GoogleCalendarError):
+        asyncio.run(run())
+
+
+@pytest.mark.parametrize("token_response,events_response", [
+    (httpx.Response(200, json={"token_type": "Bearer"}), None),
+    (httpx.Response(200, text="<html>oops</html>"), None),
+    (None, httpx.Response(200, text="not json")),
+    (None, httpx.Response(200, json=["not", "an", "object"])),
+])
+def test_malformed_responses_raise_calendar_error(token_response, events_response):
+    fake = FakeGoogle(events=5)
+
+    def transport(request):
+        if request.url.path == "/token" and token_response is not None:
+            return token_response
+        if request.url.path != "/token" and events_response is not None:
+            return events_response
+        return fake(request)
+
+    client = make_client(transport)
+
+    async def run():
+        try:
+            await client.list_events("user_6", {"refresh_token": "refresh"}, "2030-01-07T00:00:00Z", "2030-01-07T23:59:59Z")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(GoogleCalendarError):
+        asyncio.run(run())
+
+
+def test_incremental_sync_returns_only_changes():
+    fake = FakeGoogle(events=30, page_size=20)
+    client = make_client(fake)
+    tokens = {"access_token": "fresh-token", "refresh_token": "refresh"}
+
+    async def run():
+        full, token = await client.sync_events("user_6", tokens, time_min="2030-01-01T00:00:00Z")
+        fake.change(3, summary="Moved")
+        fake.change(7, status="cancelled")
+        delta, next_token = await client.sync_events("user_6", tokens, sync_token=token)
+        await client.aclose()
+        return full, token, delta, next_token
+
+    full, token, delta, next_token = asyncio.run(run())
+    assert len(full) == 30
+    assert token == "v1"
+    assert {e["id"] for e in delta} == {"evt_3", "evt_7"}
+    assert next(e for e in delta if e["id"] == "evt_7")["status"] == "cancelled"
+    assert next_token == "v3"
+
+
+def test_expired_sync_token_raises():
+    fake = FakeGoogle(events=5)
+    fake.expired_tokens.add("v0")
+    client = make_client(fake)
+
+    async def run():
+        try:
+            await client.sync_events("user_7", {"access_token": "fresh-token"}, sync_token="v0")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(GoogleCalendarSyncTokenExpired):
+        asyncio.run(run())
@@ -1,8 +1,9 @@
 """
 Comprehensive tests for StudySmart Mega Prompt features:
-- Tasks: linked goals, tags, status history, overdue detection
+- Tasks: linked goals, tags, status history, overdue detection, dependencies
 - Focus Timer: presets, session tracking, XP
 - Study Groups: multi-group, chat, group goals, contributions
+- Achievements: badges from domain events, replay
 """
 import pytest
 import requests
@@ -11,6 +12,7 @@ import time
 from datetime import datetime, timedelta
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://study-wizard-14.preview.emergentagent.com')
+INTERNAL_TOKEN = os.environ.get('INTERNAL_TOKEN', '')
 
 # Test user credentials
 TEST_EMAIL = f"megafeature_test_{int(time.time())}@test.com"
@@ -62,6 +64,39 @@ def auth_headers():
     return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
 
+# ============ HEALTH TESTS ============
+
+class TestHealth:
+    """Test liveness and readiness probes"""
+
+    def test_health_probes(self):
+        """Liveness is static; readiness reports Mongo, the background workers and warmup"""
+        response = requests.get(f"{BASE_URL}/api/health/live")
+        assert response.status_code == 200
+        assert response.json()["status"] == "alive"
+
+        response = requests.get(f"{BASE_URL}/api/health/ready")
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["checks"]["mongo"]["ok"]
+        assert data["checks"]["workers"]["stopped"] == []
+        assert data["checks"]["warmup"]["ok"]
+        print("✓ Health probes report ready")
+
+    def test_metrics_require_internal_token(self):
+        """/metrics is hidden or refused without the internal token"""
+        response = requests.get(f"{BASE_URL}/metrics")
+        assert response.status_code in (403, 404)
+        response = requests.get(f"{BASE_URL}/metrics", headers={"Authorization": "Bearer wrong-token"})
+        assert response.status_code in (403, 404)
+        if INTERNAL_TOKEN:
+            response = requests.get(f"{BASE_URL}/metrics", headers={"Authorization": f"Bearer {INTERNAL_TOKEN}"})
+            assert response.status_code == 200
+            assert "http_requests_total" in response.text
+        print("✓ Metrics require the internal token")
+
+
 # ============ TASKS TESTS ============
 
 class TestTasksEnhanced:
@@ -136,6 +171,26 @@ class TestTasksEnhanced:
         tasks = response.json()
         print(f"✓ Today's tasks filter working: {len(tasks)} tasks for today")
     
+    def test_next_tasks_by_priority_score(self, auth_headers):
+        """Test top-k next tasks are ordered by stored priority score"""
+        soon = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+        create_resp = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": "TEST_Due tomorrow",
+            "priority": "high",
+            "due_date": soon
+        })
+        assert create_resp.status_code == 201
+        assert create_resp.json()["priority_score"] is not None
+        
+        response = requests.get(f"{BASE_URL}/api/tasks/next", headers=auth_headers, params={"k": 3})
+        assert response.status_code == 200
+        tasks = response.json()
+        assert 0 < len(tasks) <= 3
+        scores = [t["priority_score"] for t in tasks]
+        assert scores == sorted(scores, reverse=True)
+        assert all(t["status"] != "completed" for t in tasks)
+        print(f"✓ Next tasks endpoint working: {[t['title'] for t in tasks]}")
+    
     def test_status_change_history(self, auth_headers):
         """Test status change tracking"""
         # Create task
@@ -209,6 +264,110 @@ class TestTasksEnhanced:
         assert len(tasks) >= 1
         assert all(t.get("linked_goal_id") == goal_id for t in tasks)
         print(f"✓ Tasks filtered by goal: {len(tasks)} tasks")
+    
+    def test_bulk_task_operations(self, auth_headers):
+        """Test bulk create/update/complete/delete with per-item results"""
+        response = requests.post(f"{BASE_URL}/api/tasks/bulk", headers=auth_headers, json={"operations": [
+            {"op": "create", "data": {"title": "TEST_Bulk A", "priority": "high"}},
+            {"op": "create", "data": {"title": "TEST_Bulk B"}},
+            {"op": "create", "data": {"title": "TEST_Bulk C"}},
+        ]})
+        assert response.status_code == 200
+        a, b, c = [r["task_id"] for r in response.json()["results"]]
+        assert response.json()["succeeded"] == 3
+        
+        response = requests.post(f"{BASE_URL}/api/tasks/bulk", headers=auth_headers, json={"operations": [
+            {"op": "complete", "task_id": a},
+            {"op": "complete", "task_id": b},
+            {"op": "update", "task_id": c, "data": {"priority": "low"}},
+            {"op": "delete", "task_id": "task_missing"},
+            {"op": "create", "data": {"priority": "high"}},
+        ]})
+        assert response.status_code == 200
+        data = response.json()
+        assert [r["ok"] for r in data["results"]] == [True, True, True, False, False]
+        assert data["results"][3]["error"] == "Task not found"
+        assert data["completed"] == 2
+        # XP for both completions is awarded in one go
+        assert data["xp_awarded"] >= 40 + 30
+        assert data["current_streak"] >= 1
+        
+        task = requests.get(f"{BASE_URL}/api/tasks/{a}", headers=auth_headers).json()
+        assert task["status"] == "completed" and task["completed_at"]
+        
+        response = requests.post(f"{BASE_URL}/api/tasks/bulk", headers=auth_headers, json={"operations": [
+            {"op": "delete", "task_id": a}, {"op": "delete", "task_id": b}, {"op": "delete", "task_id": c},
+        ]})
+        assert response.json()["succeeded"] == 3
+        assert requests.get(f"{BASE_URL}/api/tasks/{a}", headers=auth_headers).status_code == 404
+        print("✓ Bulk task operations working")
+    
+    def test_task_dependencies(self, auth_headers):
+        """Test cycle rejection, blocked flags and the dependency graph"""
+        first = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={"title": "TEST_Prerequisite"}).json()
+        second = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": "TEST_Dependent", "depends_on": [first["task_id"]]
+        }).json()
+        assert second["blocked"] is True
+        assert second["topo_rank"] == first["topo_rank"] + 1
+        
+        # Closing the loop is rejected
+        response = requests.put(f"{BASE_URL}/api/tasks/{first['task_id']}", headers=auth_headers, json={
+            "depends_on": [second["task_id"]]
+        })
+        assert response.status_code == 400
+        assert "cycle" in response.json()["detail"].lower()
+        response = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": "TEST_Bad dependency", "depends_on": ["task_missing"]
+        })
+        assert response.status_code == 400
+        
+        unblocked = requests.get(f"{BASE_URL}/api/tasks", headers=auth_headers, params={"blocked": "false"}).json()
+        assert second["task_id"] not in [t["task_id"] for t in unblocked]
+        next_tasks = requests.get(f"{BASE_URL}/api/tasks/next", headers=auth_headers, params={"k": 50}).json()
+        assert second["task_id"] not in [t["task_id"] for t in next_tasks]
+        
+        graph = requests.get(f"{BASE_URL}/api/tasks/graph", headers=auth_headers).json()
+        assert graph["order"].index(first["task_id"]) < graph["order"].index(second["task_id"])
+        assert {"from": first["task_id"], "to": second["task_id"]} in graph["edges"]
+        assert graph["cycles"] == []
+        
+        # Completing the prerequisite unblocks the dependent
+        requests.put(f"{BASE_URL}/api/tasks/{first['task_id']}", headers=auth_headers, json={"status": "completed"})
+        task = requests.get(f"{BASE_URL}/api/tasks/{second['task_id']}", headers=auth_headers).json()
+        assert task["blocked"] is False
+        print("✓ Task dependency graph working")
+
+    def test_burnout_check_tracks_overdue_tasks(self, auth_headers):
+        """Overdue counter follows task creation and completion"""
+        before = requests.post(f"{BASE_URL}/api/ai/burnout-check", headers=auth_headers).json()
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        task = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": "TEST_Overdue", "due_date": yesterday
+        }).json()
+
+        during = requests.post(f"{BASE_URL}/api/ai/burnout-check", headers=auth_headers).json()
+        assert during["stats"]["overdue_tasks"] == before["stats"]["overdue_tasks"] + 1
+
+        requests.put(f"{BASE_URL}/api/tasks/{task['task_id']}", headers=auth_headers, json={"status": "completed"})
+        after = requests.post(f"{BASE_URL}/api/ai/burnout-check", headers=auth_headers).json()
+        assert after["stats"]["overdue_tasks"] == before["stats"]["overdue_tasks"]
+        assert after["risk_level"] in ["low", "medium", "high"]
+        print("✓ Burnout check tracks overdue tasks")
+
+    def test_tasks_conditional_get(self, auth_headers):
+        """Unchanged task lists answer If-None-Match with 304; a mutation invalidates the ETag"""
+        response = requests.get(f"{BASE_URL}/api/tasks", headers=auth_headers)
+        etag = response.headers["ETag"]
+        response = requests.get(f"{BASE_URL}/api/tasks", headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
+        task = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={"title": "TEST_ETag"}).json()
+        response = requests.get(f"{BASE_URL}/api/tasks", headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert task["task_id"] in [t["task_id"] for t in response.json()]
+        assert response.headers["ETag"] != etag
+        print("✓ Task list ETags track data versions")
 
 
 # ============ FOCUS TIMER / POMODORO TESTS ============
@@ -280,6 +439,55 @@ class TestFocusTimer:
         assert "average_daily_sessions" in data
         print(f"✓ Pomodoro stats: {data['today_sessions']} today, {data['week_sessions']} this week")
     
+    def test_stats_count_each_session_once(self, auth_headers):
+        """Stats come from daily rollups; completing a session twice counts it once"""
+        before = requests.get(f"{BASE_URL}/api/pomodoro/stats", headers=auth_headers).json()
+        session_id = requests.post(f"{BASE_URL}/api/pomodoro/start", headers=auth_headers, json={
+            "focus_duration": 40,
+            "break_duration": 5
+        }).json()["session_id"]
+        requests.post(f"{BASE_URL}/api/pomodoro/{session_id}/complete", headers=auth_headers)
+        requests.post(f"{BASE_URL}/api/pomodoro/{session_id}/complete", headers=auth_headers)
+        
+        after = requests.get(f"{BASE_URL}/api/pomodoro/stats", headers=auth_headers).json()
+        assert after["today_sessions"] == before["today_sessions"] + 1
+        assert after["total_focus_time_minutes"] == before["total_focus_time_minutes"] + 40
+        
+        daily = requests.get(f"{BASE_URL}/api/analytics/daily-stats", headers=auth_headers, params={"days": 1}).json()
+        assert daily[-1]["pomodoro_sessions"] == after["today_sessions"]
+        print("✓ Focus rollups count each session once")
+
+    def test_session_timestamps_stay_iso_strings(self, auth_headers):
+        """Timestamps are stored as dates but still served as ISO strings"""
+        session_id = requests.post(f"{BASE_URL}/api/pomodoro/start", headers=auth_headers, json={
+            "focus_duration": 25,
+            "break_duration": 5
+        }).json()["session_id"]
+        completed = requests.post(f"{BASE_URL}/api/pomodoro/{session_id}/complete", headers=auth_headers).json()
+        assert datetime.fromisoformat(completed["completed_at"]) >= datetime.fromisoformat(completed["started_at"])
+
+        sessions = requests.get(f"{BASE_URL}/api/pomodoro/sessions", headers=auth_headers, params={"days": 1}).json()
+        assert session_id in [s["session_id"] for s in sessions]
+        print("✓ Session timestamps served as ISO strings")
+    
+    def test_focus_pattern_heatmap_timezone(self, auth_headers):
+        """Heatmap is bucketed in the requested timezone"""
+        utc = requests.get(f"{BASE_URL}/api/analytics/focus-patterns", headers=auth_headers, params={"days": 14}).json()
+        tokyo = requests.get(f"{BASE_URL}/api/analytics/focus-patterns", headers=auth_headers, params={
+            "days": 14, "tz": "Asia/Tokyo"
+        }).json()
+        assert len(utc["heatmap_minutes"]) == 7 and len(utc["heatmap_minutes"][0]) == 24
+        assert utc["total_focus_minutes"] == tokyo["total_focus_minutes"] > 0
+        
+        # Tokyo is UTC+9 all year: every hour column moves 9 hours later
+        utc_hours = [sum(day[h] for day in utc["heatmap_minutes"]) for h in range(24)]
+        tokyo_hours = [sum(day[h] for day in tokyo["heatmap_minutes"]) for h in range(24)]
+        assert tokyo_hours == utc_hours[-9:] + utc_hours[:-9]
+        
+        assert requests.get(f"{BASE_URL}/api/analytics/focus-patterns", headers=auth_headers, params={"days": 7}).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/analytics/focus-patterns", headers=auth_headers, params={"tz": "Mars/Base"}).status_code == 400
+        print(f"✓ Focus heatmap peak hours: {tokyo['peak_hours']}")
+    
     def test_get_recent_sessions(self, auth_headers):
         """Get recent pomodoro sessions"""
         response = requests.get(f"{BASE_URL}/api/pomodoro/sessions", headers=auth_headers, params={"days": 7})
@@ -337,6 +545,37 @@ class TestStudyGroupsMulti:
         print(f"✓ User is in {len(groups)} groups")
         return groups
     
+    def test_member_count_follows_change_feed(self, auth_headers):
+        """A join made by another user shows up in the materialized member count"""
+        feed = requests.get(f"{BASE_URL}/api/health/ready").json()["checks"].get("change_feed", {})
+        if not feed.get("live"):
+            pytest.skip("Change feed not running (needs a replica set)")
+        group_id = requests.post(f"{BASE_URL}/api/groups/v2", headers=auth_headers, json={
+            "name": f"TEST_FeedGroup_{int(time.time())}",
+            "description": "Member count maintained by the change feed",
+            "is_public": True
+        }).json()["group_id"]
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"feed_test_{int(time.time() * 1000)}@test.com",
+            "password": TEST_PASSWORD,
+            "name": "Change Feed Tester"
+        })
+        response = requests.post(
+            f"{BASE_URL}/api/groups/{group_id}/join/v2",
+            headers={"Authorization": f"Bearer {response.json()['token']}"}
+        )
+        assert response.status_code == 200, response.text
+        
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            groups = requests.get(f"{BASE_URL}/api/groups/my/all", headers=auth_headers).json()
+            if next(g for g in groups if g["group_id"] == group_id)["member_count"] == 2:
+                break
+            time.sleep(0.3)
+        else:
+            raise AssertionError("Member count did not reach 2 within 10s")
+        print("✓ Member count updated from the change feed")
+    
     def test_get_public_groups(self, auth_headers):
         """Get list of public groups"""
         response = requests.get(f"{BASE_URL}/api/groups", headers=auth_headers)
@@ -569,6 +808,65 @@ class TestLeaderboard:
         data = response.json()
         assert "leaderboard" in data
         print(f"✓ Group leaderboard: {len(data['leaderboard'])} groups")
+    
+    def test_leaderboard_rate_limit(self):
+        """A client hammering the leaderboard gets 429 with Retry-After"""
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"ratelimit_test_{int(time.time() * 1000)}@test.com",
+            "password": TEST_PASSWORD,
+            "name": "Rate Limit Tester"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        for _ in range(200):
+            response = requests.get(f"{BASE_URL}/api/leaderboard", headers=headers)
+            if response.status_code != 200:
+                break
+        assert response.status_code == 429, response.text
+        assert int(response.headers["Retry-After"]) >= 1
+        print(f"✓ Leaderboard rate limited, retry after {response.headers['Retry-After']}s")
+
+
+# ============ ACHIEVEMENTS TESTS ============
+
+def wait_for_badge(auth_headers, badge_id, timeout=10):
+    """Badges are awarded by a background worker; poll until it catches up"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = requests.get(f"{BASE_URL}/api/achievements", headers=auth_headers).json()
+        if badge_id in [b["badge_id"] for b in data["badges"]]:
+            return data
+        time.sleep(0.3)
+    raise AssertionError(f"Badge {badge_id} not awarded within {timeout}s")
+
+
+class TestAchievements:
+    """Test event-driven badges"""
+    
+    def test_first_task_badge(self, auth_headers):
+        """Completing a task earns the first task badge"""
+        task_id = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": "TEST_Badge task"
+        }).json()["task_id"]
+        requests.put(f"{BASE_URL}/api/tasks/{task_id}", headers=auth_headers, json={"status": "completed"})
+        
+        data = wait_for_badge(auth_headers, "first_task")
+        assert data["counters"]["tasks_completed"] >= 1
+        first_task = next(a for a in data["available"] if a["badge_id"] == "first_task")
+        assert first_task["earned"] and first_task["progress"] == 1.0
+        print(f"✓ Badges earned: {[b['name'] for b in data['badges']]}")
+    
+    def test_replay_is_idempotent(self, auth_headers):
+        """Replaying history never double counts or re-awards badges"""
+        before = wait_for_badge(auth_headers, "first_task")
+        response = requests.post(f"{BASE_URL}/api/achievements/replay", headers=auth_headers, params={"rebuild": "true"})
+        assert response.status_code == 200
+        
+        time.sleep(1.5)
+        after = requests.get(f"{BASE_URL}/api/achievements", headers=auth_headers).json()
+        badge_ids = [b["badge_id"] for b in after["badges"]]
+        assert len(badge_ids) == len(set(badge_ids))
+        assert after["counters"]["tasks_completed"] == before["counters"]["tasks_completed"]
+        print("✓ Achievement replay is idempotent")
 
 
 # ============ CLEANUP ============
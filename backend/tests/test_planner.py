@@ -0,0 +1,262 @@
+"""
+Tests for the Smart Planner engine:
+- Deterministic schedule generation (chunking, dependencies, unscheduled tasks)
+- Block drag-and-drop conflict detection (reject / auto-shift)
+- Versioned block edits (If-Match) and batch moves
+- Multi-day generation and range fetch
+"""
+import pytest
+import requests
+import os
+import time
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://study-wizard-14.preview.emergentagent.com')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Register a fresh user so the planner only sees this module's tasks"""
+    response = requests.post(f"{BASE_URL}/api/auth/register", json={
+        "email": f"planner_test_{int(time.time())}_{uuid.uuid4().hex[:6]}@test.com",
+        "password": "testpass123",
+        "name": "Planner Tester"
+    })
+    assert response.status_code == 200, f"Register failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def planner_tasks(auth_headers):
+    """A long task, a task depending on it, and a short independent task"""
+    created = {}
+    for title, priority, minutes, deps in [
+        ("TEST_Essay draft", "high", 120, []),
+        ("TEST_Essay review", "high", 30, ["TEST_Essay draft"]),
+        ("TEST_Flashcards", "low", 20, []),
+    ]:
+        response = requests.post(f"{BASE_URL}/api/tasks", headers=auth_headers, json={
+            "title": title,
+            "priority": priority,
+            "estimated_time": minutes,
+            "depends_on": [created[d] for d in deps]
+        })
+        assert response.status_code == 201
+        created[title] = response.json()["task_id"]
+    return created
+
+
+def task_blocks(schedule):
+    return [b for b in schedule["blocks"] if b["type"] == "task"]
+
+
+class TestPlannerGenerate:
+    """Local engine generation"""
+    
+    def test_generate_splits_long_tasks(self, auth_headers, planner_tasks):
+        """Tasks are split into <=50 minute chunks covering their estimated time"""
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-07",
+            "available_start": "09:00",
+            "available_end": "17:00"
+        })
+        assert response.status_code == 200, response.text
+        blocks = [b for b in task_blocks(response.json()) if b["task_id"] == planner_tasks["TEST_Essay draft"]]
+        minutes = [
+            (int(b["end"][:2]) * 60 + int(b["end"][3:])) - (int(b["start"][:2]) * 60 + int(b["start"][3:]))
+            for b in blocks
+        ]
+        assert sum(minutes) == 120
+        assert max(minutes) <= 50
+        assert len({b["id"] for b in response.json()["blocks"]}) == len(response.json()["blocks"])
+    
+    def test_generate_respects_dependencies(self, auth_headers, planner_tasks):
+        """A task never starts before its prerequisite's last chunk ends"""
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-07",
+            "available_start": "09:00",
+            "available_end": "17:00"
+        })
+        blocks = task_blocks(response.json())
+        draft_end = max(b["end"] for b in blocks if b["task_id"] == planner_tasks["TEST_Essay draft"])
+        review_start = min(b["start"] for b in blocks if b["task_id"] == planner_tasks["TEST_Essay review"])
+        assert review_start >= draft_end
+    
+    def test_generate_reports_unscheduled(self, auth_headers, planner_tasks):
+        """Work that doesn't fit the window is reported, not dropped silently"""
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-08",
+            "available_start": "09:00",
+            "available_end": "10:00"
+        })
+        assert response.status_code == 200
+        unscheduled = {u["task_id"]: u for u in response.json()["unscheduled"]}
+        assert unscheduled[planner_tasks["TEST_Essay review"]]["reason"] == "blocked_by_dependency"
+    
+    def test_generate_rejects_bad_times(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-07",
+            "available_start": "nine"
+        })
+        assert response.status_code == 400
+        
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-07",
+            "available_start": "12:75"
+        })
+        assert response.status_code == 400
+
+
+class TestPlannerBlockConflicts:
+    """Drag-and-drop moves are checked against the other blocks"""
+    
+    def test_overlapping_move_rejected_or_shifted(self, auth_headers, planner_tasks):
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-09",
+            "available_start": "09:00",
+            "available_end": "17:00"
+        })
+        blocks = task_blocks(response.json())
+        first, last = blocks[0], blocks[-1]
+        move = {"start": first["start"], "end": first["end"]}
+        
+        response = requests.put(
+            f"{BASE_URL}/api/planner/schedule/2030-01-09/block/{last['id']}",
+            headers=auth_headers, json=move
+        )
+        assert response.status_code == 409
+        
+        response = requests.put(
+            f"{BASE_URL}/api/planner/schedule/2030-01-09/block/{last['id']}",
+            headers=auth_headers, json={**move, "on_conflict": "shfit"}
+        )
+        assert response.status_code == 422
+        
+        response = requests.put(
+            f"{BASE_URL}/api/planner/schedule/2030-01-09/block/{last['id']}",
+            headers=auth_headers, json={**move, "on_conflict": "shift"}
+        )
+        assert response.status_code == 200
+        moved = next(b for b in response.json()["blocks"] if b["id"] == last["id"])
+        others = [b for b in response.json()["blocks"] if b["id"] != last["id"] and b["type"] != "break"]
+        assert all(moved["end"] <= b["start"] or moved["start"] >= b["end"] for b in others)
+    
+    def test_moved_break_is_kept(self, auth_headers, planner_tasks):
+        schedule = requests.get(f"{BASE_URL}/api/planner/schedule/2030-01-09", headers=auth_headers).json()
+        brk = next(b for b in schedule["blocks"] if b["type"] == "break")
+        
+        response = requests.put(
+            f"{BASE_URL}/api/planner/schedule/2030-01-09/block/{brk['id']}",
+            headers=auth_headers, json={"start": "20:00", "end": "20:15"}
+        )
+        assert response.status_code == 200
+        moved = next(b for b in response.json()["blocks"] if b["id"] == brk["id"])
+        assert (moved["start"], moved["end"]) == ("20:00", "20:15")
+        
+        # Batch: a task may be moved onto a break that was moved earlier in the batch
+        task = task_blocks(response.json())[0]
+        response = requests.patch(f"{BASE_URL}/api/planner/schedule/2030-01-09/blocks", headers=auth_headers, json={"moves": [
+            {"block_id": brk["id"], "start": "21:00", "end": "21:15"},
+            {"block_id": task["id"], "start": "21:00", "end": "21:30"},
+        ]})
+        assert response.status_code == 200, response.text
+        blocks = {b["id"]: b for b in response.json()["blocks"]}
+        assert blocks[brk["id"]]["start"] == "21:00"
+        assert blocks[task["id"]]["start"] == "21:00"
+
+
+class TestPlannerBlockVersions:
+    """Block edits are versioned so concurrent edits can't silently overwrite each other"""
+    
+    def test_stale_if_match_rejected(self, auth_headers, planner_tasks):
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-10",
+            "available_start": "09:00",
+            "available_end": "17:00"
+        })
+        version = response.json()["version"]
+        block = task_blocks(response.json())[-1]
+        url = f"{BASE_URL}/api/planner/schedule/2030-01-10/block/{block['id']}"
+        
+        response = requests.put(url, headers={**auth_headers, "If-Match": f'"{version}"'}, json={"start": "16:00", "end": "16:30"})
+        assert response.status_code == 200
+        assert response.json()["version"] == version + 1
+        assert response.headers["ETag"] == f'"{version + 1}"'
+        
+        # A second tab still holding the old version loses
+        response = requests.put(url, headers={**auth_headers, "If-Match": f'"{version}"'}, json={"start": "15:00", "end": "15:30"})
+        assert response.status_code == 409
+        response = requests.delete(url, headers={**auth_headers, "If-Match": f'"{version}"'})
+        assert response.status_code == 409
+        
+        response = requests.delete(url, headers={**auth_headers, "If-Match": f'"{version + 1}"'})
+        assert response.status_code == 200
+        assert response.json()["version"] == version + 2
+    
+    def test_batch_move_swaps_blocks(self, auth_headers, planner_tasks):
+        response = requests.post(f"{BASE_URL}/api/planner/generate", headers=auth_headers, json={
+            "date": "2030-01-11",
+            "available_start": "09:00",
+            "available_end": "17:00"
+        })
+        first, second = task_blocks(response.json())[:2]
+        url = f"{BASE_URL}/api/planner/schedule/2030-01-11/blocks"
+        
+        # Each move alone would overlap; together they are a valid swap
+        swap = [
+            {"block_id": first["id"], "start": second["start"], "end": second["end"]},
+            {"block_id": second["id"], "start": first["start"], "end": first["end"]},
+        ]
+        response = requests.patch(url, headers=auth_headers, json={"moves": swap})
+        assert response.status_code == 200
+        blocks = {b["id"]: b for b in response.json()["blocks"]}
+        assert blocks[first["id"]]["start"] == second["start"]
+        assert blocks[second["id"]]["start"] == first["start"]
+        
+        response = requests.patch(url, headers=auth_headers, json={"moves": [
+            {"block_id": first["id"], "start": "12:00", "end": "12:30"},
+            {"block_id": second["id"], "start": "12:15", "end": "12:45"},
+        ]})
+        assert response.status_code == 409
+        
+        # Nothing from the rejected batch was written
+        schedule = requests.get(f"{BASE_URL}/api/planner/schedule/2030-01-11", headers=auth_headers).json()
+        assert {b["id"]: b["start"] for b in schedule["blocks"]}[first["id"]] == second["start"]
+
+
+class TestPlannerRange:
+    """Week planning and range fetch"""
+    
+    def test_generate_range_and_fetch(self, auth_headers, planner_tasks):
+        response = requests.post(f"{BASE_URL}/api/planner/generate-range", headers=auth_headers, json={
+            "start_date": "2030-02-04",
+            "days": 7,
+            "available_start": "09:00",
+            "available_end": "11:00"
+        })
+        assert response.status_code == 200, response.text
+        schedules = response.json()["schedules"]
+        assert len(schedules) == 7
+        
+        # Each task's chunks add up to its estimate across the week (no double booking)
+        planned = {}
+        for schedule in schedules:
+            for b in task_blocks(schedule):
+                minutes = (int(b["end"][:2]) * 60 + int(b["end"][3:])) - (int(b["start"][:2]) * 60 + int(b["start"][3:]))
+                planned[b["task_id"]] = planned.get(b["task_id"], 0) + minutes
+        assert planned[planner_tasks["TEST_Essay draft"]] == 120
+        assert planned[planner_tasks["TEST_Essay review"]] == 30
+        
+        response = requests.get(f"{BASE_URL}/api/planner/schedule", headers=auth_headers, params={
+            "from": "2030-02-04",
+            "to": "2030-02-10"
+        })
+        assert response.status_code == 200
+        assert [s["iso_date"] for s in response.json()["schedules"]] == [s["iso_date"] for s in schedules]
+    
+    def test_range_rejects_inverted_dates(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/planner/schedule", headers=auth_headers, params={
+            "from": "2030-02-10",
+            "to": "2030-02-04"
+        })
+        assert response.status_code == 400
@@ -39,6 +39,9 @@ export const tasksApi = {
   create: (data) => api.post('/tasks', data),
   update: (id, data) => api.put(`/tasks/${id}`, data),
   delete: (id) => api.delete(`/tasks/${id}`),
+  // operations: [{ op: 'create' | 'update' | 'complete' | 'delete', task_id, data }]
+  bulk: (operations) => api.post('/tasks/bulk', { operations }),
+  getGraph: (params) => api.get('/tasks/graph', { params }),
   getToday: () => api.get('/tasks', { params: { today_only: true } }),
   getByGoal: (goalId) => api.get('/tasks', { params: { linked_goal_id: goalId } }),
 };
@@ -67,6 +70,8 @@ export const goalsApi = {
 export const analyticsApi = {
   getOverview: () => api.get('/analytics/overview'),
   getDailyStats: (days = 7) => api.get('/analytics/daily-stats', { params: { days } }),
+  getFocusPatterns: (days = 14, tz = Intl.DateTimeFormat().resolvedOptions().timeZone) =>
+    api.get('/analytics/focus-patterns', { params: { days, tz } }),
 };
 
 // AI API
@@ -75,7 +80,9 @@ export const aiApi = {
   breakDownTask: (data) => api.post('/ai/break-down-task', data),
   getWeeklySummary: () => api.post('/ai/weekly-summary'),
   checkBurnout: () => api.post('/ai/burnout-check'),
-  getFocusPatterns: () => api.post('/ai/focus-patterns'),
+  // days: 14 | 30 | 90, tz: IANA timezone the heatmap is bucketed in
+  getFocusPatterns: (days = 14, tz = Intl.DateTimeFormat().resolvedOptions().timeZone) =>
+    api.post('/ai/focus-patterns', null, { params: { days, tz } }),
 };
 
 // Leaderboard API
@@ -105,11 +112,27 @@ export const groupsApi = {
 };
 
 // Planner API
+const ifMatch = (version) => (version === undefined ? {} : { headers: { 'If-Match': `"${version}"` } });
+// Moves must carry the version they were made against, or a second tab's drag silently re-applies
+const requireVersion = (version) => {
+  if (version === undefined || version === null) {
+    throw new Error('Block moves need the schedule version');
+  }
+  return ifMatch(version);
+};
+
 export const plannerApi = {
   getSchedule: (date) => api.get(`/planner/schedule/${date}`),
+  getScheduleRange: (from, to) => api.get('/planner/schedule', { params: { from, to } }),
   generateSchedule: (data) => api.post('/planner/generate', data),
-  updateBlock: (date, blockId, data) => api.put(`/planner/schedule/${date}/block/${blockId}`, data),
-  deleteBlock: (date, blockId) => api.delete(`/planner/schedule/${date}/block/${blockId}`),
+  generateScheduleRange: (data) => api.post('/planner/generate-range', data),
+  // version (from the schedule) is sent as If-Match; a 409 means someone else edited the day first
+  updateBlock: (date, blockId, data, version) =>
+    api.put(`/planner/schedule/${date}/block/${blockId}`, data, requireVersion(version)),
+  moveBlocks: (date, moves, version, onConflict = 'reject') =>
+    api.patch(`/planner/schedule/${date}/blocks`, { moves, on_conflict: onConflict }, requireVersion(version)),
+  deleteBlock: (date, blockId, version) =>
+    api.delete(`/planner/schedule/${date}/block/${blockId}`, ifMatch(version)),
   rescheduleTask: (taskId) => api.post(`/planner/reschedule-task/${taskId}`),
   explainSchedule: (date) => api.get(`/planner/explain/${date}`),
 };
@@ -97,7 +97,6 @@ const Planner = () => {
   const [calendarOpen, setCalendarOpen] = useState(false);
 
   const dateString = format(selectedDate, 'dd-MM-yyyy');
-  let date = new Date()
 
   useEffect(() => {
     if (viewMode === 'daily') {
@@ -136,41 +135,35 @@ const Planner = () => {
       const weekEnd = endOfWeek(selectedDate, { weekStartsOn: 1 });
       const days = eachDayOfInterval({ start: weekStart, end: weekEnd });
       
-      const weekData = await Promise.all(
-        days.map(async (day) => {
-          const dayStr = format(day, 'yyyy-MM-dd');
-          try {
-            const res = await plannerApi.getSchedule(dayStr);
-            const blocks = res.data.blocks || [];
-            const taskBlocks = blocks.filter(b => b.type === 'task');
-            const totalMinutes = taskBlocks.reduce((acc, b) => {
-              const [startH, startM] = b.start.split(':').map(Number);
-              const [endH, endM] = b.end.split(':').map(Number);
-              return acc + (endH * 60 + endM) - (startH * 60 + startM);
-            }, 0);
-            
-            return {
-              date: day,
-              dateStr: dayStr,
-              blocks: blocks.length,
-              taskBlocks: taskBlocks.length,
-              totalMinutes,
-              isOverloaded: totalMinutes > 480, // More than 8 hours
-              schedule: res.data
-            };
-          } catch {
-            return {
-              date: day,
-              dateStr: dayStr,
-              blocks: 0,
-              taskBlocks: 0,
-              totalMinutes: 0,
-              isOverloaded: false,
-              schedule: null
-            };
-          }
-        })
+      const res = await plannerApi.getScheduleRange(
+        format(weekStart, 'yyyy-MM-dd'),
+        format(weekEnd, 'yyyy-MM-dd')
+      );
+      const schedulesByDate = Object.fromEntries(
+        (res.data.schedules || []).map((s) => [s.iso_date, s])
       );
+
+      const weekData = days.map((day) => {
+        const dayStr = format(day, 'yyyy-MM-dd');
+        const schedule = schedulesByDate[dayStr] || null;
+        const blocks = schedule?.blocks || [];
+        const taskBlocks = blocks.filter(b => b.type === 'task');
+        const totalMinutes = taskBlocks.reduce((acc, b) => {
+          const [startH, startM] = b.start.split(':').map(Number);
+          const [endH, endM] = b.end.split(':').map(Number);
+          return acc + (endH * 60 + endM) - (startH * 60 + startM);
+        }, 0);
+
+        return {
+          date: day,
+          dateStr: dayStr,
+          blocks: blocks.length,
+          taskBlocks: taskBlocks.length,
+          totalMinutes,
+          isOverloaded: totalMinutes > 480, // More than 8 hours
+          schedule
+        };
+      });
       
       setWeeklyData(weekData);
       
@@ -303,7 +296,7 @@ const Planner = () => {
       const res = await plannerApi.generateSchedule({
         date: dateString,
         energy_level: energyLevel,
-        available_start: date.getHours + ':' + date.getMinutes,
+        available_start: isToday(selectedDate) ? format(new Date(), 'HH:mm') : '09:00',
         available_end: '22:00',
         include_breaks: true,
         pomodoro_style: true,
@@ -358,11 +351,16 @@ const Planner = () => {
 
   const handleDeleteBlock = async (blockId) => {
     try {
-      await plannerApi.deleteBlock(dateString, blockId);
+      await plannerApi.deleteBlock(dateString, blockId, schedule?.version);
       fetchSchedule();
       toast.success('Block removed');
     } catch (error) {
-      toast.error('Failed to remove block');
+      if (error.response?.status === 409) {
+        fetchSchedule();
+        toast.error('This day changed elsewhere, reloaded the latest schedule');
+      } else {
+        toast.error('Failed to remove block');
+      }
     }
   };
 